@@ -0,0 +1,358 @@
+"""
+Asyncio clients for the Gmail REST API and the Mistral chat completions API.
+
+Each client uses its upstream's pooled keep-alive `httpx.AsyncClient` from
+`http_pool`, so request handlers never block a threadpool worker on network
+I/O and repeat calls skip the TCP/TLS handshake. Outbound concurrency to each
+upstream is bounded by a semaphore.
+
+Every upstream call is timed into a histogram on /metrics: Gmail by API
+method and status (each attempt separately, so retries are visible), Mistral
+by operation and status, with time to first token for streams. Each call is
+also a client span in the current request's trace (see tracing.py).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from email.parser import Parser
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+from dotenv import load_dotenv
+
+from http_pool import HTTP_TIMEOUT, get_http_client, close_http_client
+from gmail_quota import GmailQuota, RetryPolicy, gmail_quota, default_retry_policy, is_rate_limited, is_retryable
+from metrics import registry
+from structured_log import get_logger
+from tracing import tracer, KIND_CLIENT
+
+# --- CONFIGURATION ---
+load_dotenv()
+
+GMAIL_API_URL = os.getenv("GMAIL_API_URL", "https://gmail.googleapis.com/")
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+
+GMAIL_MAX_CONCURRENCY = int(os.getenv("GMAIL_MAX_CONCURRENCY", "64"))
+MISTRAL_MAX_CONCURRENCY = int(os.getenv("MISTRAL_MAX_CONCURRENCY", "64"))
+
+_gmail_slots = asyncio.Semaphore(GMAIL_MAX_CONCURRENCY)
+_mistral_slots = asyncio.Semaphore(MISTRAL_MAX_CONCURRENCY)
+
+log = get_logger("clients")
+GMAIL_REQUEST_SECONDS = registry.histogram(
+    "gmail_request_duration_seconds", "Gmail API call latency per attempt, excluding quota waits.", ("method", "status"))
+MISTRAL_REQUEST_SECONDS = registry.histogram(
+    "mistral_request_duration_seconds", "Mistral chat completion latency, to the last token for streams.", ("operation", "status"))
+MISTRAL_FIRST_TOKEN_SECONDS = registry.histogram(
+    "mistral_first_token_seconds", "Time from sending a streaming completion to its first content token.")
+
+# --- GMAIL ---
+class GmailApiError(Exception):
+    """Raised when the Gmail API answers with a non-2xx status."""
+
+    def __init__(self, status_code: int, message: str, reason: Optional[str] = None, retry_after: Optional[float] = None):
+        super().__init__(f"Gmail API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, status_code: int, body: str, headers: Optional[Dict[str, str]] = None) -> "GmailApiError":
+        message, reason = body, None
+        try:
+            error = json.loads(body).get("error", {})
+            message = error.get("message", body)
+            errors = error.get("errors") or []
+            if errors:
+                reason = errors[0].get("reason")
+        except (ValueError, AttributeError):
+            pass
+        retry_after = None
+        try:
+            retry_after = float(headers.get("retry-after")) if headers and headers.get("retry-after") else None
+        except ValueError:
+            pass  # HTTP-date form; fall back to computed backoff
+        return cls(status_code, message, reason, retry_after)
+
+
+class AsyncGmailClient:
+    """
+    Minimal async client for the `users/me` Gmail resources the backend uses.
+
+    Every call is charged to `user_key`'s quota bucket before it is sent and
+    retried with backoff when Gmail rate-limits it (see `gmail_quota`).
+    """
+
+    BATCH_PATH = "batch/gmail/v1"
+    USER_PATH = "gmail/v1/users/me/"
+
+    def __init__(self, access_token: str, base_url: str = GMAIL_API_URL, http: Optional[httpx.AsyncClient] = None,
+                 user_key: Optional[str] = None, quota: Optional[GmailQuota] = None, retry_policy: Optional[RetryPolicy] = None):
+        self.access_token = access_token
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self._http = http
+        self.user_key = user_key or hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+        self.quota = quota or gmail_quota
+        self.retry_policy = retry_policy or default_retry_policy
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http or get_http_client("gmail")
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    async def _backoff(self, error: GmailApiError, attempt: int, idempotent: bool = True) -> bool:
+        """Sleeps before a retry and returns True, or returns False if `error` should be raised."""
+        rate_limited = is_rate_limited(error.status_code, error.reason)
+        if attempt >= self.retry_policy.max_retries or not is_retryable(error.status_code, error.reason):
+            return False
+        if not rate_limited and not idempotent:
+            return False  # a 5xx on send may still have delivered the message
+        if rate_limited:
+            self.quota.record_rate_limited(self.user_key, error.retry_after)
+        self.quota.record_retry(self.user_key)
+        delay = self.retry_policy.delay(attempt, error.retry_after)
+        log.warning("gmail_retry", status=error.status_code, reason=error.reason, attempt=attempt + 1, delay=round(delay, 2))
+        await asyncio.sleep(delay)
+        return True
+
+    async def request(self, method: str, path: str, params: Optional[Dict] = None, json_body: Optional[Dict] = None,
+                      api_method: str = "messages.get", idempotent: bool = True) -> Dict:
+        """Sends one REST call below `users/me/` and returns the decoded JSON body."""
+        attempt = 0
+        while True:
+            with tracer.span(f"gmail {api_method}", KIND_CLIENT, **{"gmail.method": api_method, "retry.attempt": attempt}) as span:
+                span.set_attribute("gmail.quota_wait_s", await self.quota.acquire(self.user_key, api_method))
+                async with _gmail_slots:
+                    start, status = time.perf_counter(), "error"
+                    try:
+                        resp = await self.http.request(
+                            method, self.base_url + self.USER_PATH + path, params=params, json=json_body, headers=self.headers
+                        )
+                        status = str(resp.status_code)
+                    finally:
+                        GMAIL_REQUEST_SECONDS.observe(time.perf_counter() - start, api_method, status)
+                span.set_attribute("http.status_code", resp.status_code)
+                if resp.status_code >= 400:
+                    span.set_error(f"HTTP {resp.status_code}")
+            if resp.status_code < 300:
+                return resp.json() if resp.content else {}
+            error = GmailApiError.from_response(resp.status_code, resp.text, resp.headers)
+            if not await self._backoff(error, attempt, idempotent):
+                raise error
+            attempt += 1
+
+    async def get_profile(self) -> Dict:
+        return await self.request("GET", "profile", api_method="getProfile")
+
+    async def list_messages(self, **params) -> Dict:
+        return await self.request("GET", "messages", params=params, api_method="messages.list")
+
+    async def list_history(self, **params) -> Dict:
+        return await self.request("GET", "history", params=params, api_method="history.list")
+
+    async def get_message(self, message_id: str, **params) -> Dict:
+        return await self.request("GET", f"messages/{message_id}", params=params, api_method="messages.get")
+
+    async def get_thread(self, thread_id: str, **params) -> Dict:
+        return await self.request("GET", f"threads/{thread_id}", params=params, api_method="threads.get")
+
+    async def trash_message(self, message_id: str) -> Dict:
+        return await self.request("POST", f"messages/{message_id}/trash", api_method="messages.trash")
+
+    async def send_message(self, body: Dict) -> Dict:
+        return await self.request("POST", "messages/send", json_body=body, api_method="messages.send", idempotent=False)
+
+    async def batch_modify(self, message_ids: List[str], add_label_ids: List[str] = (), remove_label_ids: List[str] = ()) -> Dict:
+        """Changes labels on up to 1000 messages in one call."""
+        body = {"ids": list(message_ids), "addLabelIds": list(add_label_ids), "removeLabelIds": list(remove_label_ids)}
+        return await self.request("POST", "messages/batchModify", json_body=body, api_method="messages.batchModify")
+
+    async def batch_get_messages(self, message_ids: List[str], **params) -> Tuple[Dict[str, Dict], Dict[str, GmailApiError]]:
+        """
+        Fetches up to 100 messages in a single multipart/mixed batch request.
+        Sub-requests that were rate-limited are retried in a smaller batch.
+        Returns (fetched, failed), both keyed by message ID.
+        """
+        fetched, failed = {}, {}
+        pending, attempt = list(message_ids), 0
+        while pending:
+            try:
+                with tracer.span("gmail batch", KIND_CLIENT, **{"gmail.method": "messages.get", "batch.size": len(pending),
+                                                               "retry.attempt": attempt}) as span:
+                    span.set_attribute("gmail.quota_wait_s", await self.quota.acquire(self.user_key, "messages.get", len(pending)))
+                    batch_fetched, batch_failed = await self._send_batch(pending, params)
+                    span.set_attribute("batch.failed", len(batch_failed))
+            except GmailApiError as error:
+                if not await self._backoff(error, attempt):
+                    raise
+                attempt += 1
+                continue
+            fetched.update(batch_fetched)
+            retry = {mid: e for mid, e in batch_failed.items() if is_retryable(e.status_code, e.reason)}
+            failed.update({mid: e for mid, e in batch_failed.items() if mid not in retry})
+            pending = []
+            if retry:
+                # Back off by the longest Retry-After any sub-request asked for
+                error = max(retry.values(), key=lambda e: e.retry_after or 0)
+                if await self._backoff(error, attempt):
+                    attempt += 1
+                    pending = list(retry)
+                else:
+                    failed.update(retry)
+        return fetched, failed
+
+    async def _send_batch(self, message_ids: List[str], params: Dict) -> Tuple[Dict[str, Dict], Dict[str, GmailApiError]]:
+        boundary = f"batch_{uuid.uuid4().hex}"
+        query = urlencode(params, doseq=True)
+        parts = []
+        for index, message_id in enumerate(message_ids):
+            target = f"/{self.USER_PATH}messages/{message_id}" + (f"?{query}" if query else "")
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <item-{index}>\r\n\r\n"
+                f"GET {target} HTTP/1.1\r\n\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+
+        async with _gmail_slots:
+            start, status = time.perf_counter(), "error"
+            try:
+                resp = await self.http.post(
+                    self.base_url + self.BATCH_PATH,
+                    content="".join(parts).encode("utf-8"),
+                    headers={**self.headers, "Content-Type": f"multipart/mixed; boundary={boundary}"},
+                )
+                status = str(resp.status_code)
+            finally:
+                GMAIL_REQUEST_SECONDS.observe(time.perf_counter() - start, "batch", status)
+        if resp.status_code >= 300:
+            raise GmailApiError.from_response(resp.status_code, resp.text, resp.headers)
+
+        fetched, failed = {}, {}
+        envelope = Parser().parsestr(f"Content-Type: {resp.headers['content-type']}\r\n\r\n" + resp.text)
+        for part in envelope.get_payload():
+            content_id = (part["Content-ID"] or "").strip("<>")
+            index = int(content_id.rsplit("-", 1)[-1])
+            status, headers, body = _parse_http_part(part.get_payload())
+            if status >= 300:
+                failed[message_ids[index]] = GmailApiError.from_response(status, body, headers)
+            else:
+                fetched[message_ids[index]] = json.loads(body)
+        return fetched, failed
+
+    async def get_messages_batched(self, message_ids: List[str], chunk_size: int, **params) -> Tuple[Dict[str, Dict], Dict[str, GmailApiError]]:
+        """Splits `message_ids` into batch requests of `chunk_size` and runs them concurrently."""
+        chunks = [message_ids[i:i + chunk_size] for i in range(0, len(message_ids), chunk_size)]
+        fetched, failed = {}, {}
+        for chunk_fetched, chunk_failed in await asyncio.gather(
+            *(self.batch_get_messages(chunk, **params) for chunk in chunks)
+        ):
+            fetched.update(chunk_fetched)
+            failed.update(chunk_failed)
+        return fetched, failed
+
+
+def _parse_http_part(payload: str) -> Tuple[int, Dict[str, str], str]:
+    """Splits an application/http batch part into status, headers and body."""
+    payload = payload.replace("\r\n", "\n")
+    head, _, body = payload.partition("\n\n")
+    status_line, *header_lines = head.split("\n")
+    status = int(status_line.split(" ", 2)[1])
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers, body.strip()
+
+# --- MISTRAL ---
+class MistralApiError(Exception):
+    """Raised when the Mistral API answers a streaming request with a non-2xx status."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Mistral API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class AsyncMistralClient:
+    """Async client for the Mistral chat completions endpoint."""
+
+    def __init__(self, api_key: str, endpoint: str = MISTRAL_API_URL, http: Optional[httpx.AsyncClient] = None):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self._http = http
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http or get_http_client("mistral")
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    async def chat(self, payload: Dict, timeout: float = HTTP_TIMEOUT) -> httpx.Response:
+        with tracer.span("mistral chat", KIND_CLIENT, **{"llm.model": payload.get("model"),
+                                                         "llm.max_tokens": payload.get("max_tokens")}) as span:
+            async with _mistral_slots:
+                start = time.perf_counter()
+                status = "error"
+                try:
+                    resp = await self.http.post(self.endpoint, headers=self.headers, json=payload, timeout=timeout)
+                    status = str(resp.status_code)
+                    span.set_attribute("http.status_code", resp.status_code)
+                    return resp
+                finally:
+                    MISTRAL_REQUEST_SECONDS.observe(time.perf_counter() - start, "chat", status)
+
+    async def stream_chat(self, payload: Dict, timeout: float = HTTP_TIMEOUT) -> AsyncIterator[str]:
+        """
+        Sends the payload with `stream: true` and yields content deltas as they arrive.
+        Closing the generator early closes the upstream connection, which cancels generation.
+        """
+        # Not made current: the generator's body runs in its consumer's context between yields
+        span = tracer.start_span("mistral stream", KIND_CLIENT, **{"llm.model": payload.get("model"),
+                                                                    "llm.max_tokens": payload.get("max_tokens")})
+        async with _mistral_slots:
+            request = {**payload, "stream": True}
+            start, first_token, status, tokens = time.perf_counter(), True, "error", 0
+            try:
+                async with self.http.stream("POST", self.endpoint, headers=self.headers, json=request, timeout=timeout) as resp:
+                    status = str(resp.status_code)
+                    span.set_attribute("http.status_code", resp.status_code)
+                    if resp.status_code != 200:
+                        body = (await resp.aread()).decode("utf-8", "replace")
+                        span.set_error(MistralApiError(resp.status_code, body))
+                        raise MistralApiError(resp.status_code, body)
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            return
+                        try:
+                            chunk = json.loads(data)
+                        except ValueError:
+                            continue
+                        for choice in chunk.get("choices") or []:
+                            delta = choice.get("delta") or {}
+                            if delta.get("content"):
+                                if first_token:
+                                    MISTRAL_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                                    span.add_event("first_token")
+                                    first_token = False
+                                tokens += 1
+                                yield delta["content"]
+            finally:
+                # Also reached when the consumer closes the stream early (status stays 200)
+                MISTRAL_REQUEST_SECONDS.observe(time.perf_counter() - start, "stream", status)
+                span.set_attribute("llm.deltas", tokens)
+                span.end()
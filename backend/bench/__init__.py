@@ -0,0 +1 @@
+"""Local stand-ins and benchmarks for the email assistant backend."""
@@ -0,0 +1,88 @@
+"""
+Benchmark: drafting replies for a morning inbox.
+
+Drafts replies for `--emails` distinct emails against a fake Mistral, either
+one `/emails/generate-reply` call after another (what the frontend did) or in a
+single streamed `/emails/generate-replies` batch. For the batch it reports
+time to first draft and total time. A final round sets a per-item timeout
+shorter than the upstream latency and checks that every draft reports a timeout
+instead of hanging the batch.
+
+Run from the backend directory:
+    python -m bench.bench_batch_drafts --emails 30 --concurrency 30
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import BackendProcess
+
+
+def inbox(count: int):
+    # Distinct contents, so neither mode is served from the reply cache
+    return [f"Hi, could you confirm the agenda for meeting #{i} on Thursday? Thanks" for i in range(count)]
+
+
+async def sequential(client: httpx.AsyncClient, contents):
+    start = time.perf_counter()
+    for content in contents:
+        resp = await client.post("/emails/generate-reply", params={"refresh": True}, json={"content": content})
+        resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def batch(client: httpx.AsyncClient, contents, concurrency: int, timeout=None):
+    start = time.perf_counter()
+    first_draft, statuses, event = None, {}, None
+    body = {"contents": contents, "concurrency": concurrency, "timeout": timeout, "refresh": True}
+    async with client.stream("POST", "/emails/generate-replies", params={"stream": True}, json=body) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "draft":
+                if first_draft is None:
+                    first_draft = time.perf_counter() - start
+                status = json.loads(line[len("data: "):])["status"]
+                statuses[status] = statuses.get(status, 0) + 1
+    return first_draft, time.perf_counter() - start, statuses
+
+
+async def run(args):
+    mistral = FakeMistralServer(latency=args.mistral_latency, tokens_per_second=args.tokens_per_second,
+                                reply_tokens=args.reply_tokens).start()
+    backend = BackendProcess({"MISTRAL_API_KEY": "bench-key", "MISTRAL_API_URL": mistral.endpoint,
+                              "PREFETCH_ENABLED": "0"}).start()
+    contents = inbox(args.emails)
+    try:
+        async with httpx.AsyncClient(base_url=backend.base_url, timeout=300) as client:
+            print(f"{args.emails} emails, one draft takes ~{(args.mistral_latency + args.reply_tokens / args.tokens_per_second) * 1000:.0f}ms upstream")
+            print(f"{'mode':>12} {'first_ms':>9} {'total_ms':>9}  statuses")
+            total = await sequential(client, contents)
+            print(f"{'sequential':>12} {'-':>9} {total * 1000:>9.0f}  ok={args.emails}")
+            first, total, statuses = await batch(client, contents, args.concurrency)
+            print(f"{'batch':>12} {first * 1000:>9.0f} {total * 1000:>9.0f}  {statuses}")
+            first, total, statuses = await batch(client, contents, args.concurrency, timeout=args.mistral_latency / 2)
+            print(f"{'batch+timeout':>12} {first * 1000:>9.0f} {total * 1000:>9.0f}  {statuses}")
+    finally:
+        backend.stop()
+        mistral.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--mistral-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark: serial `messages.get` loop vs. `fetch_messages_batched`.
+
+Run from the backend directory:
+    python -m bench.bench_batch_fetch --latency 0.03 --sizes 5 10 25 50 100
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from async_clients import AsyncGmailClient, close_http_client
+from bench.fake_gmail import FakeGmailServer
+from gmail_quota import GmailQuota
+from main_new import fetch_messages_batched
+
+# The fake does not meter quota here; measure transport cost only
+UNMETERED = GmailQuota(enabled=False)
+
+
+async def fetch_serial(service, message_ids):
+    return [await service.get_message(msg_id) for msg_id in message_ids]
+
+
+async def time_call(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+async def run(args):
+    server = FakeGmailServer(mailbox_size=max(args.sizes), latency=args.latency).start()
+    try:
+        service = AsyncGmailClient("fake-token", base_url=server.base_url, quota=UNMETERED)
+        print(f"latency={args.latency * 1000:.0f}ms chunk_size={args.chunk_size}")
+        print(f"{'max_results':>11} {'serial_ms':>10} {'batched_ms':>11} {'speedup':>8}")
+        for size in args.sizes:
+            listed = await service.list_messages(labelIds=['INBOX'], maxResults=size)
+            ids = [m['id'] for m in listed.get('messages', [])]
+            serial = await time_call(lambda: fetch_serial(service, ids), args.repeat)
+            batched = await time_call(lambda: fetch_messages_batched(service, ids, chunk_size=args.chunk_size), args.repeat)
+            print(f"{size:>11} {serial * 1000:>10.1f} {batched * 1000:>11.1f} {serial / batched:>7.1f}x")
+    finally:
+        await close_http_client()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.03, help="simulated round-trip latency in seconds")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 10, 25, 50, 100])
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
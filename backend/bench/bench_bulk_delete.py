@@ -0,0 +1,71 @@
+"""
+Benchmark: trashing every email from one sender, one call per message vs. batchModify.
+
+The "per_message" path is what the chatbot did before: `messages.trash`
+once per message (run with the same concurrency cap the client allows).
+The "batch_modify" path resolves IDs with paginated `messages.list` and
+trashes them with `batchModify` in chunks of 1000.
+
+Run from the backend directory:
+    python -m bench.bench_bulk_delete --mailbox-size 6000 --sender newsletter@company.com
+"""
+import argparse
+import asyncio
+import time
+
+from async_clients import AsyncGmailClient, close_http_client
+from bench.fake_gmail import FakeGmailServer
+from gmail_quota import GmailQuota
+from main_new import bulk_trash, list_matching_ids
+
+USER_ID = "bench_user"
+# The fake does not meter quota here; measure transport cost only
+UNMETERED = GmailQuota(enabled=False)
+
+
+async def per_message(service: AsyncGmailClient, query: str):
+    message_ids = await list_matching_ids(service, query)
+    await asyncio.gather(*(service.trash_message(message_id) for message_id in message_ids))
+    return len(message_ids)
+
+
+async def batched(service: AsyncGmailClient, query: str):
+    message_ids = await list_matching_ids(service, query)
+    done = 0
+    async for progress in bulk_trash(USER_ID, service, message_ids):
+        done = progress["done"]
+    return done
+
+
+async def run(args):
+    query = f"from:{args.sender}"
+    print(f"{'method':>13} {'trashed':>8} {'seconds':>8} {'api_calls':>9}")
+    try:
+        for name, fn in (("per_message", per_message), ("batch_modify", batched)):
+            server = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.latency).start()
+            try:
+                service = AsyncGmailClient("fake-token", base_url=server.base_url, quota=UNMETERED)
+                start = time.perf_counter()
+                trashed = await fn(service, query)
+                elapsed = time.perf_counter() - start
+                remaining = sum(1 for m in server.mailbox.messages
+                                if "INBOX" in m["labelIds"] and server.mailbox.matches(m, {"q": [query]}))
+                calls = sum(server.app.request_counts.values())
+                print(f"{name:>13} {trashed:>8} {elapsed:>8.2f} {calls:>9}" + ("" if remaining == 0 else f"  ({remaining} left in inbox!)"))
+            finally:
+                server.stop()
+    finally:
+        await close_http_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mailbox-size", type=int, default=6000)
+    parser.add_argument("--sender", default="newsletter@company.com")
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
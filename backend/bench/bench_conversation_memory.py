@@ -0,0 +1,125 @@
+"""
+Benchmark: chatbot conversation memory per user.
+
+Simulates `--users` users each sending `--turns` chatbot turns (a command, a
+reply, and an action on every third reply). The turns go into three
+implementations:
+
+  legacy  per-user lists of dicts trimmed with slice copies, as main_new.py
+          kept them before (kept below as `LegacyConversations`)
+  state   the shared state-store path (`SharedConversationStore` over an
+          in-memory state store)
+  deque   `InMemoryConversationStore`: deques of __slots__ records
+
+For each, the benchmark reports bytes per user (from tracemalloc) and the
+time per turn. Each turn appends a message, renders the 3-message prompt
+context, and reads the last action. It also reports the time per repeated
+context read with no append in between, as when a batch drafts many replies
+for one user.
+
+Run from the backend directory:
+    python -m bench.bench_conversation_memory --users 5000 --turns 40
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from conversation_store import CONVERSATION_MAX_MESSAGES, InMemoryConversationStore, SharedConversationStore
+from state_store import InMemoryStateStore
+
+COMMANDS = ["show my emails", "delete the second one", "reply to the first email", "what did you do", "search for invoices"]
+ACTIONS = ["fetch_emails", "delete_email", "generate_reply"]
+
+
+class LegacyConversations:
+    """The conversation helpers main_new.py used before conversation_store."""
+
+    def __init__(self):
+        self.memory = {}
+
+    def append(self, user_id, role, content, action_taken=None):
+        if user_id not in self.memory:
+            self.memory[user_id] = []
+        self.memory[user_id].append({
+            "role": role, "content": content, "timestamp": datetime.now().isoformat(), "action_taken": action_taken,
+        })
+        if len(self.memory[user_id]) > CONVERSATION_MAX_MESSAGES:
+            self.memory[user_id] = self.memory[user_id][-CONVERSATION_MAX_MESSAGES:]
+
+    def context(self, user_id, last_n=5):
+        if user_id not in self.memory:
+            return ""
+        context_str = "Recent conversation:\n"
+        for msg in self.memory[user_id][-last_n:]:
+            context_str += f"{msg['role']}: {msg['content']}\n"
+        return context_str
+
+    def last_action(self, user_id):
+        for msg in reversed(self.memory.get(user_id, [])):
+            if msg.get("action_taken"):
+                return msg["action_taken"]
+        return None
+
+
+def simulate(store, users: int, turns: int) -> float:
+    """Runs every user's turns, returning seconds per turn."""
+    start = time.perf_counter()
+    for turn in range(turns):
+        command = COMMANDS[turn % len(COMMANDS)]
+        action = ACTIONS[turn % len(ACTIONS)] if turn % 3 == 0 else None
+        for user in range(users):
+            user_id = f"user{user}@example.com"
+            store.append(user_id, "user", command)
+            store.context(user_id, 3)
+            store.last_action(user_id)
+            store.append(user_id, "assistant", f"Done: {command} (turn {turn})", action)
+    return (time.perf_counter() - start) / (users * turns)
+
+
+def context_reads(store, users: int, reads: int = 10) -> float:
+    start = time.perf_counter()
+    for user in range(users):
+        user_id = f"user{user}@example.com"
+        for _ in range(reads):
+            store.context(user_id, 3)
+    return (time.perf_counter() - start) / (users * reads)
+
+
+def bytes_per_user(make_store, users: int, turns: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    store = make_store()
+    simulate(store, users, turns)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=40)
+    args = parser.parse_args()
+
+    stores = (
+        ("legacy", LegacyConversations),
+        ("state", lambda: SharedConversationStore(InMemoryStateStore())),
+        ("deque", InMemoryConversationStore),
+    )
+    print(f"{args.users} users, {args.turns} turns each ({CONVERSATION_MAX_MESSAGES} messages kept per user)")
+    print(f"{'store':>7} {'bytes/user':>11} {'bytes/user@' + str(args.turns * 4):>14} {'us/turn':>8} {'us/context':>10}")
+    for name, make_store in stores:
+        store = make_store()
+        per_turn = simulate(store, args.users, args.turns)  # timed without tracemalloc overhead
+        per_read = context_reads(store, args.users)
+        memory = bytes_per_user(make_store, args.users, args.turns)
+        # Four times the turns: memory should not grow once histories are full
+        longer = bytes_per_user(make_store, args.users // 4 or 1, args.turns * 4)
+        print(f"{name:>7} {memory:>11.0f} {longer:>14.0f} {per_turn * 1e6:>8.2f} {per_read * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
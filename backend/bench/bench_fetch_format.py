@@ -0,0 +1,58 @@
+"""
+Benchmark: summary fetch with `format=full` vs. `format=metadata`.
+
+Run from the backend directory:
+    python -m bench.bench_fetch_format --attachment-bytes 500000 --max-results 25
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from async_clients import AsyncGmailClient, close_http_client
+from bench.fake_gmail import FakeGmailServer
+from gmail_quota import GmailQuota
+from main_new import fetch_messages_batched, summary_fetch_kwargs
+
+# The fake does not meter quota here; measure transport cost only
+UNMETERED = GmailQuota(enabled=False)
+
+
+async def run(args):
+    server = FakeGmailServer(
+        mailbox_size=args.max_results, latency=args.latency, attachment_bytes=args.attachment_bytes
+    ).start()
+    try:
+        service = AsyncGmailClient("fake-token", base_url=server.base_url, quota=UNMETERED)
+        listed = await service.list_messages(maxResults=args.max_results)
+        ids = [m['id'] for m in listed.get('messages', [])]
+
+        print(f"messages={len(ids)} attachment_bytes={args.attachment_bytes} latency={args.latency * 1000:.0f}ms")
+        print(f"{'format':>9} {'median_ms':>10} {'payload_kb':>11}")
+        for fetch_format in ('full', 'metadata'):
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                fetched = await fetch_messages_batched(service, ids, **summary_fetch_kwargs(fetch_format))
+                samples.append(time.perf_counter() - start)
+            payload_kb = sum(len(json.dumps(m)) for m in fetched) / 1024
+            print(f"{fetch_format:>9} {statistics.median(samples) * 1000:>10.1f} {payload_kb:>11.1f}")
+    finally:
+        await close_http_client()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.03)
+    parser.add_argument("--attachment-bytes", type=int, default=500_000)
+    parser.add_argument("--max-results", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: repeat inbox loads with a full re-list vs. history-based sync.
+
+Each round optionally delivers new mail and trashes a message, then loads
+the newest `--max-results` inbox messages both ways and checks that the
+synced view matches the fake mailbox.
+
+Run from the backend directory:
+    python -m bench.bench_incremental_sync --rounds 5 --max-results 50
+"""
+import argparse
+import asyncio
+import time
+
+from async_clients import AsyncGmailClient, close_http_client
+from bench.fake_gmail import FakeGmailServer
+from gmail_quota import GmailQuota
+from mailbox_sync import MailboxSync
+from main_new import fetch_message_summaries
+from message_store import InMemoryMessageStore
+
+USER_ID = "bench_user"
+# The fake does not meter quota here; measure transport cost only
+UNMETERED = GmailQuota(enabled=False)
+
+
+async def relist(service: AsyncGmailClient, max_results: int):
+    results = await service.list_messages(labelIds=['INBOX'], maxResults=max_results)
+    return await fetch_message_summaries(service, [m['id'] for m in results.get('messages', [])])
+
+
+def expected_inbox(server: FakeGmailServer, max_results: int):
+    return [m["id"] for m in server.mailbox.messages if "INBOX" in m["labelIds"]][:max_results]
+
+
+async def run(args):
+    server = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.latency).start()
+    store = InMemoryMessageStore()
+    sync = MailboxSync(store, fetch_message_summaries)
+    try:
+        service = AsyncGmailClient("fake-token", base_url=server.base_url, quota=UNMETERED)
+        print(f"{'round':>5} {'change':>14} {'relist_ms':>10} {'sync_ms':>8} {'sync_result':<48} {'match':>5}")
+        for round_no in range(args.rounds):
+            change = "none"
+            if round_no == args.rounds - 1 and args.expire_last:
+                server.mailbox.expire_history()
+                change = "history expired"
+            elif round_no > 0 and round_no % 2 == 0:
+                server.mailbox.deliver(args.new_per_round)
+                victim = server.mailbox.messages[args.new_per_round + 1]
+                await service.trash_message(victim["id"])
+                change = f"+{args.new_per_round} new, 1 trash"
+
+            start = time.perf_counter()
+            await relist(service, args.max_results)
+            relist_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            result = await sync.sync(USER_ID, service, min_messages=args.max_results)
+            sync_ms = (time.perf_counter() - start) * 1000
+
+            synced = [m["id"] for m in store.list_by_label(USER_ID, "INBOX", limit=args.max_results)]
+            match = synced == expected_inbox(server, args.max_results)
+            print(f"{round_no:>5} {change:>14} {relist_ms:>10.1f} {sync_ms:>8.1f} {str(result):<48} {str(match):>5}")
+    finally:
+        await close_http_client()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mailbox-size", type=int, default=500)
+    parser.add_argument("--max-results", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.03)
+    parser.add_argument("--rounds", type=int, default=6)
+    parser.add_argument("--new-per-round", type=int, default=3)
+    parser.add_argument("--expire-last", action="store_true", default=True)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: intent matching speed and accuracy on a labelled command corpus.
+
+Compares the precompiled single-pass matcher in `intent_matcher` with the
+previous per-call keyword/regex implementation (kept below as `legacy_detect`).
+Accuracy counts a command as correct when the intent and every labelled
+entity in `intent_corpus.jsonl` match.
+
+Run from the backend directory:
+    python -m bench.bench_intent --repeat 200
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+from intent_matcher import match_command
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "intent_corpus.jsonl")
+
+
+def legacy_detect(command: str):
+    """The matcher `detect_intent_and_entities` used before, for comparison."""
+    command_lower = command.lower().strip()
+    intents = {
+        "greet": ["hello", "hi", "hey", "greetings", "good morning", "good afternoon"],
+        "help": ["help", "what can you do", "commands", "how to", "guide", "explain"],
+        "fetch_emails": ["fetch", "read", "get", "show", "display", "list", "check", "see"],
+        "delete_email": ["delete", "remove", "trash", "get rid of"],
+        "generate_reply": ["reply", "respond", "answer", "draft", "compose"],
+        "send_email": ["send", "deliver", "dispatch"],
+        "search_email": ["search", "find", "look for", "locate"],
+        "status": ["status", "what did you do", "last action", "what happened"],
+    }
+    detected_intent = "unknown"
+    confidence = 0.0
+    for intent, keywords in intents.items():
+        matches = sum(1 for keyword in keywords if keyword in command_lower)
+        if matches > 0:
+            current_confidence = matches / len(keywords)
+            if current_confidence > confidence:
+                confidence = current_confidence
+                detected_intent = intent
+
+    entities = {"sender": None, "subject": None, "count": 5, "email_reference": None, "time_reference": None}
+    sender_match = re.search(r'from\s+([\w.@\s-]+)', command_lower)
+    if sender_match:
+        entities["sender"] = sender_match.group(1).strip()
+    subject_match = re.search(r'(about|subject|regarding)\s+["\']?([^"\']+)["\']?', command_lower)
+    if subject_match:
+        entities["subject"] = subject_match.group(2).strip()
+    count_match = re.search(r'(\d+|last|latest|recent)', command_lower)
+    if count_match and count_match.group(1).isdigit():
+        entities["count"] = int(count_match.group(1))
+    if any(word in command_lower for word in ['this', 'that', 'it', 'the email', 'that email']):
+        entities["email_reference"] = "contextual"
+    elif any(word in command_lower for word in ['first', 'second', 'third', 'last', 'latest']):
+        entities["email_reference"] = command_lower
+    return {"intent": detected_intent, "confidence": confidence, "entities": entities, "original_command": command}
+
+
+def load_corpus(path: str = CORPUS_PATH):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(fn, corpus):
+    """Returns (intent accuracy, full accuracy, misses)."""
+    intent_ok = full_ok = 0
+    misses = []
+    for case in corpus:
+        result = fn(case["command"])
+        intent_match = result["intent"] == case["intent"]
+        entity_match = all(result["entities"].get(key) == value for key, value in case.get("entities", {}).items())
+        intent_ok += intent_match
+        full_ok += intent_match and entity_match
+        if not (intent_match and entity_match):
+            misses.append((case["command"], result["intent"], case["intent"]))
+    return intent_ok / len(corpus), full_ok / len(corpus), misses
+
+
+def time_calls(fn, commands, repeat: int) -> float:
+    """Mean microseconds per command."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for command in commands:
+            fn(command)
+    return (time.perf_counter() - start) / (repeat * len(commands)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--show-misses", action="store_true")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    commands = [case["command"] for case in corpus]
+    print(f"{len(corpus)} labelled commands")
+    print(f"{'matcher':>12} {'us/call':>8} {'intent_acc':>10} {'full_acc':>8}")
+    for name, fn in (("legacy", legacy_detect), ("precompiled", match_command)):
+        intent_acc, full_acc, misses = evaluate(fn, corpus)
+        us = time_calls(fn, commands, args.repeat)
+        print(f"{name:>12} {us:>8.2f} {intent_acc:>10.1%} {full_acc:>8.1%}")
+        if args.show_misses:
+            for command, got, expected in misses:
+                print(f"{'':>14}{command!r}: got {got}, expected {expected}")
+
+
+if __name__ == "__main__":
+    main()
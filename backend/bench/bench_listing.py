@@ -0,0 +1,91 @@
+"""
+Benchmark: listing a large mailbox all at once vs. NDJSON streaming.
+
+"single_shot" follows every `messages.list` page, fetches all summaries and
+serialises one JSON array, which is what a non-paginated endpoint has to do.
+"ndjson_stream" consumes `stream_email_summaries` line by line. Reports time
+to first item, total time and peak Python heap (tracemalloc) for each.
+
+Run from the backend directory:
+    python -m bench.bench_listing --mailbox-size 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+# Keep the bench's message store out of the working directory
+os.environ.setdefault("MESSAGE_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="email-bench-"), "store.sqlite3"))
+
+from async_clients import AsyncGmailClient, close_http_client
+from bench.fake_gmail import FakeGmailServer
+from gmail_quota import GmailQuota
+from main_new import LISTING_PAGE_LIMIT, fetch_message_summaries, listing_params, stream_email_summaries
+
+USER_ID = "bench_user"
+# The fake does not meter quota here; measure transport cost only
+UNMETERED = GmailQuota(enabled=False)
+
+
+async def single_shot(service: AsyncGmailClient, page_size: int):
+    message_ids, page_token = [], None
+    while True:
+        results = await service.list_messages(**listing_params("INBOX", None, page_size, page_token))
+        message_ids.extend(m["id"] for m in results.get("messages", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+    summaries = await fetch_message_summaries(service, message_ids)
+    body = json.dumps(summaries)
+    yield len(summaries), len(body)
+
+
+async def ndjson_stream(service: AsyncGmailClient, page_size: int):
+    async for line in stream_email_summaries(USER_ID, service, "INBOX", None, page_size, None, None):
+        if line.startswith('{"type": "email"'):
+            yield 1, len(line)
+
+
+async def measure(fn, service: AsyncGmailClient, page_size: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_item = None
+    items = size = 0
+    async for count, nbytes in fn(service, page_size):
+        if first_item is None:
+            first_item = time.perf_counter() - start
+        items += count
+        size += nbytes
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first_item, total, peak, items, size
+
+
+async def run(args):
+    server = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.latency, per_item_cost=0).start()
+    try:
+        service = AsyncGmailClient("fake-token", base_url=server.base_url, quota=UNMETERED)
+        print(f"{'method':>14} {'items':>7} {'first_item_ms':>13} {'total_s':>8} {'peak_heap_mb':>12} {'bytes_mb':>8}")
+        for name, fn in (("single_shot", single_shot), ("ndjson_stream", ndjson_stream)):
+            first_item, total, peak, items, size = await measure(fn, service, args.page_size)
+            print(f"{name:>14} {items:>7} {first_item * 1000:>13.0f} {total:>8.2f} {peak / 2**20:>12.1f} {size / 2**20:>8.1f}")
+    finally:
+        await close_http_client()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mailbox-size", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=LISTING_PAGE_LIMIT)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark: process memory as the number of users grows, with and without the memory governor.
+
+Each simulated user syncs `--messages` message summaries into the in-memory
+message store, is shown a context list of 10 emails, has `--turns` chatbot
+turns, and has `--threads` threads cached for reply drafting. This is what
+one active user leaves behind in a single-process backend.
+
+The users are run through the same stores twice:
+
+  unbounded  no governor: every user's data stays until restart (the old behaviour)
+  governed   one MemoryGovernor with a `--budget-mb` budget across all the caches
+
+For each user count the benchmark reports the memory traced by tracemalloc,
+the bytes the governor accounted for, and its evictions. It also reports the
+time per simulated user, so the cost of the size accounting is visible.
+
+Run from the backend directory:
+    python -m bench.bench_memory_governor --users 500 1000 2000 4000 --budget-mb 16
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from conversation_store import InMemoryConversationStore
+from memory_governor import MemoryGovernor
+from message_store import InMemoryMessageStore
+from thread_cache import ThreadCache
+
+WORDS = ("invoice meeting budget report review project timeline deck friday numbers "
+         "please confirm attached next week board quarterly update").split()
+
+
+def sentence(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def summaries(rng: random.Random, user: int, count: int):
+    return [{
+        "id": f"m{user}-{i}",
+        "thread_id": f"t{user}-{i % 50}",
+        "sender": f"Sender {i} <sender{i}@example.com>",
+        "subject": sentence(rng, 6),
+        "snippet": sentence(rng, 25),
+        "date": "Mon, 13 Nov 2023 10:00:00 +0000",
+        "internal_date": str(1700000000000 + i),
+        "label_ids": ["INBOX", "UNREAD"],
+    } for i in range(count)]
+
+
+def thread(rng: random.Random, user: int, index: int):
+    return {"id": f"t{user}-{index}", "history_id": "1", "messages": [{
+        "id": f"m{user}-{index}-{j}", "sender": "Sender <sender@example.com>", "to": "me@example.com",
+        "subject": sentence(rng, 6), "date": "Mon, 13 Nov 2023 10:00:00 +0000",
+        "message_id": f"<m{user}-{index}-{j}@example.com>", "references": "", "snippet": sentence(rng, 40),
+    } for j in range(4)]}
+
+
+def simulate(governor, users: int, args) -> dict:
+    rng = random.Random(7)
+    conversations = InMemoryConversationStore(governor=governor)
+    messages = InMemoryMessageStore(governor)
+    threads = ThreadCache(max_entries=10 ** 9, governor=governor)
+    start = time.perf_counter()
+    for user in range(users):
+        user_id = f"user{user}@example.com"
+        records = summaries(rng, user, args.messages)
+        messages.upsert(user_id, records)
+        messages.set_state(user_id, "12345", True)
+        messages.set_context(user_id, records[:10])
+        for turn in range(args.turns):
+            conversations.append(user_id, "user", sentence(rng, 8))
+            conversations.context(user_id, 3)
+            conversations.append(user_id, "assistant", sentence(rng, 20), "fetch_emails" if turn % 3 == 0 else None)
+        for index in range(args.threads):
+            threads._store((user_id, f"t{user}-{index}"), thread(rng, user, index))
+    elapsed = time.perf_counter() - start
+    return {"stores": (conversations, messages, threads), "us_per_user": elapsed / users * 1e6}
+
+
+def measure(make_governor, users: int, args) -> dict:
+    us_per_user = simulate(make_governor(), users, args)["us_per_user"]  # timed without tracemalloc overhead
+    gc.collect()
+    tracemalloc.start()
+    governor = make_governor()
+    result = simulate(governor, users, args)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    snapshot = governor.snapshot() if governor else None
+    return {
+        "traced_mb": traced / 2 ** 20,
+        "accounted_mb": snapshot["total_bytes"] / 2 ** 20 if snapshot else None,
+        "evictions": sum(c["evictions"] for c in snapshot["caches"].values()) if snapshot else 0,
+        "snapshot": snapshot,
+        "us_per_user": us_per_user,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[500, 1000, 2000, 4000])
+    parser.add_argument("--budget-mb", type=float, default=16.0)
+    parser.add_argument("--messages", type=int, default=100, help="message summaries synced per user")
+    parser.add_argument("--turns", type=int, default=10, help="chatbot turns per user")
+    parser.add_argument("--threads", type=int, default=5, help="threads cached per user")
+    args = parser.parse_args()
+
+    modes = (
+        ("unbounded", lambda: None),
+        ("governed", lambda: MemoryGovernor(budget_bytes=args.budget_mb * 2 ** 20)),
+    )
+    print(f"{args.messages} messages, {args.turns} turns, {args.threads} threads per user; budget {args.budget_mb:g} MB")
+    print(f"{'mode':>10} {'users':>6} {'traced_mb':>10} {'accounted_mb':>12} {'evictions':>9} {'us/user':>8}")
+    last = None
+    for name, make_governor in modes:
+        for users in args.users:
+            result = measure(make_governor, users, args)
+            accounted = f"{result['accounted_mb']:.1f}" if result["accounted_mb"] is not None else "-"
+            print(f"{name:>10} {users:>6} {result['traced_mb']:>10.1f} {accounted:>12} "
+                  f"{result['evictions']:>9} {result['us_per_user']:>8.0f}")
+            last = result
+    print(f"\ngoverned caches at {args.users[-1]} users: {last['snapshot']['caches']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: first dashboard load after login, with and without background prefetch.
+
+For each mode a fresh backend authenticates (token flow against the fake
+Gmail), waits `--think-time` seconds as a user would before the dashboard
+asks for mail, then times `/emails/recent` and a follow-up call.
+
+A second part drives `PrefetchWorker` directly with many users and a fake
+sync to check the global concurrency cap and the per-user rate limit.
+
+Run from the backend directory:
+    python -m bench.bench_prefetch --max-results 50 --think-time 1.0
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import httpx
+
+from bench.fake_gmail import FakeGmailServer
+from bench.harness import BackendProcess
+from prefetch import PrefetchWorker
+
+
+async def first_load(gmail: FakeGmailServer, prefetch: bool, args):
+    backend = BackendProcess({
+        "GMAIL_API_URL": gmail.base_url,
+        "PREFETCH_ENABLED": "1" if prefetch else "0",
+        "SYNC_WINDOW": str(args.max_results),
+        "MESSAGE_STORE": "memory",
+    }).start()
+    try:
+        async with httpx.AsyncClient(base_url=backend.base_url, timeout=60) as client:
+            (await client.post("/auth/google", json={"access_token": "bench-token"})).raise_for_status()
+            await asyncio.sleep(args.think_time)
+            timings = []
+            for _ in range(2):
+                start = time.perf_counter()
+                resp = await client.get("/emails/recent", params={"max_results": args.max_results})
+                resp.raise_for_status()
+                timings.append((time.perf_counter() - start) * 1000)
+            stats = (await client.get("/debug/prefetch")).json()
+        return timings, stats
+    finally:
+        backend.stop()
+
+
+async def scheduler(users: int, workers: int, sync_seconds: float):
+    active = peak = 0
+
+    async def fake_sync(user_id: str):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(sync_seconds)
+        active -= 1
+        return {"mode": "delta"}
+
+    worker = PrefetchWorker(fake_sync, workers=workers, min_interval=60, refresh_interval=0)
+    worker.start()
+    start = time.perf_counter()
+    for i in range(users):
+        worker.register(f"user_{i}")
+    await worker.drain()
+    for i in range(users):
+        worker.schedule(f"user_{i}")  # re-logins inside min_interval
+    await worker.drain()
+    elapsed = time.perf_counter() - start
+    await worker.stop()
+    return peak, elapsed, worker.snapshot()
+
+
+async def run(args):
+    gmail = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.latency).start()
+    try:
+        print(f"{'prefetch':>8} {'first_load_ms':>13} {'second_load_ms':>14} {'prefetch_runs':>13}")
+        for prefetch in (False, True):
+            timings, stats = await first_load(gmail, prefetch, args)
+            print(f"{str(prefetch):>8} {timings[0]:>13.1f} {timings[1]:>14.1f} {stats['runs']:>13}")
+    finally:
+        gmail.stop()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        peak, elapsed, stats = await scheduler(args.users, args.workers, args.sync_seconds)
+    print(f"\n{args.users} users, {args.workers} workers: peak concurrent syncs {peak}, "
+          f"{stats['runs']} runs, {stats['rate_limited']} rate-limited re-schedules, {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mailbox-size", type=int, default=500)
+    parser.add_argument("--max-results", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.03)
+    parser.add_argument("--think-time", type=float, default=1.0)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sync-seconds", type=float, default=0.01)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: reply prompt size and latency with the token-budgeted prompt builder.
+
+Drafts replies for synthetic emails in three shapes: a short email with a
+signature, a reply chain with `--quoted-levels` levels of quoted history, and
+a long newsletter with no quotes. Each is drafted two ways against a fake
+Mistral that charges prefill time per prompt token:
+
+  raw       the email pasted into the prompt unchanged (the old behaviour)
+  budgeted  `build_reply_payload`: quotes and signatures stripped, truncated to budget
+
+It also times building the prompt for a redraft, which is served from the
+condensed-email cache.
+
+Run from the backend directory:
+    python -m bench.bench_prompt_budget --drafts 10 --prefill 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import time
+
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import latency_summary
+
+WORDS = ("please review the attached budget report and confirm the timeline for the "
+         "project meeting next week we need numbers for the board deck by friday").split()
+SIGNATURE = "\n\nThanks,\nSarah\n--\nSarah Connor | VP Finance\nCyberdyne Systems | +1 555 0100\n\nSent from my iPhone"
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_emails(rng: random.Random, quoted_levels: int):
+    short = f"Hi,\n\n{words(rng, 60)}{SIGNATURE}"
+    chain = f"Hi,\n\n{words(rng, 60)}{SIGNATURE}"
+    for level in range(1, quoted_levels + 1):
+        quote = "> " * level
+        chain += f"\n\n{quote}On Mon, 13 Nov 2023 at 10:{level:02d}, Person {level} <p{level}@example.com> wrote:\n"
+        chain += "\n".join(f"{quote}{words(rng, 12)}" for _ in range(20))
+    newsletter = "\n\n".join(words(rng, 80) for _ in range(60))
+    return {"short": short, "reply_chain": chain, "newsletter": newsletter}
+
+
+async def run(args):
+    os.environ.setdefault("MESSAGE_STORE", "memory")
+    os.environ["MISTRAL_API_KEY"] = "bench-key"
+    mistral = FakeMistralServer(latency=0.05, tokens_per_second=2000, reply_tokens=60,
+                                prefill_tokens_per_second=args.prefill).start()
+    os.environ["MISTRAL_API_URL"] = mistral.endpoint
+    import main_new
+    from http_pool import close_http_client
+
+    client = main_new.get_mistral_client()
+    emails = make_emails(random.Random(3), args.quoted_levels)
+    print(f"prefill {args.prefill:.0f} tokens/s, budget {main_new.prompt_builder.budget} tokens "
+          f"(email {main_new.prompt_builder.email_tokens})")
+    print(f"{'email':>12} {'mode':>9} {'prompt_tokens':>13} {'p50_ms':>7} {'p95_ms':>7}")
+    try:
+        for name, content in emails.items():
+            raw = {"model": "mistral-small", "max_tokens": 200, "messages": [
+                {"role": "system", "content": main_new.REPLY_SYSTEM_PROMPT},
+                {"role": "user", "content": main_new.REPLY_USER_PROMPT.format(context="", content=content)},
+            ]}
+            with contextlib.redirect_stdout(io.StringIO()):
+                budgeted, report = main_new.build_reply_payload(content)
+            for mode, payload in (("raw", raw), ("budgeted", budgeted)):
+                samples, usage = [], 0
+                for _ in range(args.drafts):
+                    start = time.perf_counter()
+                    resp = await client.chat(payload)
+                    samples.append(time.perf_counter() - start)
+                    usage = resp.json()["usage"]["prompt_tokens"]
+                latency = latency_summary(samples)
+                print(f"{name:>12} {mode:>9} {usage:>13} {latency['p50_ms']:>7.0f} {latency['p95_ms']:>7.0f}")
+
+        content = emails["reply_chain"]
+        main_new.prompt_builder._condensed.clear()
+        timings = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                start = time.perf_counter()
+                main_new.build_reply_payload(content)
+                timings.append(time.perf_counter() - start)
+        print(f"\nbuild prompt for reply_chain: first {timings[0] * 1e6:.0f}us, redraft {timings[1] * 1e6:.0f}us (cached)")
+        print(f"prompt stats: {main_new.prompt_builder.snapshot()}")
+    finally:
+        mistral.stop()
+        await close_http_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drafts", type=int, default=10)
+    parser.add_argument("--prefill", type=float, default=2000.0, help="fake Mistral prompt tokens per second")
+    parser.add_argument("--quoted-levels", type=int, default=6)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
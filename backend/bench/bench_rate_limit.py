@@ -0,0 +1,97 @@
+"""
+Benchmark: Gmail calls against a fake that enforces per-user quota and injects 429s.
+
+Each operation mimics a dashboard load: `messages.list` for 20 IDs, a batch
+`messages.get` for them (100 quota units), then a `history.list`. Many run
+at once, well above the fake's quota, under three client setups:
+
+  no_retry       quota limiter off, no retries (the old behaviour)
+  retry_only     backoff + Retry-After, but no client-side budget
+  limiter_retry  per-user token bucket in quota units, plus backoff
+
+Run from the backend directory:
+    python -m bench.bench_rate_limit --operations 60 --quota 250 --inject 0.02
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from async_clients import AsyncGmailClient, GmailApiError, close_http_client
+from bench.fake_gmail import FakeGmailServer
+from bench.harness import latency_summary
+from gmail_quota import GmailQuota, RetryPolicy
+
+PAGE = 20
+
+
+async def dashboard_load(service: AsyncGmailClient, offset: int, history_id: str):
+    listing = await service.list_messages(labelIds=["INBOX"], maxResults=PAGE, pageToken=str(offset))
+    ids = [m["id"] for m in listing.get("messages", [])]
+    fetched, failed = await service.batch_get_messages(ids, format="metadata")
+    await service.list_history(startHistoryId=history_id)
+    return not failed and len(fetched) == len(ids)
+
+
+async def run_mode(args, quota: GmailQuota, retry_policy: RetryPolicy):
+    server = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.latency, per_item_cost=0,
+                             quota_per_second=args.quota, inject_429=args.inject, retry_after=args.retry_after).start()
+    service = AsyncGmailClient("bench-token", base_url=server.base_url, user_key="bench_user",
+                               quota=quota, retry_policy=retry_policy)
+    samples, ok = [], 0
+
+    async def one(index: int):
+        nonlocal ok
+        start = time.perf_counter()
+        try:
+            if await dashboard_load(service, (index * PAGE) % args.mailbox_size, str(server.mailbox.history_id)):
+                ok += 1
+                samples.append(time.perf_counter() - start)
+        except GmailApiError:
+            pass
+
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(one(i) for i in range(args.operations)))
+    finally:
+        server.stop()
+    wall = time.perf_counter() - start
+    return ok, server.app.request_counts.get("rate_limited", 0), wall, latency_summary(samples), quota.snapshot("bench_user")
+
+
+async def run(args):
+    modes = (
+        ("no_retry", GmailQuota(enabled=False), RetryPolicy(max_retries=0)),
+        ("retry_only", GmailQuota(enabled=False), RetryPolicy(max_retries=args.max_retries)),
+        ("limiter_retry", GmailQuota(rate=args.quota, burst=args.quota), RetryPolicy(max_retries=args.max_retries)),
+    )
+    print(f"{args.operations} ops x {5 + PAGE * 5 + 2} units against a {args.quota:g} units/s quota, "
+          f"{args.inject:.0%} injected 429s, Retry-After={args.retry_after}")
+    print(f"{'mode':>14} {'ok':>5} {'server_429s':>11} {'retries':>7} {'wall_s':>7} {'p50_ms':>8} {'p95_ms':>8}")
+    try:
+        for name, quota, policy in modes:
+            ok, rejected, wall, latency, usage = await run_mode(args, quota, policy)
+            user = usage["users"]["bench_user"]
+            print(f"{name:>14} {ok:>5} {rejected:>11} {user['retries']:>7} {wall:>7.2f} "
+                  f"{latency['p50_ms']:>8.0f} {latency['p95_ms']:>8.0f}")
+    finally:
+        await close_http_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--operations", type=int, default=60)
+    parser.add_argument("--mailbox-size", type=int, default=1200)
+    parser.add_argument("--quota", type=float, default=250.0)
+    parser.add_argument("--inject", type=float, default=0.02)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--max-retries", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: /emails/generate-reply with the reply cache against a slow fake Mistral.
+
+Sends `--requests` replies drawn from `--distinct` email bodies (a few
+popular ones, like a newsletter many users receive, and a long tail), then
+restarts the backend on the same REPLY_CACHE_PATH to show the disk tier
+serving replies after a restart. Reports latency, Mistral calls made and the
+/debug/reply-cache counters.
+
+Run from the backend directory:
+    python -m bench.bench_reply_cache --requests 200 --distinct 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import BackendProcess, latency_summary
+
+
+def email_bodies(distinct: int):
+    return [f"Hi, following up on item #{i}. Can you confirm the schedule for next week? Thanks" for i in range(distinct)]
+
+
+async def replay(base_url: str, bodies, count: int, concurrency: int, seed: int, refresh: bool = False):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(bodies))]
+    workload = rng.choices(bodies, weights, k=count)
+    samples = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(client, body):
+        async with slots:
+            start = time.perf_counter()
+            resp = await client.post(f"{base_url}/emails/generate-reply", params={"refresh": refresh}, json={"content": body})
+            resp.raise_for_status()
+            samples.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        await asyncio.gather(*(one(client, body) for body in workload))
+        stats = (await client.get(f"{base_url}/debug/reply-cache")).json()
+    return latency_summary(samples), stats
+
+
+async def run(args):
+    mistral = FakeMistralServer(latency=args.mistral_latency).start()
+    bodies = email_bodies(args.distinct)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            "MISTRAL_API_KEY": "bench-key",
+            "MISTRAL_API_URL": mistral.endpoint,
+            "REPLY_CACHE_PATH": os.path.join(tmp, "replies.sqlite3"),
+        }
+        print(f"{'phase':>14} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'llm_calls':>9} {'hits':>5} {'disk_hits':>9}")
+        try:
+            for phase, refresh in (("uncached", True), ("cached", False), ("after_restart", False)):
+                backend = BackendProcess(env).start()
+                try:
+                    calls_before = mistral.request_count
+                    latency, stats = await replay(backend.base_url, bodies, args.requests, args.concurrency, args.seed, refresh)
+                finally:
+                    backend.stop()
+                    if phase == "uncached":
+                        # Start the cached phase from an empty cache
+                        os.remove(env["REPLY_CACHE_PATH"])
+                calls = mistral.request_count - calls_before
+                print(f"{phase:>14} {latency['p50_ms']:>8.1f} {latency['p95_ms']:>8.1f} {latency['p99_ms']:>8.1f} "
+                      f"{calls:>9} {stats['hits']:>5} {stats['disk_hits']:>9}")
+        finally:
+            mistral.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mistral-latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
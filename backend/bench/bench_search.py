@@ -0,0 +1,93 @@
+"""
+Benchmark: local full-text search over a large synthetic mailbox.
+
+Loads `--messages` summaries into a SQLite store (FTS5 + BM25) and compares
+query latency with a linear substring scan over the same records, which is
+how `find_email_by_reference` searched the cached list.
+
+Run from the backend directory:
+    python -m bench.bench_search --messages 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench.fake_gmail import SENDERS, SUBJECTS
+from bench.harness import latency_summary
+from message_store import SQLiteMessageStore, search_terms
+
+USER_ID = "bench_user"
+VOCABULARY_SIZE = 20_000
+
+# Mix of very common (subject/sender) terms and rarer body words
+QUERIES = ["invoice", "quarterly report", "newsletter", "sarah", "w120", "w4521 w77", "w15000", "budget w300"]
+
+
+def synthetic_records(count: int, seed: int = 11):
+    """Summaries whose snippet words follow a Zipf-like distribution over a large vocabulary."""
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    weights = [1 / (rank + 1) for rank in range(VOCABULARY_SIZE)]
+    for index in range(count):
+        yield {
+            "id": f"{index:016x}",
+            "thread_id": f"t{index // 3:015x}",
+            "sender": rng.choice(SENDERS),
+            "subject": f"{rng.choice(SUBJECTS)} #{index}",
+            "snippet": " ".join(rng.choices(vocabulary, weights, k=20)),
+            "date": None,
+            "internal_date": str((1700000000 - index * 60) * 1000),
+            "label_ids": ["INBOX"],
+        }
+
+
+def linear_scan(records, query: str, limit: int = 10):
+    """Ranked substring scan: every record is visited, matches are scored by term frequency."""
+    terms = search_terms(query)
+    hits = []
+    for record in records:
+        words = f"{record['sender']} {record['subject']} {record['snippet']}".lower().split()
+        if all(any(word.startswith(term) for word in words) for term in terms):
+            hits.append((sum(word.startswith(term) for word in words for term in terms), record))
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    return [record for _, record in hits[:limit]]
+
+
+def time_queries(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            fn(query)
+            samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = list(synthetic_records(args.messages))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteMessageStore(os.path.join(tmp, "bench.sqlite3"))
+        start = time.perf_counter()
+        for offset in range(0, len(records), 5000):
+            store.upsert(USER_ID, records[offset:offset + 5000])
+        load_s = time.perf_counter() - start
+        print(f"indexed {args.messages} messages in {load_s:.2f}s ({args.messages / load_s:,.0f} msg/s)")
+
+        print(f"{'method':>12} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8}")
+        for name, fn in (
+            ("fts5_bm25", lambda q: store.search(USER_ID, q, limit=10)),
+            ("linear_scan", lambda q: linear_scan(records, q)),
+        ):
+            stats = time_queries(fn, args.repeat)
+            print(f"{name:>12} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
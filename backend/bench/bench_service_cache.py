@@ -0,0 +1,63 @@
+"""
+Benchmark: cost of obtaining a Gmail service per request.
+
+Compares the original `googleapiclient.discovery.build()` call (static
+discovery document), an uncached `get_gmail_service` and the cached path.
+
+Run from the backend directory:
+    python -m bench.bench_service_cache --iterations 200
+"""
+import argparse
+import asyncio
+import time
+
+import google.oauth2.credentials
+from googleapiclient.discovery import build
+
+import main_new
+
+USER_ID = "bench_user"
+
+
+def per_call_ms(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    main_new.save_credentials(USER_ID, {
+        'token': 'bench-token',
+        'refresh_token': None,
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'client_id': 'bench-client',
+        'client_secret': 'bench-secret',
+        'scopes': ['https://www.googleapis.com/auth/gmail.modify'],
+    })
+
+    def discovery_build():
+        credentials = google.oauth2.credentials.Credentials(**main_new.load_credentials(USER_ID))
+        build('gmail', 'v1', credentials=credentials, static_discovery=True)
+
+    def uncached():
+        main_new.invalidate_gmail_service(USER_ID)
+        loop.run_until_complete(main_new.get_gmail_service(USER_ID))
+
+    def cached():
+        loop.run_until_complete(main_new.get_gmail_service(USER_ID))
+
+    loop = asyncio.new_event_loop()
+    build_iterations = max(1, args.iterations // 10)
+    print(f"{'path':>32} {'per_call_ms':>12}")
+    print(f"{'discovery.build (static doc)':>32} {per_call_ms(discovery_build, build_iterations):>12.3f}")
+    print(f"{'get_gmail_service (uncached)':>32} {per_call_ms(uncached, args.iterations):>12.3f}")
+    print(f"{'get_gmail_service (cached)':>32} {per_call_ms(cached, args.iterations):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: shared state across uvicorn workers.
+
+Part 1 times the state store operations each request makes (session lookup,
+credentials read, conversation append/read) on every backend.
+
+Part 2 runs the backend with several workers and signs in distinct users
+(one cookie jar each). Every user then reads their conversation history
+repeatedly over fresh connections. The workers share one listening socket,
+so the kernel decides which worker serves each request. A request succeeds only
+if the worker serving it sees the user's session and the greeting written
+at sign-in.
+
+  memory  per-process dicts (the old behaviour)
+  sqlite  one WAL database shared by the workers
+  redis   RESP client against bench/fake_redis.py
+
+Run from the backend directory:
+    python -m bench.bench_state_store --workers 4 --users 20 --reads 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from bench.fake_gmail import FakeGmailServer
+from bench.fake_redis import FakeRedisServer
+from bench.harness import BackendProcess, latency_summary
+from state_store import InMemoryStateStore, RedisStateStore, SQLiteStateStore
+
+CREDS = {"token": "t", "refresh_token": "r", "expiry": None, "token_uri": "https://oauth2.googleapis.com/token",
+         "client_id": "c", "client_secret": "s", "scopes": ["https://www.googleapis.com/auth/gmail.modify"]}
+MESSAGE = {"role": "user", "content": "show my emails", "timestamp": "2025-01-01T00:00:00", "action_taken": None}
+
+
+def store_ops(store, iterations: int):
+    store.set("sessions", "session", "user")
+    store.set("credentials", "user", CREDS)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        user_id = store.get("sessions", "session")
+        store.get("credentials", user_id)
+        store.append("conversation", user_id, MESSAGE, 20)
+        store.get_list("conversation", user_id, 5)
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+async def shared_sessions(env, args):
+    backend = BackendProcess({**env, "DEFAULT_USER_ID": "", "PREFETCH_ENABLED": "0", "MESSAGE_STORE": "memory"},
+                             workers=args.workers).start()
+    ok = failed = 0
+    try:
+        await asyncio.sleep(1.0)  # let every worker finish booting
+
+        async def user(index: int):
+            nonlocal ok, failed
+            async with httpx.AsyncClient(base_url=backend.base_url, timeout=30) as client:
+                (await client.post("/auth/google", json={"access_token": f"user{index}"})).raise_for_status()
+                for _ in range(args.reads):
+                    # A fresh connection per read lets the kernel hand it to any worker
+                    resp = await client.get("/chatbot/history", headers={"Connection": "close"})
+                    if resp.status_code == 200 and resp.json()["history"]:
+                        ok += 1
+                    else:
+                        failed += 1
+
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+    finally:
+        backend.stop()
+    return ok, failed
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="state-bench-")
+    redis = FakeRedisServer().start()
+    print(f"{'backend':>8} {'p50_us':>8} {'p99_us':>8}   (session + credentials + append + read, {args.iterations} iterations)")
+    for name, store in (
+        ("memory", InMemoryStateStore()),
+        ("sqlite", SQLiteStateStore(os.path.join(workdir, "micro.sqlite3"))),
+        ("redis", RedisStateStore(redis.url, prefix="micro:")),
+    ):
+        latency = store_ops(store, args.iterations)
+        print(f"{name:>8} {latency['p50_ms'] * 1000:>8.1f} {latency['p99_ms'] * 1000:>8.1f}")
+
+    gmail = FakeGmailServer(mailbox_size=20, latency=0, per_item_cost=0).start()
+    print(f"\n{args.workers} workers, {args.users} users x {args.reads} history reads")
+    print(f"{'backend':>8} {'ok':>6} {'failed':>6}")
+    try:
+        for name, env in (
+            ("memory", {"STATE_BACKEND": "memory"}),
+            ("sqlite", {"STATE_BACKEND": "sqlite", "STATE_STORE_PATH": os.path.join(workdir, "app_state.sqlite3")}),
+            ("redis", {"STATE_BACKEND": "redis", "REDIS_URL": redis.url}),
+        ):
+            ok, failed = await shared_sessions({**env, "GMAIL_API_URL": gmail.base_url}, args)
+            print(f"{name:>8} {ok:>6} {failed:>6}")
+    finally:
+        gmail.stop()
+        redis.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: time to first token for streamed vs. buffered reply generation.
+
+Calls `/emails/generate-reply` (waits for the whole completion) and
+`/emails/generate-reply/stream` (server-sent events) against a fake Mistral
+that streams tokens at `--tokens-per-second`, and reports time to first
+token and time to full reply. A final round disconnects after the first
+token and checks that the upstream stream was cancelled.
+
+Run from the backend directory:
+    python -m bench.bench_streaming --requests 20 --reply-tokens 200
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import BackendProcess, latency_summary
+
+EMAIL_TEXT = "Hi, can you send me the quarterly report before Friday's meeting? Thanks, Sarah"
+
+
+async def buffered(client: httpx.AsyncClient, base_url: str):
+    start = time.perf_counter()
+    resp = await client.post(f"{base_url}/emails/generate-reply", params={"refresh": True}, json={"content": EMAIL_TEXT})
+    resp.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+async def streamed(client: httpx.AsyncClient, base_url: str, stop_after_first: bool = False):
+    start = time.perf_counter()
+    first_token = None
+    url = f"{base_url}/emails/generate-reply/stream"
+    async with client.stream("POST", url, params={"refresh": True}, json={"content": EMAIL_TEXT}) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if line == "event: token" and first_token is None:
+                first_token = time.perf_counter() - start
+                if stop_after_first:
+                    break
+            elif line == "event: done":
+                break
+    return first_token, time.perf_counter() - start
+
+
+async def run(args):
+    mistral = FakeMistralServer(latency=args.mistral_latency, tokens_per_second=args.tokens_per_second,
+                                reply_tokens=args.reply_tokens).start()
+    backend = BackendProcess({"MISTRAL_API_KEY": "bench-key", "MISTRAL_API_URL": mistral.endpoint}).start()
+    try:
+        async with httpx.AsyncClient(timeout=120) as client:
+            print(f"{'mode':>9} {'ttft_p50':>9} {'ttft_p95':>9} {'total_p50':>10} {'total_p95':>10}")
+            for mode, fn in (("buffered", buffered), ("streamed", streamed)):
+                results = [await fn(client, backend.base_url) for _ in range(args.requests)]
+                ttft = latency_summary([r[0] for r in results])
+                total = latency_summary([r[1] for r in results])
+                print(f"{mode:>9} {ttft['p50_ms']:>7.0f}ms {ttft['p95_ms']:>7.0f}ms {total['p50_ms']:>8.0f}ms {total['p95_ms']:>8.0f}ms")
+
+            before = mistral.cancelled_streams
+            for _ in range(args.requests):
+                await streamed(client, backend.base_url, stop_after_first=True)
+            await asyncio.sleep(0.5)
+            print(f"disconnect after first token: {mistral.cancelled_streams - before}/{args.requests} upstream streams cancelled")
+    finally:
+        backend.stop()
+        mistral.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--mistral-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
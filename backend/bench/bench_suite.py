@@ -0,0 +1,290 @@
+"""
+Benchmark suite: throughput and latency of the main endpoints, with results
+saved as JSON so regressions can be tracked across commits.
+
+Runs `main_new:app` in a uvicorn subprocess against bench/fake_gmail.py
+(REST and /batch, with `--gmail-latency` per call and a `--mailbox-size`
+message inbox) and bench/fake_mistral.py (`--mistral-latency` plus
+`--tokens-per-second` generation). It signs in `--users` accounts and sends
+`--rounds` rounds of `--requests` calls per endpoint, `--concurrency` at a
+time, round-robin across the users:
+
+  recent   GET  /emails/recent
+  command  POST /chatbot/command   ("show my emails" by default)
+  reply    POST /emails/generate-reply?refresh=true   (bypasses the reply cache)
+  send     POST /emails/send   (replies to messages from the inbox)
+
+Each endpoint first gets `--warmup` unrecorded calls. Percentiles pool all
+rounds and throughput is the median round. The client-side Gmail quota is
+raised for the run (`--gmail-quota`, units/s per user) so that send measures
+the backend and not the 100-unit messages.send pacing.
+
+The results go to `--output` (default bench/results/<commit>.json). The file
+holds the commit of `--app-dir`, the config, and per endpoint the ok/error
+counts, throughput and p50/p95/p99/max. `--compare` takes an earlier
+results file, prints the change per metric, and exits 1 if p95 or
+throughput regressed by more than `--threshold` percent.
+
+Run from the backend directory:
+    python -m bench.bench_suite --requests 200 --concurrency 20
+    python -m bench.bench_suite --compare bench/results/<older commit>.json
+
+To benchmark another commit, point --app-dir at a worktree of it (the fakes
+need a commit that reads GMAIL_API_URL and MISTRAL_API_URL):
+    git worktree add /tmp/email-baseline <commit>
+    python -m bench.bench_suite --app-dir /tmp/email-baseline/backend
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.fake_gmail import FakeGmailServer
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import BACKEND_DIR, BackendProcess, latency_summary
+
+RESULTS_VERSION = 1
+ENDPOINTS = ("recent", "command", "reply", "send")
+EMAIL_TEXT = "Hi, can you send me the quarterly report before Friday's meeting? Thanks, Sarah"
+
+
+def git_commit(app_dir: str) -> Dict[str, Optional[str]]:
+    """Commit checked out in `app_dir`, and whether the tree has uncommitted changes."""
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.run(["git", "-C", app_dir, *args], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    commit = git("rev-parse", "HEAD")
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": commit, "dirty": bool(status) if status is not None else None}
+
+
+class Users:
+    """Signed-in accounts, handed out round-robin as X-Session-Id headers."""
+
+    def __init__(self, sessions: List[Optional[str]]):
+        self.sessions = sessions
+        self._next = itertools.cycle(sessions)
+
+    def headers(self) -> Dict[str, str]:
+        session = next(self._next)
+        # Commits from before sessions existed serve every request as the last signed-in user
+        return {"X-Session-Id": session} if session else {}
+
+
+async def sign_in(client: httpx.AsyncClient, count: int) -> Users:
+    sessions = []
+    for index in range(count):
+        resp = await client.post("/auth/google", json={"access_token": f"bench-user{index}"})
+        resp.raise_for_status()
+        sessions.append(resp.cookies.get("session_id"))
+    client.cookies.clear()  # the session cookie would take precedence over X-Session-Id
+    return Users(sessions)
+
+
+def endpoint_requests(name: str, users: Users, inbox: List[Dict], args):
+    """Endless (method, url, kwargs) stream for one endpoint."""
+    for index in itertools.count():
+        headers = users.headers()
+        email = inbox[index % len(inbox)]
+        if name == "recent":
+            yield "GET", "/emails/recent", {"params": {"max_results": args.max_results}, "headers": headers}
+        elif name == "command":
+            yield "POST", "/chatbot/command", {"json": {"command": args.command}, "headers": headers}
+        elif name == "reply":
+            yield "POST", "/emails/generate-reply", {
+                "params": {"refresh": True}, "headers": headers,
+                "json": {"content": f"{EMAIL_TEXT} ({email['snippet']})", "message_id": email["id"]},
+            }
+        elif name == "send":
+            yield "POST", "/emails/send", {"json": {"message_id": email["id"], "reply_text": "Thanks, will do."},
+                                           "headers": headers}
+
+
+async def measure(client: httpx.AsyncClient, requests, total: int, concurrency: int,
+                  latencies: List[float], errors: Dict[str, int]) -> float:
+    """
+    Runs `total` requests with at most `concurrency` in flight, adding successful
+    latencies and error counts to the given collections; returns requests/s.
+    """
+    recorded = len(latencies)
+    # Workers share the stream; each takes the next request until `total` have been issued
+    batch = itertools.islice(requests, total)
+
+    async def worker():
+        for method, url, kwargs in batch:
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, url, **kwargs)
+                outcome = "ok" if resp.status_code == 200 else str(resp.status_code)
+            except httpx.HTTPError as error:
+                outcome = type(error).__name__
+            if outcome == "ok":
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return (len(latencies) - recorded) / (time.perf_counter() - start)
+
+
+async def measure_endpoint(client: httpx.AsyncClient, requests, args) -> Dict:
+    """
+    Warms up, then runs `--rounds` rounds. Percentiles pool every round's
+    latencies; throughput is the median round, which damps one-off stalls.
+    """
+    if args.warmup:
+        await measure(client, requests, args.warmup, min(args.concurrency, args.warmup), [], {})
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    rounds = [await measure(client, requests, args.requests, args.concurrency, latencies, errors)
+              for _ in range(args.rounds)]
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(statistics.median(rounds), 2),
+        "rounds_rps": [round(rps, 2) for rps in rounds],
+        **{key: round(value, 2) if isinstance(value, float) else value
+           for key, value in latency_summary(latencies).items()},
+    }
+
+
+async def run_suite(args) -> Dict:
+    gmail = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.gmail_latency).start()
+    mistral = FakeMistralServer(latency=args.mistral_latency, tokens_per_second=args.tokens_per_second,
+                                reply_tokens=args.reply_tokens).start()
+    backend = BackendProcess({
+        "GMAIL_API_URL": gmail.base_url,
+        "MISTRAL_API_KEY": "bench-key",
+        "MISTRAL_API_URL": mistral.endpoint,
+        "GMAIL_QUOTA_PER_SECOND": str(args.gmail_quota),
+        "DEFAULT_USER_ID": "",
+        "PREFETCH_ENABLED": "0",
+        "LOG_LEVEL": "WARNING",
+        "TRACING_ENABLED": "0",
+    }, app_dir=args.app_dir).start()
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency + 10)
+        async with httpx.AsyncClient(base_url=backend.base_url, limits=limits, timeout=args.timeout) as client:
+            users = await sign_in(client, args.users)
+            resp = await client.get("/emails/recent", params={"max_results": args.max_results}, headers=users.headers())
+            resp.raise_for_status()
+            inbox = resp.json()
+            for name in args.endpoints:
+                results[name] = await measure_endpoint(client, endpoint_requests(name, users, inbox, args), args)
+                print_row(name, results[name])
+    finally:
+        backend.stop()
+        mistral.stop()
+        gmail.stop()
+    return results
+
+
+def print_row(name: str, row: Dict):
+    errors = sum(row["errors"].values())
+    print(f"{name:>8} {row['ok']:>6} {errors:>6} {row['throughput_rps']:>8.1f} {row['p50_ms']:>8.1f} "
+          f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+
+
+def compare(previous: Dict, current: Dict, threshold: float) -> List[str]:
+    """Prints per-metric changes against an earlier results file; returns the regressions."""
+    print(f"\nvs {previous.get('commit') or '?'} ({previous.get('timestamp', '?')}):")
+    print(f"{'endpoint':>8} {'metric':>14} {'before':>9} {'after':>9} {'change':>8}")
+    regressions = []
+    for name, row in current["results"].items():
+        before = previous.get("results", {}).get(name)
+        if not before:
+            continue
+        # Higher is better for throughput, lower for latency
+        for metric, higher_is_better in (("throughput_rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False)):
+            old, new = before.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold and metric in ("throughput_rps", "p95_ms"):
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric} {change:+.1f}%")
+            print(f"{name:>8} {metric:>14} {old:>9.1f} {new:>9.1f} {change:>+7.1f}%{flag}")
+    if current["config"] != previous.get("config"):
+        print("note: the two runs used different configs")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", default=BACKEND_DIR, help="directory containing main_new.py")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="recorded requests per endpoint and round")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=10, help="unrecorded requests per endpoint")
+    parser.add_argument("--users", type=int, default=4, help="signed-in accounts the requests rotate over")
+    parser.add_argument("--mailbox-size", type=int, default=500)
+    parser.add_argument("--gmail-latency", type=float, default=0.03, help="seconds per fake Gmail call")
+    parser.add_argument("--gmail-quota", type=float, default=100000, help="client-side Gmail quota, units/s per user")
+    parser.add_argument("--mistral-latency", type=float, default=0.2, help="seconds before the fake Mistral replies")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--max-results", type=int, default=10, help="max_results for /emails/recent")
+    parser.add_argument("--command", default="show my emails", help="chatbot command to send")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="results file (default bench/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=15.0, help="percent change in p95/throughput that fails --compare")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in (
+        "endpoints", "requests", "rounds", "concurrency", "warmup", "users", "mailbox_size", "gmail_latency",
+        "gmail_quota", "mistral_latency", "tokens_per_second", "reply_tokens", "max_results", "command",
+    )}
+    revision = git_commit(args.app_dir)
+    print(f"app_dir={os.path.abspath(args.app_dir)} commit={(revision['commit'] or '?')[:12]}"
+          f"{' (dirty)' if revision['dirty'] else ''}")
+    print(f"{args.rounds}x{args.requests} requests per endpoint at concurrency {args.concurrency}, {args.users} users; "
+          f"gmail {args.gmail_latency * 1000:.0f}ms/{args.mailbox_size} messages, "
+          f"mistral {args.mistral_latency * 1000:.0f}ms + {args.reply_tokens} tokens at {args.tokens_per_second:g}/s")
+    print(f"{'endpoint':>8} {'ok':>6} {'errors':>6} {'rps':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'max_ms':>8}")
+
+    results = asyncio.run(run_suite(args))
+    report = {
+        "version": RESULTS_VERSION,
+        **revision,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    output = args.output or os.path.join(BACKEND_DIR, "bench", "results", f"{(revision['commit'] or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"regressions over {args.threshold:g}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark: reply drafting and sending through the thread cache.
+
+For `--emails` inbox messages, drafts a reply (with `message_id`, so the
+prompt gets thread context) and then sends it, against fake Gmail and fake
+Mistral. It reports the Gmail calls made per draft+send (send latency is
+left out: the client-side quota limiter paces messages.send at 100 units).
+It also compares the bytes Gmail returns for the old header lookup
+(`messages.get` format=full, which carries bodies and attachments) with one
+metadata `threads.get`.
+
+Finally it checks the threading: every sent reply carries the original's
+thread ID, In-Reply-To and References chain, and a second draft in the same
+thread includes the reply that was just sent, because the send invalidated
+the cached thread.
+
+Run from the backend directory:
+    python -m bench.bench_threads --emails 12 --attachment-bytes 200000
+"""
+import argparse
+import asyncio
+import json
+
+import httpx
+
+from bench.fake_gmail import FakeGmailServer
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import BackendProcess
+from thread_cache import THREAD_HEADERS
+
+
+def response_bytes(gmail: FakeGmailServer, path: str, query) -> int:
+    status, body = gmail.app.route("GET", f"{gmail.app.PREFIX}{path}", query, None)
+    return len(json.dumps(body)) if status == 200 else 0
+
+
+def header(msg, name: str):
+    return next((h["value"] for h in msg["payload"]["headers"] if h["name"] == name), None)
+
+
+async def run(args):
+    gmail = FakeGmailServer(mailbox_size=60, latency=args.latency, per_item_cost=0,
+                            attachment_bytes=args.attachment_bytes).start()
+    mistral = FakeMistralServer(latency=0.05, tokens_per_second=2000).start()
+    backend = BackendProcess({"GMAIL_API_URL": gmail.base_url, "MISTRAL_API_KEY": "bench-key",
+                              "MISTRAL_API_URL": mistral.endpoint, "PREFETCH_ENABLED": "0",
+                              "MESSAGE_STORE": "memory"}).start()
+    try:
+        async with httpx.AsyncClient(base_url=backend.base_url, timeout=60) as client:
+            (await client.post("/auth/google", json={"access_token": "bench"})).raise_for_status()
+            inbox = (await client.get("/emails/recent", params={"max_results": args.emails})).json()
+            gmail.app.request_counts.clear()
+
+            for email in inbox:
+                (await client.post("/emails/generate-reply", params={"refresh": True},
+                                   json={"content": email["snippet"], "message_id": email["id"]})).raise_for_status()
+                (await client.post("/emails/send", json={"message_id": email["id"], "reply_text": "Thanks!"})).raise_for_status()
+
+            counts = dict(gmail.app.request_counts)
+            print(f"{len(inbox)} drafts + sends, Gmail latency {args.latency * 1000:.0f}ms, attachments {args.attachment_bytes} bytes")
+            print(f"gmail calls: {counts}  ({sum(counts.values()) / len(inbox):.2f} per draft+send)")
+
+            email = inbox[0]
+            full = response_bytes(gmail, f"messages/{email['id']}", {"format": ["full"]})
+            thread = response_bytes(gmail, f"threads/{email['thread_id']}",
+                                    {"format": ["metadata"], "metadataHeaders": THREAD_HEADERS})
+            print(f"bytes per lookup: messages.get full {full}, threads.get metadata {thread} (whole thread)")
+
+            threaded = 0
+            for email in inbox:
+                original = gmail.mailbox.by_id[email["id"]]
+                replies = [m for m in gmail.mailbox.thread(email["thread_id"])
+                           if "SENT" in m["labelIds"] and header(m, "In-Reply-To") == header(original, "Message-ID")]
+                if replies and header(original, "Message-ID") in (header(replies[0], "References") or ""):
+                    threaded += 1
+            print(f"replies threaded with In-Reply-To/References: {threaded}/{len(inbox)}")
+
+            email = inbox[0]
+            (await client.post("/emails/generate-reply", params={"refresh": True},
+                               json={"content": email["snippet"], "message_id": email["id"]})).raise_for_status()
+            prompt = mistral.last_payload["messages"][-1]["content"]
+            print(f"second draft in thread sees the sent reply: {'me@example.com' in prompt}")
+            print(f"thread cache: {(await client.get('/debug/thread-cache')).json()}")
+    finally:
+        backend.stop()
+        mistral.stop()
+        gmail.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.03)
+    parser.add_argument("--attachment-bytes", type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
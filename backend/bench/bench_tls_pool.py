@@ -0,0 +1,117 @@
+"""
+Benchmark: reply generation against a local TLS Mistral stub, fresh vs pooled connections.
+
+  per_request  a new client (TCP + TLS handshake) per reply, like the old
+               module-level `requests.post` calls
+  pooled       the shared keep-alive "mistral" pool from `http_pool`
+
+Handshake counts and timings come from the pool's httpcore trace metrics.
+The stub runs under uvicorn, which only speaks HTTP/1.1, so ALPN settles on
+HTTP/1.1 even when `h2` is installed. Real upstreams are further away than
+loopback, so each avoided handshake saves more there (at least one extra
+round trip on TLS 1.3, two on TLS 1.2).
+
+Run from the backend directory:
+    python -m bench.bench_tls_pool --replies 300 --concurrency 10
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import os
+import tempfile
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from async_clients import AsyncMistralClient
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import latency_summary
+from http_pool import close_http_client, create_http_client, get_http_client, pool_stats
+
+PAYLOAD = {"model": "mistral-small-latest", "messages": [{"role": "user", "content": "Draft a reply"}]}
+
+
+def self_signed_cert(directory: str):
+    """Writes a localhost certificate and key; returns (certfile, keyfile)."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+async def run_mode(mode: str, endpoint: str, args):
+    slots = asyncio.Semaphore(args.concurrency)
+    samples = []
+
+    async def reply():
+        async with slots:
+            start = time.perf_counter()
+            if mode == "per_request":
+                async with create_http_client(mode) as http:
+                    response = await AsyncMistralClient("bench-key", endpoint, http=http).chat(PAYLOAD)
+            else:
+                response = await AsyncMistralClient("bench-key", endpoint, http=get_http_client("mistral")).chat(PAYLOAD)
+            response.raise_for_status()
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(reply() for _ in range(args.replies)))
+    return time.perf_counter() - start, latency_summary(samples)
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="tls-stub-")
+    certfile, keyfile = self_signed_cert(workdir)
+    # httpx reads SSL_CERT_FILE when it builds a client's SSL context
+    os.environ["SSL_CERT_FILE"] = certfile
+    server = FakeMistralServer(latency=args.latency, reply_tokens=20, tokens_per_second=1e6,
+                               ssl_certfile=certfile, ssl_keyfile=keyfile).start()
+    print(f"{args.replies} replies, concurrency {args.concurrency}, stub latency {args.latency * 1000:.0f}ms at {server.endpoint}")
+    print(f"{'mode':>12} {'wall_s':>7} {'p50_ms':>7} {'p95_ms':>7} {'conns':>6} {'tls':>5} {'avg_tls_ms':>10} "
+          f"{'handshake_ms/reply':>18} {'versions':>16}")
+    try:
+        for mode in ("per_request", "pooled"):
+            wall, latency = await run_mode(mode, server.endpoint, args)
+            pool = "mistral" if mode == "pooled" else mode
+            host = pool_stats()["hosts"][f"{pool}:127.0.0.1"]
+            handshake_ms = (host["connect_seconds"] + host["tls_seconds"]) * 1000
+            print(f"{mode:>12} {wall:>7.2f} {latency['p50_ms']:>7.1f} {latency['p95_ms']:>7.1f} "
+                  f"{host['connections_opened']:>6} {host['tls_handshakes']:>5} {host['avg_tls_ms'] or 0:>10.2f} "
+                  f"{handshake_ms / args.replies:>18.2f} {str(host['http_versions']):>16}")
+    finally:
+        await close_http_client()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replies", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
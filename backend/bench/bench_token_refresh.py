@@ -0,0 +1,114 @@
+"""
+Benchmark: Gmail requests across access token expiry.
+
+The fake Gmail server issues short-lived tokens and rejects expired ones.
+Concurrent workers call `get_gmail_service` + `messages.list` in a loop for
+several token lifetimes under three refresh setups:
+
+  no_refresh  expired tokens are rejected (the old behaviour)
+  on_demand   requests that find the token expired wait for a single-flight refresh
+  proactive   tokens are refreshed in the background before they expire
+
+Run from the backend directory:
+    python -m bench.bench_token_refresh --ttl 2 --duration 8 --concurrency 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+from fastapi import HTTPException
+
+from bench.fake_gmail import FakeGmailServer
+from bench.harness import free_port, latency_summary
+
+USER_ID = "bench_user"
+
+
+async def run_mode(main_new, server: FakeGmailServer, args, margin: float, skew: float, interval: float):
+    from async_clients import GmailApiError
+    from token_refresh import TokenRefresher, expiry_from_now
+
+    token = server.issue_token()
+    main_new.invalidate_gmail_service(USER_ID)
+    main_new.save_credentials(USER_ID, {
+        'token': token['access_token'],
+        'refresh_token': 'bench-refresh-token',
+        'expiry': expiry_from_now(token['expires_in']),
+        'token_uri': server.token_uri,
+        'client_id': 'bench-client',
+        'client_secret': 'bench-secret',
+        'scopes': ['https://www.googleapis.com/auth/gmail.modify'],
+    })
+    refresher = TokenRefresher(main_new.load_credentials, main_new.save_credentials, main_new.authenticated_users,
+                               margin=margin, interval=interval, skew=skew)
+    main_new.token_refresher = refresher
+    server.app.request_counts.clear()
+    samples, failures = [], 0
+    deadline = time.monotonic() + args.duration
+
+    async def worker():
+        nonlocal failures
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                service = await main_new.get_gmail_service(USER_ID)
+                await service.list_messages(labelIds=["INBOX"], maxResults=10)
+                samples.append(time.perf_counter() - start)
+            except (HTTPException, GmailApiError):
+                failures += 1
+                await asyncio.sleep(0.05)
+
+    refresher.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        await refresher.stop()
+    return samples, failures, server.app.request_counts.get("token", 0), refresher.snapshot()
+
+
+async def run(args):
+    port = free_port()
+    # main_new reads GMAIL_API_URL at import time, so it must be set before it is loaded
+    os.environ["GMAIL_API_URL"] = f"http://127.0.0.1:{port}/"
+    import main_new
+    from gmail_quota import gmail_quota
+    from http_pool import close_http_client
+
+    # Measure refresh behaviour, not the client-side quota limiter
+    gmail_quota.enabled = False
+
+    server = FakeGmailServer(mailbox_size=200, latency=args.latency, per_item_cost=0, port=port, token_ttl=args.ttl).start()
+    modes = (
+        ("no_refresh", float("-inf"), float("-inf"), 0),
+        ("on_demand", 0.0, args.ttl / 8, 0),
+        ("proactive", args.ttl / 2, args.ttl / 8, args.ttl / 8),
+    )
+    print(f"{args.concurrency} workers for {args.duration}s, token TTL {args.ttl}s, upstream latency {args.latency * 1000:.0f}ms")
+    print(f"{'mode':>11} {'ok':>6} {'failed':>6} {'refresh_calls':>13} {'deduped':>7} {'p50_ms':>7} {'p99_ms':>7} {'max_ms':>7}")
+    try:
+        for name, margin, skew, interval in modes:
+            samples, failures, token_calls, stats = await run_mode(main_new, server, args, margin, skew, interval)
+            latency = latency_summary(samples)
+            print(f"{name:>11} {len(samples):>6} {failures:>6} {token_calls:>13} {stats['deduplicated']:>7} "
+                  f"{latency['p50_ms']:>7.1f} {latency['p99_ms']:>7.1f} {latency['max_ms']:>7.1f}")
+    finally:
+        server.stop()
+        await close_http_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ttl", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=8.0)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+"""
+A small in-process fake of the Gmail REST API used by the benchmarks.
+
+It serves a synthetic mailbox over plain HTTP and understands the subset of
+the API the backend uses, including the multipart `/batch` endpoint, so that
+the backend's Gmail client can talk to it unmodified.
+
+With `quota_per_second` set it meters requests in Gmail quota units and
+answers 429 rateLimitExceeded once the budget is spent; `inject_429` adds
+random 429s on top. Both apply to batch sub-requests individually.
+
+With `token_ttl` set it also acts as Google's token endpoint (`POST /token`)
+and rejects Gmail calls whose bearer token it did not issue or that expired.
+
+Usage:
+    server = FakeGmailServer(mailbox_size=500, latency=0.03)
+    server.start()
+    ...  # point a client at server.base_url
+    server.stop()
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+from email import message_from_bytes
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from gmail_quota import quota_units
+
+SENDERS = [
+    "Amazon <shipment-tracking@amazon.com>",
+    "GitHub <noreply@github.com>",
+    "Sarah Connor <sarah@example.com>",
+    "John Smith <john@example.com>",
+    "Newsletter <newsletter@company.com>",
+    "Boss <boss@work.example>",
+]
+
+SUBJECTS = [
+    "Your order has shipped",
+    "Invoice for project updates",
+    "Meeting tomorrow at 10",
+    "Weekly newsletter",
+    "Quarterly report draft",
+    "Re: budget review",
+]
+
+WORDS = (
+    "please review the attached report and let me know your thoughts on the "
+    "budget timeline invoice meeting project update shipment schedule"
+).split()
+
+
+SEARCH_TERM = re.compile(r'\b(from|subject):(?:"([^"]*)"|(\S+))')
+
+
+# --- SYNTHETIC MAILBOX ---
+def make_message(index: int, attachment_bytes: int = 0, rng: Optional[random.Random] = None,
+                 timestamp: Optional[int] = None) -> Dict:
+    """Build a Gmail `format=full` message resource for position `index`."""
+    rng = rng or random.Random(index)
+    timestamp = 1700000000 - index * 60 if timestamp is None else timestamp
+    sender = SENDERS[index % len(SENDERS)]
+    subject = f"{SUBJECTS[index % len(SUBJECTS)]} #{index}"
+    body_text = " ".join(rng.choice(WORDS) for _ in range(60))
+    msg_id = f"{index:016x}"
+    headers = [
+        {"name": "From", "value": sender},
+        {"name": "To", "value": "me@example.com"},
+        {"name": "Subject", "value": subject},
+        {"name": "Date", "value": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(timestamp))},
+        {"name": "Message-ID", "value": f"<{msg_id}@mail.example.com>"},
+    ]
+    parts = [{
+        "partId": "0",
+        "mimeType": "text/plain",
+        "body": {"size": len(body_text), "data": base64.urlsafe_b64encode(body_text.encode()).decode()},
+    }]
+    if attachment_bytes:
+        blob = base64.urlsafe_b64encode(b"\0" * attachment_bytes).decode()
+        parts.append({
+            "partId": "1",
+            "mimeType": "application/pdf",
+            "filename": "attachment.pdf",
+            "body": {"size": attachment_bytes, "data": blob},
+        })
+    return {
+        "id": msg_id,
+        "threadId": f"t{index // 3:015x}",
+        "labelIds": ["INBOX"],
+        "snippet": body_text[:120],
+        "historyId": str(1000 + index),
+        "internalDate": str(timestamp * 1000),
+        "sizeEstimate": len(body_text) + attachment_bytes,
+        "payload": {"mimeType": "multipart/mixed", "headers": headers, "parts": parts},
+    }
+
+
+class FakeMailbox:
+    """Synthetic mailbox, newest message first, with a Gmail-style history log."""
+
+    def __init__(self, size: int = 200, attachment_bytes: int = 0, seed: int = 7):
+        rng = random.Random(seed)
+        self.attachment_bytes = attachment_bytes
+        self.messages: List[Dict] = [make_message(i, attachment_bytes, rng) for i in range(size)]
+        self.by_id: Dict[str, Dict] = {m["id"]: m for m in self.messages}
+        self.lock = threading.Lock()
+        self.history_id = 1000 + size
+        self.history: List[Dict] = []
+        self.oldest_history_id = self.history_id
+        self.next_index = size
+
+    def _record(self, **change) -> str:
+        self.history_id += 1
+        self.history.append({"id": str(self.history_id), **change})
+        return str(self.history_id)
+
+    @staticmethod
+    def _stub(msg: Dict) -> Dict:
+        return {"id": msg["id"], "threadId": msg["threadId"], "labelIds": list(msg["labelIds"])}
+
+    def deliver(self, count: int = 1) -> List[str]:
+        """Adds `count` new messages to the top of the inbox."""
+        with self.lock:
+            newest = int(self.messages[0]["internalDate"]) // 1000 if self.messages else 1700000000
+            delivered = []
+            for k in range(count):
+                msg = make_message(self.next_index, self.attachment_bytes, timestamp=newest + 60 * (k + 1))
+                self.next_index += 1
+                msg["historyId"] = self._record(messagesAdded=[{"message": self._stub(msg)}])
+                self.messages.insert(0, msg)
+                self.by_id[msg["id"]] = msg
+                delivered.append(msg["id"])
+            return delivered
+
+    def thread(self, thread_id: str) -> List[Dict]:
+        """Messages of a thread, oldest first."""
+        return sorted((m for m in self.messages if m["threadId"] == thread_id), key=lambda m: int(m["internalDate"]))
+
+    def add_sent(self, raw: str, thread_id: Optional[str] = None) -> Dict:
+        """Stores a sent message (base64url MIME, as passed to messages.send) in `thread_id`'s thread."""
+        mime = message_from_bytes(base64.urlsafe_b64decode(raw.encode()))
+        with self.lock:
+            newest = int(self.messages[0]["internalDate"]) // 1000 if self.messages else 1700000000
+            msg = make_message(self.next_index, timestamp=newest + 60)
+            self.next_index += 1
+            headers = [{"name": "From", "value": "me@example.com"}]
+            headers += [{"name": name, "value": mime[name]} for name in ("To", "Subject", "In-Reply-To", "References") if mime[name]]
+            headers.append({"name": "Message-ID", "value": f"<{msg['id']}@mail.example.com>"})
+            msg["payload"]["headers"] = headers
+            msg["labelIds"] = ["SENT"]
+            if thread_id and any(m["threadId"] == thread_id for m in self.messages):
+                msg["threadId"] = thread_id
+            msg["historyId"] = self._record(messagesAdded=[{"message": self._stub(msg)}])
+            self.messages.insert(0, msg)
+            self.by_id[msg["id"]] = msg
+            return msg
+
+    def change_labels(self, msg: Dict, added: List[str] = (), removed: List[str] = ()):
+        with self.lock:
+            msg["labelIds"] = [label for label in msg["labelIds"] if label not in removed] + \
+                [label for label in added if label not in msg["labelIds"]]
+            change = {}
+            if added:
+                change["labelsAdded"] = [{"message": self._stub(msg), "labelIds": list(added)}]
+            if removed:
+                change["labelsRemoved"] = [{"message": self._stub(msg), "labelIds": list(removed)}]
+            msg["historyId"] = self._record(**change)
+
+    def remove(self, message_id: str):
+        """Permanently deletes a message."""
+        with self.lock:
+            msg = self.by_id.pop(message_id)
+            self.messages.remove(msg)
+            self._record(messagesDeleted=[{"message": self._stub(msg)}])
+
+    def expire_history(self):
+        """Forgets all history so older start IDs get a 404, as Gmail does after about a week."""
+        with self.lock:
+            self.history.clear()
+            self.history_id += 1
+            self.oldest_history_id = self.history_id
+
+    def matches(self, msg: Dict, query: Dict[str, List[str]]) -> bool:
+        labels = query.get("labelIds", [])
+        if any(label not in msg["labelIds"] for label in labels):
+            return False
+        q = (query.get("q") or [""])[0]
+        # from:/subject: terms, bare or quoted; other search terms are ignored
+        for operator, quoted, bare in SEARCH_TERM.findall(q):
+            header = "From" if operator == "from" else "Subject"
+            value = next(h["value"] for h in msg["payload"]["headers"] if h["name"] == header)
+            if (quoted or bare).lower() not in value.lower():
+                return False
+        return True
+
+
+def view_message(msg: Dict, fmt: str, metadata_headers: List[str]) -> Dict:
+    """Project a full message resource onto the requested `format`."""
+    if fmt == "minimal":
+        return {k: msg[k] for k in ("id", "threadId", "labelIds", "snippet", "historyId", "internalDate", "sizeEstimate")}
+    if fmt == "metadata":
+        view = {k: v for k, v in msg.items() if k != "payload"}
+        headers = msg["payload"]["headers"]
+        if metadata_headers:
+            wanted = {h.lower() for h in metadata_headers}
+            headers = [h for h in headers if h["name"].lower() in wanted]
+        view["payload"] = {"mimeType": msg["payload"]["mimeType"], "headers": headers}
+        return view
+    return msg
+
+
+# --- QUOTA ---
+RATE_LIMIT_ERROR = {"error": {
+    "code": 429,
+    "message": "User-rate limit exceeded.",
+    "errors": [{"domain": "usageLimits", "reason": "rateLimitExceeded", "message": "User-rate limit exceeded."}],
+}}
+
+
+class FakeQuota:
+    """Gmail-style per-user quota: a token bucket in quota units, plus optional random 429s."""
+
+    def __init__(self, units_per_second: Optional[float] = None, inject_rate: float = 0.0,
+                 retry_after: Optional[float] = None, seed: int = 13):
+        self.units_per_second = units_per_second
+        self.inject_rate = inject_rate
+        self.retry_after = retry_after
+        self.tokens = units_per_second or 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+
+    def allow(self, api_method: str) -> bool:
+        with self.lock:
+            if self.inject_rate and self.rng.random() < self.inject_rate:
+                return False
+            if not self.units_per_second:
+                return True
+            now = time.monotonic()
+            self.tokens = min(self.units_per_second, self.tokens + (now - self.updated) * self.units_per_second)
+            self.updated = now
+            cost = quota_units(api_method)
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+
+# --- ROUTING ---
+class FakeGmailApp:
+    """Request router shared by direct HTTP requests and batch sub-requests."""
+
+    PREFIX = "/gmail/v1/users/me/"
+
+    def __init__(self, mailbox: FakeMailbox, quota: Optional[FakeQuota] = None):
+        self.mailbox = mailbox
+        self.quota = quota
+        self.request_counts: Dict[str, int] = {}
+
+    @staticmethod
+    def api_method(parts: List[str]) -> str:
+        """Gmail method name for quota accounting."""
+        if parts == ["profile"]:
+            return "getProfile"
+        if parts == ["history"]:
+            return "history.list"
+        if parts == ["messages"]:
+            return "messages.list"
+        if parts[0] == "threads":
+            return "threads.get"
+        if len(parts) == 3 and parts[2] == "trash":
+            return "messages.trash"
+        if len(parts) == 2 and parts[1] in ("send", "batchModify", "batchDelete"):
+            return f"messages.{parts[1]}"
+        return "messages.get"
+
+    def count(self, name: str):
+        self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def route(self, method: str, path: str, query: Dict[str, List[str]], body: Optional[Dict],
+              account: str = "me@example.com") -> Tuple[int, Dict]:
+        if not path.startswith(self.PREFIX):
+            return 404, {"error": {"code": 404, "message": f"Unknown path {path}"}}
+        parts = path[len(self.PREFIX):].strip("/").split("/")
+
+        if self.quota is not None and not self.quota.allow(self.api_method(parts)):
+            self.count("rate_limited")
+            return 429, RATE_LIMIT_ERROR
+        if parts == ["messages"] and method == "GET":
+            self.count("messages.list")
+            return 200, self.list_messages(query)
+        if len(parts) == 2 and parts[0] == "messages" and method == "GET":
+            self.count("messages.get")
+            msg = self.mailbox.by_id.get(parts[1])
+            if msg is None:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            fmt = (query.get("format") or ["full"])[0]
+            return 200, view_message(msg, fmt, query.get("metadataHeaders", []))
+        if len(parts) == 3 and parts[0] == "messages" and parts[2] == "trash" and method == "POST":
+            self.count("messages.trash")
+            msg = self.mailbox.by_id.get(parts[1])
+            if msg is None:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            self.mailbox.change_labels(msg, added=["TRASH"], removed=[label for label in msg["labelIds"] if label == "INBOX"])
+            return 200, view_message(msg, "minimal", [])
+        if parts in (["messages", "batchModify"], ["messages", "batchDelete"]) and method == "POST":
+            return self.batch_change(parts[1], body or {})
+        if len(parts) == 2 and parts[0] == "threads" and method == "GET":
+            self.count("threads.get")
+            messages = self.mailbox.thread(parts[1])
+            if not messages:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            fmt = (query.get("format") or ["full"])[0]
+            return 200, {
+                "id": parts[1],
+                "historyId": max((m["historyId"] for m in messages), key=int),
+                "messages": [view_message(m, fmt, query.get("metadataHeaders", [])) for m in messages],
+            }
+        if parts == ["messages", "send"] and method == "POST":
+            self.count("messages.send")
+            if not (body or {}).get("raw"):
+                return 400, {"error": {"code": 400, "message": "Missing raw message"}}
+            msg = self.mailbox.add_sent(body["raw"], body.get("threadId"))
+            return 200, {"id": msg["id"], "threadId": msg["threadId"], "labelIds": ["SENT"]}
+        if parts == ["profile"] and method == "GET":
+            self.count("profile")
+            return 200, {
+                "emailAddress": account,
+                "messagesTotal": len(self.mailbox.messages),
+                "historyId": str(self.mailbox.history_id),
+            }
+        if parts == ["history"] and method == "GET":
+            self.count("history.list")
+            return self.list_history(query)
+        return 404, {"error": {"code": 404, "message": f"Unknown path {path}"}}
+
+    def batch_change(self, operation: str, body: Dict) -> Tuple[int, Optional[Dict]]:
+        """batchModify / batchDelete: up to 1000 IDs, unknown IDs are ignored, 204 with no body."""
+        self.count(f"messages.{operation}")
+        ids = body.get("ids") or []
+        if not ids or len(ids) > 1000:
+            return 400, {"error": {"code": 400, "message": "ids must contain between 1 and 1000 entries"}}
+        for message_id in ids:
+            msg = self.mailbox.by_id.get(message_id)
+            if msg is None:
+                continue
+            if operation == "batchDelete":
+                self.mailbox.remove(message_id)
+            else:
+                self.mailbox.change_labels(msg, added=body.get("addLabelIds") or [], removed=body.get("removeLabelIds") or [])
+        return 204, None
+
+    def list_history(self, query: Dict[str, List[str]]) -> Tuple[int, Dict]:
+        start_history_id = int((query.get("startHistoryId") or ["0"])[0])
+        if start_history_id < self.mailbox.oldest_history_id:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        max_results = int((query.get("maxResults") or ["100"])[0])
+        offset = int((query.get("pageToken") or ["0"])[0])
+        records = [h for h in self.mailbox.history if int(h["id"]) > start_history_id]
+        page = records[offset:offset + max_results]
+        result = {"historyId": str(self.mailbox.history_id)}
+        if page:
+            result["history"] = page
+        if offset + max_results < len(records):
+            result["nextPageToken"] = str(offset + max_results)
+        return 200, result
+
+    def list_messages(self, query: Dict[str, List[str]]) -> Dict:
+        max_results = int((query.get("maxResults") or ["100"])[0])
+        start = int((query.get("pageToken") or ["0"])[0])
+        matched = [m for m in self.mailbox.messages if self.mailbox.matches(m, query)]
+        page = matched[start:start + max_results]
+        result = {
+            "messages": [{"id": m["id"], "threadId": m["threadId"]} for m in page],
+            "resultSizeEstimate": len(matched),
+        }
+        if start + max_results < len(matched):
+            result["nextPageToken"] = str(start + max_results)
+        if not page:
+            del result["messages"]
+        return result
+
+
+def account_for_token(header: str) -> str:
+    """Profile address for a bearer token, so benchmarks can sign in as distinct users (token "alice" -> alice@example.com)."""
+    token = header[len("Bearer "):]
+    if not token or token.startswith("ya29.") or not re.fullmatch(r"[\w.-]+", token):
+        return "me@example.com"
+    return f"{token}@example.com"
+
+
+# --- HTTP SERVER ---
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, content_type: str, payload: bytes, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _dispatch(self, method: str):
+        server: "FakeGmailServer" = self.server.owner
+        raw = self._read_body()
+        parsed = urlparse(self.path)
+        if parsed.path == "/token" and method == "POST":
+            time.sleep(server.latency)
+            status, result = server.refresh_token(parse_qs(raw.decode()))
+            self._send(status, "application/json; charset=UTF-8", json.dumps(result).encode())
+            return
+        if not server.authorized(self.headers.get("Authorization", "")):
+            server.app.count("unauthorized")
+            payload = json.dumps({"error": {"code": 401, "message": "Invalid Credentials", "status": "UNAUTHENTICATED"}})
+            self._send(401, "application/json; charset=UTF-8", payload.encode())
+            return
+        if parsed.path in ("/batch", "/batch/gmail/v1") and method == "POST":
+            time.sleep(server.latency)
+            self._send(200, *server.handle_batch(self.headers.get("Content-Type", ""), raw))
+            return
+        time.sleep(server.latency + server.per_item_cost)
+        body = json.loads(raw) if raw else None
+        status, result = server.app.route(method, parsed.path, parse_qs(parsed.query), body,
+                                          account_for_token(self.headers.get("Authorization", "")))
+        payload = json.dumps(result).encode() if result is not None else b""
+        self._send(status, "application/json; charset=UTF-8", payload, server.error_headers(status))
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class FakeGmailServer:
+    """Threaded HTTP server wrapping `FakeGmailApp` with configurable latency."""
+
+    def __init__(self, mailbox_size: int = 200, latency: float = 0.03, per_item_cost: float = 0.001,
+                 attachment_bytes: int = 0, host: str = "127.0.0.1", port: int = 0,
+                 quota_per_second: Optional[float] = None, inject_429: float = 0.0, retry_after: Optional[float] = None,
+                 token_ttl: Optional[float] = None):
+        self.mailbox = FakeMailbox(mailbox_size, attachment_bytes)
+        quota = None
+        if quota_per_second or inject_429:
+            quota = FakeQuota(quota_per_second, inject_429, retry_after)
+        self.app = FakeGmailApp(self.mailbox, quota)
+        self.latency = latency
+        self.per_item_cost = per_item_cost
+        self.token_ttl = token_ttl
+        self.tokens: Dict[str, float] = {}
+        self._token_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "FakeGmailServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def token_uri(self) -> str:
+        return f"{self.base_url}token"
+
+    def issue_token(self) -> Dict:
+        """Mints an access token valid for `token_ttl` seconds, as a token endpoint response."""
+        token = f"ya29.fake-{random.getrandbits(64):016x}"
+        with self._token_lock:
+            self.tokens[token] = time.monotonic() + self.token_ttl
+        return {"access_token": token, "expires_in": self.token_ttl, "token_type": "Bearer"}
+
+    def refresh_token(self, form: Dict[str, List[str]]) -> Tuple[int, Dict]:
+        self.app.count("token")
+        if self.token_ttl is None:
+            return 404, {"error": "not_found"}
+        if (form.get("grant_type") or [""])[0] != "refresh_token" or not form.get("refresh_token"):
+            return 400, {"error": "invalid_grant", "error_description": "Bad Request"}
+        return 200, self.issue_token()
+
+    def authorized(self, header: str) -> bool:
+        if self.token_ttl is None:
+            return True
+        expires_at = self.tokens.get(header[len("Bearer "):])
+        return expires_at is not None and time.monotonic() < expires_at
+
+    def error_headers(self, status: int) -> Dict[str, str]:
+        quota = self.app.quota
+        if status == 429 and quota is not None and quota.retry_after:
+            return {"Retry-After": f"{quota.retry_after:g}"}
+        return {}
+
+    def handle_batch(self, content_type: str, raw: bytes) -> Tuple[str, bytes]:
+        """Answer a multipart/mixed batch the way Gmail's `/batch` endpoint does."""
+        self.app.count("batch")
+        envelope = Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n" + raw.decode("utf-8"))
+        boundary = "batch_fake_gmail_boundary"
+        out = []
+        for part in envelope.get_payload():
+            content_id = part["Content-ID"] or ""
+            request_line, _, rest = part.get_payload().partition("\n")
+            method, target, _ = request_line.strip().split(" ", 2)
+            _, _, sub_body = rest.replace("\r\n", "\n").partition("\n\n")
+            parsed = urlparse(target)
+            time.sleep(self.per_item_cost)
+            status, result = self.app.route(
+                method, parsed.path, parse_qs(parsed.query), json.loads(sub_body) if sub_body.strip() else None
+            )
+            payload = json.dumps(result)
+            reason = "OK" if status < 300 else "Error"
+            extra = "".join(f"{name}: {value}\r\n" for name, value in self.error_headers(status).items())
+            out.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"{extra}"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n"
+                f"{payload}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(out).encode("utf-8")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake Gmail API server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mailbox-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    fake = FakeGmailServer(mailbox_size=args.mailbox_size, latency=args.latency, port=args.port)
+    print(f"Fake Gmail listening on {fake.base_url}")
+    fake.httpd.serve_forever()
@@ -0,0 +1,137 @@
+"""
+A fake Mistral chat completions server used by the benchmarks.
+
+Responses are delayed by a fixed time-to-first-token plus the time it takes
+to "generate" `reply_tokens` tokens at `tokens_per_second`. Requests with
+`stream: true` get the tokens as server-sent events at that rate; streams
+the client abandons are counted in `app.state.cancelled_streams`.
+
+With `prefill_tokens_per_second` set, reading the prompt also takes time:
+its estimated token count (about four characters per token, also reported as
+`usage.prompt_tokens`) divided by that rate, as it does for a real model.
+
+Usage:
+    server = FakeMistralServer(latency=0.2, tokens_per_second=200).start()
+    ...  # POST to server.endpoint
+    server.stop()
+"""
+import asyncio
+import json
+import time
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from bench.harness import ServerThread
+
+REPLY_WORDS = (
+    "Thank you for your email. I have reviewed the details and will follow up "
+    "with the requested information by the end of the week. Best regards"
+).split()
+
+
+def make_reply(tokens: int) -> str:
+    return " ".join(REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(tokens))
+
+
+def prompt_tokens(payload: Dict) -> int:
+    return sum(len(m.get("content") or "") for m in payload.get("messages", [])) // 4
+
+
+def create_app(latency: float = 0.2, tokens_per_second: float = 200.0, reply_tokens: int = 60,
+               prefill_tokens_per_second: Optional[float] = None) -> FastAPI:
+    app = FastAPI()
+    app.state.request_count = 0
+    app.state.cancelled_streams = 0
+    app.state.last_payload = None
+
+    def prefill_seconds(payload: Dict) -> float:
+        return prompt_tokens(payload) / prefill_tokens_per_second if prefill_tokens_per_second else 0.0
+
+    async def stream_tokens(model: str, completion_id: str, prefill: float):
+        await asyncio.sleep(latency + prefill)
+        try:
+            for i in range(reply_tokens):
+                word = REPLY_WORDS[i % len(REPLY_WORDS)]
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1 / tokens_per_second)
+            yield "data: [DONE]\n\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            app.state.cancelled_streams += 1
+            raise
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        app.state.request_count += 1
+        app.state.last_payload = payload
+        completion_id = f"cmpl-{app.state.request_count}"
+        if payload.get("stream"):
+            return StreamingResponse(stream_tokens(payload.get("model"), completion_id, prefill_seconds(payload)),
+                                     media_type="text/event-stream")
+        await asyncio.sleep(latency + prefill_seconds(payload) + reply_tokens / tokens_per_second)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": make_reply(reply_tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens(payload), "completion_tokens": reply_tokens,
+                      "total_tokens": prompt_tokens(payload) + reply_tokens},
+        }
+
+    return app
+
+
+class FakeMistralServer(ServerThread):
+    """Runs the fake Mistral app under uvicorn on a background thread."""
+
+    def __init__(self, latency: float = 0.2, tokens_per_second: float = 200.0, reply_tokens: int = 60, port: int = 0,
+                 prefill_tokens_per_second: Optional[float] = None, **server_kwargs):
+        self.app = create_app(latency, tokens_per_second, reply_tokens, prefill_tokens_per_second)
+        super().__init__(self.app, port=port, **server_kwargs)
+
+    @property
+    def request_count(self) -> int:
+        return self.app.state.request_count
+
+    @property
+    def cancelled_streams(self) -> int:
+        return self.app.state.cancelled_streams
+
+    @property
+    def last_payload(self):
+        """The most recent chat completion request body."""
+        return self.app.state.last_payload
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.base_url}v1/chat/completions"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake Mistral API server")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    args = parser.parse_args()
+    server = FakeMistralServer(args.latency, args.tokens_per_second, port=args.port).start()
+    print(f"Fake Mistral listening on {server.endpoint}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
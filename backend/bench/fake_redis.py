@@ -0,0 +1,192 @@
+"""
+A small in-process stand-in for a Redis server, used by the benchmarks.
+
+It speaks RESP2 over TCP and implements the commands `RedisStateStore`
+sends (strings with PX expiry, sets, lists) plus PING, AUTH, SELECT and
+FLUSHDB. State is a dict guarded by one lock, shared by all connections, so
+several backend workers pointed at it share state as they would with Redis.
+
+Usage:
+    server = FakeRedisServer().start()
+    ...  # REDIS_URL=server.url
+    server.stop()
+"""
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class FakeRedis:
+    """Command implementations over a dict of key -> (value, expires_at)."""
+
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[object, Optional[float]]] = {}
+        self.lock = threading.Lock()
+        self.command_count = 0
+
+    def _get(self, key: bytes, kind: type):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        if not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def execute(self, args: List[bytes]):
+        name = args[0].upper().decode()
+        with self.lock:
+            self.command_count += 1
+            handler = getattr(self, f"cmd_{name.lower()}", None)
+            if handler is None:
+                return Exception(f"ERR unknown command '{name}'")
+            try:
+                return handler(*args[1:])
+            except TypeError as e:
+                return Exception(str(e) if "WRONGTYPE" in str(e) else f"ERR wrong number of arguments for '{name}'")
+
+    def cmd_ping(self, *args):
+        return "PONG"
+
+    def cmd_auth(self, *args):
+        return "OK"
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_flushdb(self):
+        self.data.clear()
+        return "OK"
+
+    def cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def cmd_set(self, key, value, *options):
+        expires_at = None
+        if options and options[0].upper() in (b"PX", b"EX"):
+            scale = 1000 if options[0].upper() == b"PX" else 1
+            expires_at = time.time() + int(options[1]) / scale
+        self.data[key] = (value, expires_at)
+        return "OK"
+
+    def cmd_del(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._get(key, object) is not None)
+
+    def cmd_sadd(self, key, *members):
+        members_set = self._get(key, set)
+        if members_set is None:
+            members_set = set()
+            self.data[key] = (members_set, None)
+        before = len(members_set)
+        members_set.update(members)
+        return len(members_set) - before
+
+    def cmd_srem(self, key, *members):
+        members_set = self._get(key, set) or set()
+        before = len(members_set)
+        members_set.difference_update(members)
+        return before - len(members_set)
+
+    def cmd_smembers(self, key):
+        return sorted(self._get(key, set) or set())
+
+    def cmd_rpush(self, key, *values):
+        items = self._get(key, list)
+        if items is None:
+            items = []
+            self.data[key] = (items, None)
+        items.extend(values)
+        return len(items)
+
+    def cmd_ltrim(self, key, start, stop):
+        items = self._get(key, list)
+        if items is not None:
+            items[:] = self._range(items, int(start), int(stop))
+        return "OK"
+
+    def cmd_lrange(self, key, start, stop):
+        return self._range(self._get(key, list) or [], int(start), int(stop))
+
+    @staticmethod
+    def _range(items: List, start: int, stop: int) -> List:
+        length = len(items)
+        start = max(0, start + length if start < 0 else start)
+        stop = stop + length if stop < 0 else stop
+        return items[start:stop + 1]
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        redis: FakeRedis = self.server.redis
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.wfile.write(encode(redis.execute(args)))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeRedisServer:
+    """Threaded TCP server wrapping `FakeRedis`."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = _Server((host, port), _Handler)
+        self.server.redis = FakeRedis()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def redis(self) -> FakeRedis:
+        return self.server.redis
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "FakeRedisServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
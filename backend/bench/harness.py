@@ -0,0 +1,127 @@
+"""
+Shared plumbing for the benchmarks: background servers, a backend process
+runner and latency statistics.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s")
+
+
+class ServerThread:
+    """Runs an ASGI app under uvicorn on a daemon thread."""
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 0,
+                 ssl_certfile: Optional[str] = None, ssl_keyfile: Optional[str] = None):
+        self.host = host
+        self.port = port or free_port()
+        self.scheme = "https" if ssl_certfile else "http"
+        config = uvicorn.Config(app, host=host, port=self.port, log_level="warning", backlog=4096,
+                                ssl_certfile=ssl_certfile, ssl_keyfile=ssl_keyfile)
+        self.server = uvicorn.Server(config)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.scheme}://{self.host}:{self.port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+        self._thread.start()
+        wait_for_port(self.port)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+class BackendProcess:
+    """
+    Runs `main_new:app` from `app_dir` in a uvicorn subprocess.
+
+    The process gets its own working directory with a throwaway
+    `client_secret.json`, so `/auth/google` works without real Google config.
+    """
+
+    def __init__(self, env: Dict[str, str], app_dir: str = BACKEND_DIR, port: int = 0, workers: int = 1):
+        self.app_dir = os.path.abspath(app_dir)
+        self.port = port or free_port()
+        self.workers = workers
+        self.env = {**os.environ, **env}
+        self.workdir = tempfile.mkdtemp(prefix="email-bench-")
+        self.proc: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        with open(os.path.join(self.workdir, "client_secret.json"), "w") as f:
+            json.dump({"web": {
+                "client_id": "bench-client",
+                "client_secret": "bench-secret",
+                "token_uri": self.env.get("BENCH_TOKEN_URI", "http://127.0.0.1:9/token"),
+                "redirect_uris": ["http://localhost:5173/"],
+            }}, f)
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main_new:app", "--app-dir", self.app_dir,
+             "--port", str(self.port), "--log-level", "warning", "--workers", str(self.workers)],
+            cwd=self.workdir, env=self.env, stdout=subprocess.DEVNULL,
+        )
+        wait_for_port(self.port)
+        return self
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max in milliseconds."""
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000 if samples else float("nan"),
+    }
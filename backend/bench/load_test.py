@@ -0,0 +1,106 @@
+"""
+Load test: concurrent `/emails/generate-reply` calls against a slow fake Mistral.
+
+While each burst of reply requests is in flight, a probe keeps calling the
+cheap `/chatbot/history` endpoint; with blocking handlers its latency climbs
+once the threadpool is exhausted, with async handlers it stays flat.
+
+Run from the backend directory:
+    python -m bench.load_test --concurrency 10 50 100 200 --mistral-latency 1.0
+
+To measure the "before" numbers, point --app-dir at another checkout, e.g.
+    git worktree add /tmp/email-baseline <commit>
+    python -m bench.load_test --app-dir /tmp/email-baseline/backend
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from bench.fake_gmail import FakeGmailServer
+from bench.fake_mistral import FakeMistralServer
+from bench.harness import BACKEND_DIR, BackendProcess, latency_summary
+
+EMAIL_TEXT = "Hi, can you send me the quarterly report before Friday's meeting? Thanks, Sarah"
+
+
+async def timed(client: httpx.AsyncClient, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    try:
+        resp = await client.request(method, url, **kwargs)
+        ok = resp.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+async def probe(client: httpx.AsyncClient, url: str, stop: asyncio.Event, samples: list, interval: float):
+    while not stop.is_set():
+        ok, elapsed = await timed(client, "GET", url)
+        if ok:
+            samples.append(elapsed)
+        await asyncio.sleep(interval)
+
+
+async def burst(base_url: str, concurrency: int, probe_interval: float):
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        probe_samples = []
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe(client, f"{base_url}/chatbot/history", stop, probe_samples, probe_interval))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            timed(client, "POST", f"{base_url}/emails/generate-reply", json={"content": EMAIL_TEXT})
+            for _ in range(concurrency)
+        ))
+        wall = time.perf_counter() - start
+        stop.set()
+        await prober
+    latencies = [elapsed for ok, elapsed in results if ok]
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "wall_s": wall,
+        "throughput_rps": len(latencies) / wall,
+        "reply": latency_summary(latencies),
+        "probe": latency_summary(probe_samples),
+    }
+
+
+async def run(args):
+    mistral = FakeMistralServer(latency=args.mistral_latency, tokens_per_second=args.tokens_per_second).start()
+    gmail = FakeGmailServer(latency=args.gmail_latency).start()
+    backend = BackendProcess({
+        "MISTRAL_API_KEY": "bench-key",
+        "MISTRAL_API_URL": mistral.endpoint,
+        "GMAIL_API_URL": gmail.base_url,
+    }, app_dir=args.app_dir).start()
+    try:
+        print(f"app_dir={backend.app_dir} mistral_latency={args.mistral_latency}s")
+        print(f"{'conc':>5} {'ok':>5} {'wall_s':>7} {'rps':>7} {'reply_p50':>10} {'reply_p95':>10} {'probe_p50':>10} {'probe_max':>10}")
+        for concurrency in args.concurrency:
+            row = await burst(backend.base_url, concurrency, args.probe_interval)
+            print(f"{row['concurrency']:>5} {row['ok']:>5} {row['wall_s']:>7.2f} {row['throughput_rps']:>7.1f} "
+                  f"{row['reply']['p50_ms']:>8.0f}ms {row['reply']['p95_ms']:>8.0f}ms "
+                  f"{row['probe']['p50_ms']:>8.0f}ms {row['probe']['max_ms']:>8.0f}ms")
+    finally:
+        backend.stop()
+        gmail.stop()
+        mistral.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app-dir", default=BACKEND_DIR, help="directory containing main_new.py")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--mistral-latency", type=float, default=1.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--gmail-latency", type=float, default=0.03)
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
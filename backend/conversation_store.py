@@ -0,0 +1,168 @@
+"""
+Chatbot conversation memory.
+
+`InMemoryConversationStore` (STATE_BACKEND=memory) keeps each user's last
+`max_messages` turns in a `deque(maxlen=...)` of `__slots__` records, so
+appending and trimming are O(1) and a user's memory is bounded. Each
+conversation also keeps a pointer to the last action taken and memoizes its
+rendered prompt context until the next append. With a memory governor, each
+conversation is charged at its size and idle users' conversations can be
+evicted.
+
+`SharedConversationStore` keeps conversations in the shared state store
+(sqlite/redis) so every worker sees them, and stores the last action under
+its own key so reading it doesn't scan the history.
+"""
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from memory_governor import estimate_size
+from state_store import InMemoryStateStore
+
+CONVERSATION_MAX_MESSAGES = 20
+
+
+def render_context(turns: Iterable[Tuple[str, str]]) -> str:
+    """Formats (role, content) pairs as the prompt's conversation context."""
+    lines = [f"{role}: {content}\n" for role, content in turns]
+    return "Recent conversation:\n" + "".join(lines) if lines else ""
+
+
+class ConversationMessage:
+    """One chatbot turn. The timestamp is kept as a float and formatted on read."""
+
+    __slots__ = ("role", "content", "timestamp", "action_taken")
+
+    def __init__(self, role: str, content: str, action_taken: Optional[str] = None, timestamp: Optional[float] = None):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.action_taken = action_taken
+
+    def to_dict(self) -> Dict:
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat(),
+            "action_taken": self.action_taken,
+        }
+
+
+class Conversation:
+    """A user's bounded history, last action and memoized context."""
+
+    __slots__ = ("messages", "last_action", "_context_n", "_context", "_message_bytes")
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.last_action: Optional[str] = None
+        self._context_n = 0
+        self._context: Optional[str] = None
+        self._message_bytes = 0
+
+    def append(self, message: ConversationMessage):
+        # Sizes are kept incrementally so charging the governor stays O(1)
+        if len(self.messages) == self.messages.maxlen:
+            self._message_bytes -= estimate_size(self.messages[0])
+        self.messages.append(message)
+        self._message_bytes += estimate_size(message)
+        if message.action_taken:
+            self.last_action = message.action_taken
+        self._context = None
+
+    @property
+    def nbytes(self) -> int:
+        context_bytes = sys.getsizeof(self._context) if self._context is not None else 0
+        return sys.getsizeof(self) + sys.getsizeof(self.messages) + self._message_bytes + context_bytes
+
+    def context(self, last_n: int) -> str:
+        if self._context is None or self._context_n != last_n:
+            recent = list(islice(reversed(self.messages), last_n))
+            self._context = render_context((msg.role, msg.content) for msg in reversed(recent))
+            self._context_n = last_n
+        return self._context
+
+
+class InMemoryConversationStore:
+    """Per-process conversations for single-worker setups."""
+
+    def __init__(self, max_messages: int = CONVERSATION_MAX_MESSAGES, governor=None):
+        self.max_messages = max_messages
+        self._conversations: Dict[str, Conversation] = {}
+        self.governor = governor
+        if governor is not None:
+            governor.register("conversations", lambda user_id: self._conversations.pop(user_id, None))
+
+    def _get(self, user_id: str) -> Optional[Conversation]:
+        conversation = self._conversations.get(user_id)
+        if conversation is not None and self.governor is not None:
+            self.governor.touch("conversations", user_id)
+        return conversation
+
+    def append(self, user_id: str, role: str, content: str, action_taken: Optional[str] = None):
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = self._conversations[user_id] = Conversation(self.max_messages)
+        conversation.append(ConversationMessage(role, content, action_taken))
+        if self.governor is not None:
+            self.governor.charge("conversations", user_id, conversation.nbytes)
+
+    def history(self, user_id: str) -> List[Dict]:
+        conversation = self._get(user_id)
+        return [msg.to_dict() for msg in conversation.messages] if conversation else []
+
+    def context(self, user_id: str, last_n: int = 5) -> str:
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return ""
+        context = conversation.context(last_n)
+        if self.governor is not None:
+            # Charged rather than touched: the memoized context counts too
+            self.governor.charge("conversations", user_id, conversation.nbytes)
+        return context
+
+    def last_action(self, user_id: str) -> Optional[str]:
+        conversation = self._get(user_id)
+        return conversation.last_action if conversation else None
+
+    def clear(self, user_id: str):
+        self._conversations.pop(user_id, None)
+        if self.governor is not None:
+            self.governor.release("conversations", user_id)
+
+
+class SharedConversationStore:
+    """Conversations in a shared state store, visible to every worker."""
+
+    def __init__(self, state, max_messages: int = CONVERSATION_MAX_MESSAGES):
+        self.state = state
+        self.max_messages = max_messages
+
+    def append(self, user_id: str, role: str, content: str, action_taken: Optional[str] = None):
+        self.state.append("conversation", user_id, ConversationMessage(role, content, action_taken).to_dict(), self.max_messages)
+        if action_taken:
+            self.state.set("last_action", user_id, action_taken)
+
+    def history(self, user_id: str) -> List[Dict]:
+        return self.state.get_list("conversation", user_id)
+
+    def context(self, user_id: str, last_n: int = 5) -> str:
+        return render_context((msg["role"], msg["content"]) for msg in self.state.get_list("conversation", user_id, last_n))
+
+    def last_action(self, user_id: str) -> Optional[str]:
+        return self.state.get("last_action", user_id)
+
+    def clear(self, user_id: str):
+        self.state.delete("conversation", user_id)
+        self.state.delete("last_action", user_id)
+
+
+def create_conversation_store(state, max_messages: int = CONVERSATION_MAX_MESSAGES, governor=None):
+    """In-process deques for the memory state backend, the shared store otherwise."""
+    if isinstance(state, InMemoryStateStore):
+        return InMemoryConversationStore(max_messages, governor)
+    return SharedConversationStore(state, max_messages)
@@ -0,0 +1,238 @@
+"""
+Client-side Gmail quota limiting and retry policy.
+
+Gmail meters each user in quota units (250 units/user/second by default),
+and each method has its own cost: messages.get and messages.list cost 5,
+messages.send costs 100, and so on. `GmailQuota` keeps one token bucket
+per user, refilled at GMAIL_QUOTA_PER_SECOND, and every call waits for its
+units before it is sent. Sub-requests of a batch are charged individually,
+as Gmail does.
+
+When Gmail still answers 429 (or 403 rateLimitExceeded / userRateLimitExceeded),
+`RetryPolicy` retries with exponential backoff and full jitter. A Retry-After
+header overrides the computed delay, and it also pauses the user's bucket so
+concurrent calls back off together instead of all retrying at once.
+
+With a memory governor (`use_governor`), each user's bucket and usage are
+charged to it and dropped when it evicts them; the evicted usage is folded
+into `totals()` so the exported counters never go backwards.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Dict, Optional
+
+from memory_governor import estimate_size
+
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.send": 100,
+    "messages.trash": 5,
+    "messages.modify": 5,
+    "messages.batchModify": 50,
+    "messages.batchDelete": 50,
+    "history.list": 2,
+    "threads.get": 10,
+    "threads.list": 10,
+    "drafts.create": 10,
+}
+DEFAULT_UNITS = 5
+
+GMAIL_QUOTA_PER_SECOND = float(os.getenv("GMAIL_QUOTA_PER_SECOND", "250"))
+GMAIL_QUOTA_BURST = float(os.getenv("GMAIL_QUOTA_BURST", str(GMAIL_QUOTA_PER_SECOND)))
+GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", "5"))
+GMAIL_BACKOFF_BASE = float(os.getenv("GMAIL_BACKOFF_BASE", "0.5"))
+GMAIL_BACKOFF_MAX = float(os.getenv("GMAIL_BACKOFF_MAX", "32"))
+
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def quota_units(api_method: str) -> int:
+    return QUOTA_UNITS.get(api_method, DEFAULT_UNITS)
+
+
+def is_rate_limited(status_code: int, reason: Optional[str] = None) -> bool:
+    return status_code == 429 or (status_code == 403 and reason in RATE_LIMIT_REASONS)
+
+
+def new_usage() -> Dict:
+    return {
+        "calls": 0, "units": 0, "throttled_waits": 0, "wait_seconds": 0.0,
+        "rate_limited": 0, "retries": 0, "by_method": {},
+    }
+
+
+def add_usage(total: Dict, usage: Dict):
+    for key, value in usage.items():
+        if key == "by_method":
+            for method, units in value.items():
+                total["by_method"][method] = total["by_method"].get(method, 0) + units
+        else:
+            total[key] += value
+
+
+def is_retryable(status_code: int, reason: Optional[str] = None) -> bool:
+    return status_code in RETRYABLE_STATUS or is_rate_limited(status_code, reason)
+
+
+class TokenBucket:
+    """
+    Refills at `rate` units per second up to `capacity`. A single call costing
+    more than `capacity` (a large batch) waits for a full bucket and goes into debt.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost: float) -> float:
+        """Takes `cost` units, sleeping as needed; returns the seconds waited."""
+        waited = 0.0
+        # The lock keeps waiters in FIFO order so a big batch can't be starved by small calls
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(0.0, self.paused_until - now)
+                if not delay:
+                    needed = min(cost, self.capacity)
+                    if self.tokens >= needed:
+                        self.tokens -= cost
+                        return waited
+                    delay = (needed - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def pause(self, seconds: float):
+        """Blocks new acquisitions for `seconds` (Gmail asked us to back off)."""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def available(self) -> float:
+        self._refill(time.monotonic())
+        return self.tokens
+
+
+class GmailQuota:
+    """Per-user token buckets in Gmail quota units, plus usage counters."""
+
+    def __init__(self, rate: float = GMAIL_QUOTA_PER_SECOND, burst: float = GMAIL_QUOTA_BURST, enabled: bool = True):
+        self.rate = rate
+        self.burst = burst
+        self.enabled = enabled
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._usage: Dict[str, Dict] = {}
+        # Usage of users the governor has evicted
+        self._evicted_usage = new_usage()
+        self.governor = None
+
+    def use_governor(self, governor):
+        """Charges each user's bucket and usage to `governor`, which may evict idle users."""
+        self.governor = governor
+        governor.register("gmail_quota", self._evict)
+
+    def _evict(self, user_key: str):
+        self._buckets.pop(user_key, None)
+        usage = self._usage.pop(user_key, None)
+        if usage is not None:
+            add_usage(self._evicted_usage, usage)
+
+    def _charge(self, user_key: str):
+        if self.governor is not None:
+            size = estimate_size(self._usage.get(user_key)) + estimate_size(self._buckets.get(user_key))
+            self.governor.charge("gmail_quota", user_key, size)
+
+    def bucket(self, user_key: str) -> TokenBucket:
+        if user_key not in self._buckets:
+            self._buckets[user_key] = TokenBucket(self.rate, self.burst)
+            self._charge(user_key)
+        return self._buckets[user_key]
+
+    def usage(self, user_key: str) -> Dict:
+        if user_key not in self._usage:
+            self._usage[user_key] = new_usage()
+            self._charge(user_key)
+        return self._usage[user_key]
+
+    async def acquire(self, user_key: str, api_method: str, count: int = 1) -> float:
+        """Charges `count` calls of `api_method` to the user's budget, waiting if it is spent."""
+        units = quota_units(api_method) * count
+        usage = self.usage(user_key)
+        if api_method not in usage["by_method"]:
+            usage["by_method"][api_method] = 0
+            self._charge(user_key)
+        elif self.governor is not None:
+            self.governor.touch("gmail_quota", user_key)
+        usage["calls"] += count
+        usage["units"] += units
+        usage["by_method"][api_method] += units
+        if not self.enabled:
+            return 0.0
+        waited = await self.bucket(user_key).acquire(units)
+        if waited:
+            usage["throttled_waits"] += 1
+            usage["wait_seconds"] += waited
+        return waited
+
+    def record_rate_limited(self, user_key: str, retry_after: Optional[float]):
+        self.usage(user_key)["rate_limited"] += 1
+        if self.enabled and retry_after:
+            self.bucket(user_key).pause(retry_after)
+
+    def record_retry(self, user_key: str):
+        self.usage(user_key)["retries"] += 1
+
+    def totals(self) -> Dict:
+        """Usage summed over every user, including users since evicted."""
+        total = new_usage()
+        for usage in [self._evicted_usage, *list(self._usage.values())]:
+            add_usage(total, usage)
+        return total
+
+    def snapshot(self, user_key: Optional[str] = None) -> Dict:
+        """Budget and usage for one user, or for every user currently tracked."""
+        keys = [user_key] if user_key else list(self._usage)
+        users = {}
+        for key in keys:
+            bucket = self._buckets.get(key)
+            users[key] = {
+                # Read-only: asking about a user must not start tracking them
+                **self._usage.get(key, new_usage()),
+                "available_units": round(bucket.available(), 1) if bucket else self.burst,
+                "paused_for": round(max(0.0, bucket.paused_until - time.monotonic()), 3) if bucket else 0.0,
+            }
+        return {"enabled": self.enabled, "units_per_second": self.rate, "burst": self.burst, "users": users}
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter; a Retry-After value takes precedence."""
+
+    def __init__(self, max_retries: int = GMAIL_MAX_RETRIES, base: float = GMAIL_BACKOFF_BASE, cap: float = GMAIL_BACKOFF_MAX):
+        self.max_retries = max_retries
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after:
+            return retry_after + random.uniform(0, self.base)
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+# Shared by every AsyncGmailClient unless one is passed explicitly
+gmail_quota = GmailQuota()
+default_retry_policy = RetryPolicy()
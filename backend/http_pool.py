@@ -0,0 +1,144 @@
+"""
+Pooled keep-alive HTTP clients for every upstream the backend calls.
+
+Each upstream gets its own `httpx.AsyncClient` ("gmail", "mistral", "oauth"),
+so one slow host cannot take all the connections another host needs. Pool
+sizes come from HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE and can be set per
+pool, e.g. MISTRAL_POOL_MAX_CONNECTIONS. HTTP/2 is negotiated when the `h2`
+package is installed (pip install "httpx[http2]") unless HTTP2=0.
+
+Every request carries an httpcore trace hook that counts new TCP
+connections and TLS handshakes per host, so `pool_stats()` can report how
+often connections were reused and how much handshake time that saved.
+"""
+import os
+import time
+from typing import Dict
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.getenv("HTTP2", "1") != "0"
+
+
+def pool_limits(pool: str) -> httpx.Limits:
+    """Connection limits for a pool, with optional <POOL>_POOL_MAX_CONNECTIONS / _MAX_KEEPALIVE overrides."""
+    prefix = f"{pool.upper()}_POOL_"
+    return httpx.Limits(
+        max_connections=int(os.getenv(prefix + "MAX_CONNECTIONS", str(HTTP_MAX_CONNECTIONS))),
+        max_keepalive_connections=int(os.getenv(prefix + "MAX_KEEPALIVE", str(HTTP_MAX_KEEPALIVE))),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+class PoolMetrics:
+    """Per-host request, connection and handshake counters fed by httpcore trace events."""
+
+    def __init__(self):
+        self.hosts: Dict[str, Dict] = {}
+
+    def host(self, pool: str, host: str) -> Dict:
+        key = f"{pool}:{host}"
+        if key not in self.hosts:
+            self.hosts[key] = {
+                "requests": 0, "connections_opened": 0, "tls_handshakes": 0,
+                "connect_seconds": 0.0, "tls_seconds": 0.0, "http_versions": {},
+            }
+        return self.hosts[key]
+
+    def tracer(self, stats: Dict):
+        started: Dict[str, float] = {}
+
+        async def trace(event: str, info: Dict):
+            if event.endswith(".started"):
+                started[event[:-len(".started")]] = time.perf_counter()
+            elif event == "connection.connect_tcp.complete":
+                stats["connections_opened"] += 1
+                stats["connect_seconds"] += time.perf_counter() - started.pop("connection.connect_tcp", time.perf_counter())
+            elif event == "connection.start_tls.complete":
+                stats["tls_handshakes"] += 1
+                stats["tls_seconds"] += time.perf_counter() - started.pop("connection.start_tls", time.perf_counter())
+
+        return trace
+
+    def snapshot(self) -> Dict:
+        hosts = {}
+        for key, stats in self.hosts.items():
+            requests = stats["requests"]
+            opened = stats["connections_opened"]
+            hosts[key] = {
+                **stats,
+                "reused_requests": max(0, requests - opened),
+                "reuse_ratio": (requests - opened) / requests if requests else None,
+                "avg_connect_ms": stats["connect_seconds"] / opened * 1000 if opened else None,
+                "avg_tls_ms": stats["tls_seconds"] / stats["tls_handshakes"] * 1000 if stats["tls_handshakes"] else None,
+            }
+        return hosts
+
+
+pool_metrics = PoolMetrics()
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _hooks(pool: str) -> Dict:
+    async def on_request(request: httpx.Request):
+        stats = pool_metrics.host(pool, request.url.host)
+        stats["requests"] += 1
+        request.extensions["trace"] = pool_metrics.tracer(stats)
+
+    async def on_response(response: httpx.Response):
+        stats = pool_metrics.host(pool, response.request.url.host)
+        stats["http_versions"][response.http_version] = stats["http_versions"].get(response.http_version, 0) + 1
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def create_http_client(pool: str, **kwargs) -> httpx.AsyncClient:
+    """Builds a client with the pool's limits and reuse metrics; `kwargs` override httpx settings."""
+    settings = {"limits": pool_limits(pool), "timeout": HTTP_TIMEOUT, "http2": HTTP2_ENABLED, **kwargs}
+    return httpx.AsyncClient(event_hooks=_hooks(pool), **settings)
+
+
+def get_http_client(pool: str = "default") -> httpx.AsyncClient:
+    """Returns the process-wide pooled client for `pool`, creating it on first use."""
+    client = _clients.get(pool)
+    if client is None or client.is_closed:
+        client = create_http_client(pool)
+        _clients[pool] = client
+    return client
+
+
+async def close_http_client():
+    """Closes every pooled client; called on application shutdown."""
+    for pool in list(_clients):
+        await _clients.pop(pool).aclose()
+
+
+def pool_stats() -> Dict:
+    """Pool configuration plus per-host connection reuse metrics."""
+    return {
+        "http2": HTTP2_ENABLED,
+        "http2_available": HTTP2_AVAILABLE,
+        "pools": {
+            pool: {
+                "open": not client.is_closed,
+                "max_connections": pool_limits(pool).max_connections,
+                "max_keepalive": pool_limits(pool).max_keepalive_connections,
+            }
+            for pool, client in _clients.items()
+        },
+        "hosts": pool_metrics.snapshot(),
+    }
@@ -0,0 +1,153 @@
+"""
+Precompiled, single-pass intent and entity matcher for chatbot commands.
+
+All intent keywords and entity patterns are folded into one regular
+expression at import time. A single `finditer` pass over the lower-cased
+command yields every keyword hit and entity span; intent scores are the
+share of an intent's distinct keywords that matched, as before, but
+keywords now only match on word boundaries ("hi" no longer fires on
+"this").
+"""
+import re
+from typing import Dict, List, Optional
+
+# Ordered: on equal scores the earlier intent wins.
+INTENT_KEYWORDS = {
+    "greet": ["hello", "hi", "hey", "greetings", "good morning", "good afternoon"],
+    "help": ["help", "what can you do", "commands", "how to", "guide", "explain"],
+    "fetch_emails": ["fetch", "read", "get", "show", "display", "list", "check", "see"],
+    "delete_email": ["delete", "remove", "trash", "get rid of"],
+    "generate_reply": ["reply", "respond", "answer", "draft", "compose"],
+    "send_email": ["send", "deliver", "dispatch"],
+    "search_email": ["search", "find", "look for", "locate"],
+    "status": ["status", "what did you do", "last action", "what happened"],
+}
+
+# 1-based positions in the shown list; -1 means the last one
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+    "last": -1, "latest": 1,
+}
+
+REFERENCE_WORDS = ["this", "that", "it", "the email", "that email"]
+
+# "delete all emails from X" acts on every match, not just the latest
+BULK_WORDS = ["all", "every", "everything"]
+
+DEFAULT_COUNT = 5
+
+# Answers to a pending confirmation ("delete 120 emails? yes/no")
+CONFIRM_WORDS = ["yes", "yeah", "yep", "y", "confirm", "go ahead", "do it", "ok", "okay", "sure"]
+CANCEL_WORDS = ["no", "nope", "n", "cancel", "stop", "don't", "never mind", "abort"]
+
+KEYWORD_INTENT = {keyword: intent for intent, keywords in INTENT_KEYWORDS.items() for keyword in keywords}
+
+
+def _alternation(phrases: List[str]) -> str:
+    """Longest phrase first, so "get rid of" wins over "get" at the same position."""
+    ordered = sorted(phrases, key=len, reverse=True)
+    return "|".join(re.escape(p).replace(r"\ ", r"\s+") for p in ordered)
+
+
+# Entity patterns come first so text they capture (a sender name, a subject)
+# is not also scored as intent keywords.
+COMMAND_PATTERN = re.compile(
+    r"(?P<sender>\bfrom\s+(?P<sender_text>[\w.@-]+(?:\s+(?!(?:about|regarding|subject)\b)[\w.@-]+)*))"
+    r"|(?P<subject>\b(?:about|subject|regarding)\s+[\"']?(?P<subject_text>[^\"']+)[\"']?)"
+    rf"|(?P<keyword>\b(?:{_alternation(list(KEYWORD_INTENT))})\b)"
+    rf"|(?P<bulk>\b(?:{_alternation(BULK_WORDS)})\b)"
+    rf"|(?P<reference>\b(?:{_alternation(REFERENCE_WORDS)})\b)"
+    rf"|(?P<ordinal>\b(?:{_alternation(list(ORDINALS))})\b)"
+    r"|(?P<count>\b\d+\b)"
+)
+
+ORDINAL_PATTERN = re.compile(rf"\b(?:{_alternation(list(ORDINALS))})\b")
+
+WHITESPACE = re.compile(r"\s+")
+
+CONFIRMATION_PATTERN = re.compile(
+    rf"^\s*(?:(?P<confirm>{_alternation(CONFIRM_WORDS)})|(?P<cancel>{_alternation(CANCEL_WORDS)}))\b[\s!.,]*"
+)
+
+
+def match_confirmation(command: str) -> Optional[bool]:
+    """True for a yes, False for a no, None if the command doesn't start with either."""
+    match = CONFIRMATION_PATTERN.match(command.lower())
+    if not match:
+        return None
+    return match.lastgroup == "confirm"
+
+
+def match_command(command: str) -> Dict:
+    """
+    Classifies a command and extracts its entities in one pass.
+    Returns intent, confidence, per-intent scores, entities and the matched spans.
+    """
+    command_lower = command.lower().strip()
+
+    hits: Dict[str, set] = {}
+    spans = []
+    entities = {
+        "sender": None,
+        "subject": None,
+        "count": DEFAULT_COUNT,
+        "email_reference": None,
+        "time_reference": None,
+        "position": None,
+        "bulk": False,
+    }
+    has_count = has_reference = has_ordinal = False
+
+    for match in COMMAND_PATTERN.finditer(command_lower):
+        kind = match.lastgroup
+        if kind in ("sender_text", "subject_text"):
+            kind = kind[:-len("_text")]
+        text = match.group(0)
+
+        if kind == "keyword":
+            keyword = WHITESPACE.sub(" ", text)
+            intent = KEYWORD_INTENT[keyword]
+            hits.setdefault(intent, set()).add(keyword)
+            spans.append({"type": "keyword", "intent": intent, "text": text, "start": match.start(), "end": match.end()})
+            continue
+
+        if kind in ("sender", "subject"):
+            group = f"{kind}_text"
+            value = match.group(group).strip()
+            if entities[kind] is None:
+                entities[kind] = value
+            spans.append({"type": kind, "text": value, "start": match.start(group), "end": match.end(group)})
+            continue
+
+        spans.append({"type": kind, "text": text, "start": match.start(), "end": match.end()})
+        if kind == "count" and not has_count:
+            entities["count"] = int(text)
+            has_count = True
+        elif kind == "bulk":
+            entities["bulk"] = True
+        elif kind == "reference":
+            has_reference = True
+        elif kind == "ordinal" and not has_ordinal:
+            entities["position"] = ORDINALS[text]
+            has_ordinal = True
+
+    scores = {intent: len(hits[intent]) / len(keywords) for intent, keywords in INTENT_KEYWORDS.items() if intent in hits}
+    detected_intent, confidence = "unknown", 0.0
+    for intent, score in scores.items():
+        if score > confidence:
+            detected_intent, confidence = intent, score
+
+    if has_reference:
+        entities["email_reference"] = "contextual"
+    elif has_ordinal:
+        entities["email_reference"] = command_lower
+
+    return {
+        "intent": detected_intent,
+        "confidence": confidence,
+        "scores": scores,
+        "entities": entities,
+        "spans": spans,
+        "original_command": command,
+    }
@@ -0,0 +1,197 @@
+"""
+Incremental mailbox sync using Gmail's history API.
+
+The first sync for a user lists the inbox and stores message summaries with
+the mailbox `historyId`. Later syncs call `users.history.list` from that ID
+and only apply what changed (added, deleted or relabelled messages). If the
+stored history ID has expired, Gmail answers 404 and we fall back to a full
+sync.
+
+A full sync upserts what it listed and prunes stored inbox messages that are
+no longer listed, so bodies fetched for search and messages outside the
+inbox survive it. The sync state remembers how many inbox messages the last
+full sync covered; only a caller asking for more than that triggers another.
+
+`on_threads_changed(user_id, thread_ids)` is called with the threads that
+gained or lost messages, or with None after a full sync, when any thread may
+have changed.
+
+With a memory governor, each user's sync lock and last-sync time are charged
+to it; an evicted user's next sync simply starts from the stored history ID.
+Store calls go through `run` (see `message_store.message_runner`), so SQLite
+queries don't block the event loop.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from async_clients import AsyncGmailClient, GmailApiError
+from memory_governor import estimate_size
+from state_store import run_inline
+from tracing import tracer
+
+SYNC_WINDOW = int(os.getenv("SYNC_WINDOW", "50"))
+HISTORY_PAGE_SIZE = 500
+LIST_PAGE_LIMIT = 500
+
+FetchSummaries = Callable[[AsyncGmailClient, List[str]], Awaitable[List[Dict]]]
+ThreadsChanged = Callable[[str, Optional[Set[str]]], None]
+# Runs a blocking store call off the event loop (see message_store.message_runner)
+RunBlocking = Callable[..., Awaitable]
+
+
+class HistoryExpired(Exception):
+    """The stored history ID is too old for `users.history.list`."""
+
+
+class MailboxSync:
+    """Keeps a message store in step with a user's Gmail inbox."""
+
+    def __init__(self, store, fetch_summaries: FetchSummaries, window: int = SYNC_WINDOW,
+                 on_threads_changed: Optional[ThreadsChanged] = None, governor=None, run: RunBlocking = run_inline):
+        self.store = store
+        self.run = run
+        self.fetch_summaries = fetch_summaries
+        self.window = window
+        self.on_threads_changed = on_threads_changed
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.last_synced: Dict[str, float] = {}
+        self.governor = governor
+        if governor is not None:
+            governor.register("mailbox_sync", self._evict)
+
+    def _evict(self, user_id: str):
+        self.last_synced.pop(user_id, None)
+        lock = self._locks.get(user_id)
+        # A held lock stays, or a second sync could start alongside the running one
+        if lock is not None and not lock.locked():
+            del self._locks[user_id]
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self._locks:
+            self._locks[user_id] = asyncio.Lock()
+        return self._locks[user_id]
+
+    def synced_within(self, user_id: str, seconds: float) -> bool:
+        """True if a sync for this user finished in the last `seconds`."""
+        last = self.last_synced.get(user_id)
+        if last is not None and self.governor is not None:
+            self.governor.touch("mailbox_sync", user_id)
+        return last is not None and time.monotonic() - last < seconds
+
+    async def sync(self, user_id: str, gmail: AsyncGmailClient, min_messages: int = 0) -> Dict:
+        """
+        Brings the store up to date and returns what was done.
+        A full sync runs on first use, when history has expired, or when the
+        caller needs more inbox messages than the last full sync covered.
+        """
+        with tracer.span("mailbox.sync", **{"enduser.id": user_id}) as span:
+            start = time.perf_counter()
+            async with self._lock(user_id):
+                # Time spent behind another sync of the same user (e.g. the prefetcher)
+                span.set_attribute("sync.lock_wait_s", round(time.perf_counter() - start, 6))
+                result = await self._sync(user_id, gmail, min_messages)
+                self.last_synced[user_id] = time.monotonic()
+                if self.governor is not None:
+                    size = estimate_size(self._locks[user_id]) + estimate_size(self.last_synced[user_id])
+                    self.governor.charge("mailbox_sync", user_id, size)
+                span.set_attribute("sync.mode", result["mode"])
+                return result
+
+    async def _sync(self, user_id: str, gmail: AsyncGmailClient, min_messages: int) -> Dict:
+        state = await self.run(self.store.get_state, user_id)
+        # Compared with what the last full sync covered, not the current count, which trashing lowers
+        needs_more = state is not None and not state["complete"] and state["window"] < min_messages
+        if state is None or needs_more:
+            return await self.full_sync(user_id, gmail, max(min_messages, self.window))
+        try:
+            return await self.incremental_sync(user_id, gmail, state)
+        except HistoryExpired:
+            return await self.full_sync(user_id, gmail, max(min_messages, self.window, state["window"]))
+
+    async def full_sync(self, user_id: str, gmail: AsyncGmailClient, window: int) -> Dict:
+        # Read the history ID before listing so changes made during the list are replayed next time.
+        profile = await gmail.get_profile()
+        message_ids, page_token = [], None
+        while len(message_ids) < window:
+            params = {"labelIds": ["INBOX"], "maxResults": min(LIST_PAGE_LIMIT, window - len(message_ids))}
+            if page_token:
+                params["pageToken"] = page_token
+            results = await gmail.list_messages(**params)
+            message_ids.extend(m["id"] for m in results.get("messages", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+
+        records = await self.fetch_summaries(gmail, message_ids)
+        complete = page_token is None
+        await self.run(self.store.upsert, user_id, records)
+        # Stored inbox messages in the listed range that weren't listed have left the inbox
+        dates = [int(r["internal_date"]) for r in records if r.get("internal_date")]
+        oldest = None if complete or not dates else min(dates)
+        await self.run(self.store.prune, user_id, "INBOX", keep_ids=[r["id"] for r in records], since=oldest)
+        await self.run(self.store.set_state, user_id, profile["historyId"], complete=complete, window=window)
+        if self.on_threads_changed is not None:
+            self.on_threads_changed(user_id, None)
+        return {"mode": "full", "fetched": len(records)}
+
+    async def incremental_sync(self, user_id: str, gmail: AsyncGmailClient, state: Dict) -> Dict:
+        history, history_id = await self._read_history(gmail, state["history_id"])
+
+        added: Dict[str, None] = {}
+        deleted = set()
+        label_changes = []
+        changed_threads = set()
+        for record in history:
+            for item in record.get("messagesAdded", []):
+                message_id = item["message"]["id"]
+                added[message_id] = None
+                deleted.discard(message_id)
+                changed_threads.add(item["message"].get("threadId"))
+            for item in record.get("messagesDeleted", []):
+                message_id = item["message"]["id"]
+                added.pop(message_id, None)
+                deleted.add(message_id)
+                changed_threads.add(item["message"].get("threadId"))
+            for item in record.get("labelsAdded", []):
+                label_changes.append((item["message"]["id"], item.get("labelIds", []), []))
+            for item in record.get("labelsRemoved", []):
+                label_changes.append((item["message"]["id"], [], item.get("labelIds", [])))
+
+        await self.run(self.store.delete, user_id, deleted)
+
+        applied = 0
+        for message_id, labels_added, labels_removed in label_changes:
+            if message_id in added or message_id in deleted:
+                continue  # freshly fetched summaries already carry current labels
+            if await self.run(self.store.update_labels, user_id, message_id, labels_added, labels_removed):
+                applied += 1
+            elif "INBOX" in labels_added:
+                added[message_id] = None  # moved into the inbox from outside the synced window
+
+        records = await self.fetch_summaries(gmail, list(added)) if added else []
+        await self.run(self.store.upsert, user_id, records)
+        await self.run(self.store.set_state, user_id, history_id, complete=state["complete"], window=state["window"])
+        changed_threads.discard(None)
+        if changed_threads and self.on_threads_changed is not None:
+            self.on_threads_changed(user_id, changed_threads)
+        return {"mode": "delta", "added": len(records), "deleted": len(deleted), "label_changes": applied}
+
+    async def _read_history(self, gmail: AsyncGmailClient, start_history_id: str):
+        """Reads every history page after `start_history_id`."""
+        history, page_token = [], None
+        while True:
+            params = {"startHistoryId": start_history_id, "maxResults": HISTORY_PAGE_SIZE}
+            if page_token:
+                params["pageToken"] = page_token
+            try:
+                results = await gmail.list_history(**params)
+            except GmailApiError as error:
+                if error.status_code == 404:
+                    raise HistoryExpired(start_history_id) from error
+                raise
+            history.extend(results.get("history", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return history, results.get("historyId", start_history_id)
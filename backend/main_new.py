@@ -1,29 +1,76 @@
 import os
 import json
+import asyncio
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response, Depends
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import requests
 import re
-from typing import List, Dict, Optional
-from datetime import datetime
+import time
+import math
+import secrets
+from typing import List, Dict, Optional, Tuple
+from contextlib import asynccontextmanager, aclosing
 
 # Google API Imports
 import google.oauth2.credentials
 import google_auth_oauthlib.flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import base64
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import parseaddr
 
+# Async Gmail / Mistral clients
+from async_clients import (
+    AsyncGmailClient, AsyncMistralClient, GmailApiError, MistralApiError,
+    GMAIL_API_URL, get_http_client, close_http_client
+)
+from message_store import create_message_store, message_runner, search_terms
+from mailbox_sync import MailboxSync
+from prefetch import PrefetchWorker, PREFETCH_ENABLED
+from gmail_quota import gmail_quota, is_rate_limited
+from intent_matcher import match_command, match_confirmation, ORDINALS, ORDINAL_PATTERN
+from reply_cache import create_reply_cache, reply_cache_key
+from http_pool import pool_stats
+from state_store import create_state_store, state_runner
+from conversation_store import create_conversation_store
+from token_refresh import TokenRefresher, TokenRefreshError, expiry_from_now, seconds_until_expiry
+from thread_cache import ThreadCache, context_messages
+from prompt_builder import PromptBuilder, estimate_tokens
+from memory_governor import MemoryGovernor, estimate_size
+from metrics import registry as metrics, MetricsMiddleware, cache_families, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from structured_log import configure_logging, get_logger
+from tracing import tracer, TracingMiddleware
+
 # --- CONFIGURATION ---
 load_dotenv()
+# LOG_LEVEL (DEBUG/INFO/WARNING/ERROR/OFF) and LOG_FORMAT (text/json); see structured_log.py
+configure_logging()
+log = get_logger("app")
 
 # --- FASTAPI APP INITIALIZATION ---
-app = FastAPI()
+# Timings recorded while the app starts, exposed on /debug/gmail-service-cache
+startup_timings = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    for pool in ("gmail", "mistral", "oauth"):
+        get_http_client(pool)
+    startup_timings["http_pool_seconds"] = time.perf_counter() - start
+    token_refresher.start()
+    memory_governor.start()
+    if PREFETCH_ENABLED:
+        prefetcher.start()
+    yield
+    await prefetcher.stop()
+    await memory_governor.stop()
+    await token_refresher.stop()
+    await close_http_client()
+    tracer.exporter.flush()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -36,13 +83,68 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# --- IN-MEMORY STORAGE ---
-user_credentials = {}
-# Conversation memory storage per user
-conversation_memory = {}
-# Email cache for context
-email_cache = {}
+# The last middleware added is outermost: the root span wraps the metrics
+# middleware, and both include CORS and the route.
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+# --- APPLICATION STATE ---
+# Credentials, sessions and conversations live in the state store
+# (STATE_BACKEND=memory|sqlite|redis) so several workers can share them.
+# Async code goes through run_state, so a slow sqlite/redis call waits in a
+# worker thread rather than blocking the event loop.
+state = create_state_store()
+run_state = state_runner(state)
+
+# One byte budget (MEMORY_BUDGET_MB) and idle TTL across the per-user caches
+# kept in process; see memory_governor.py. Its sweep also purges expired state.
+memory_governor = MemoryGovernor()
+memory_governor.add_sweeper(state.purge_expired)
+gmail_quota.use_governor(memory_governor)
+
+SESSION_COOKIE = "session_id"
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(30 * 24 * 3600)))
+# Requests without a session act as this user; set DEFAULT_USER_ID= (empty) to require sign-in
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "user_123")
+CONVERSATION_MAX_MESSAGES = 20
+# Chatbot history: bounded deques in-process, or the shared state store (see conversation_store.py)
+conversations = create_conversation_store(state, CONVERSATION_MAX_MESSAGES, memory_governor)
+
+def load_credentials(user_id: str) -> Optional[Dict]:
+    return state.get("credentials", user_id)
+
+def save_credentials(user_id: str, creds: Dict):
+    state.set("credentials", user_id, creds)
+
+def authenticated_users() -> List[str]:
+    return state.keys("credentials")
+
+# The ticker skips users idle for PREFETCH_IDLE_TTL; they refresh on demand when they return
+token_refresher = TokenRefresher(load_credentials, save_credentials, authenticated_users, run=run_state,
+                                 active=lambda user_id: prefetcher.is_active(user_id))
+
+def create_session(user_id: str, response: Response) -> str:
+    """Starts a browser session for a user and sets its cookie."""
+    session_id = secrets.token_urlsafe(32)
+    state.set("sessions", session_id, user_id, ttl=SESSION_TTL)
+    response.set_cookie(SESSION_COOKIE, session_id, max_age=SESSION_TTL, httponly=True, samesite="lax")
+    return session_id
+
+async def current_user(request: Request) -> str:
+    """Resolves the signed-in user from the session cookie (or an X-Session-Id header)."""
+    session_id = request.cookies.get(SESSION_COOKIE) or request.headers.get("X-Session-Id")
+    user_id = await run_state(state.get, "sessions", session_id) if session_id else None
+    if user_id:
+        # On the loop: touching can make the governor evict from loop-owned caches.
+        # Keeps the user in the background refresh set; see PREFETCH_IDLE_TTL
+        prefetcher.touch(user_id)
+    else:
+        user_id = DEFAULT_USER_ID
+    if user_id:
+        # /debug/traces shows each user only their own traces
+        tracer.set_user(user_id)
+        return user_id
+    raise HTTPException(status_code=401, detail="Not signed in")
 
 # --- DATA MODELS ---
 class AuthCode(BaseModel):
@@ -53,6 +155,7 @@ class AuthCode(BaseModel):
 
 class EmailContent(BaseModel):
     content: str
+    message_id: Optional[str] = None  # adds the other messages of its thread as context
     
 class MessageId(BaseModel):
     message_id: str
@@ -61,6 +164,19 @@ class ChatCommand(BaseModel):
     command: str
     context: Optional[Dict] = None  # Allow frontend to send additional context
 
+class BulkDeleteRequest(BaseModel):
+    sender: Optional[str] = None
+    query: Optional[str] = None  # any Gmail search query, e.g. "older_than:1y category:promotions"
+    message_ids: Optional[List[str]] = None  # instead of sender/query
+    max_messages: Optional[int] = None
+
+class BatchDraftRequest(BaseModel):
+    message_ids: Optional[List[str]] = None
+    contents: Optional[List[str]] = None
+    concurrency: Optional[int] = None  # defaults to DRAFT_CONCURRENCY
+    timeout: Optional[float] = None  # seconds per draft, defaults to DRAFT_TIMEOUT
+    refresh: bool = False
+
 class SendRequest(BaseModel):
     message_id: str
     reply_text: str
@@ -73,62 +189,40 @@ class ConversationMessage(BaseModel):
     action_taken: Optional[str] = None
 
 # --- CONVERSATION MEMORY MANAGEMENT ---
-def add_to_conversation(user_id: str, role: str, content: str, action_taken: Optional[str] = None):
-    """Add a message to the conversation history."""
-    if user_id not in conversation_memory:
-        conversation_memory[user_id] = []
-    
-    conversation_memory[user_id].append({
-        "role": role,
-        "content": content,
-        "timestamp": datetime.now().isoformat(),
-        "action_taken": action_taken
-    })
-    
-    # Keep only last 20 messages to avoid memory issues
-    if len(conversation_memory[user_id]) > 20:
-        conversation_memory[user_id] = conversation_memory[user_id][-20:]
+async def add_to_conversation(user_id: str, role: str, content: str, action_taken: Optional[str] = None):
+    """Add a message to the conversation history, keeping the last CONVERSATION_MAX_MESSAGES."""
+    await run_state(conversations.append, user_id, role, content, action_taken)
 
-def get_conversation_context(user_id: str, last_n: int = 5) -> str:
+async def get_conversation_context(user_id: str, last_n: int = 5) -> str:
     """Get recent conversation context for AI understanding."""
-    if user_id not in conversation_memory:
-        return ""
-    
-    recent = conversation_memory[user_id][-last_n:]
-    context_str = "Recent conversation:\n"
-    for msg in recent:
-        context_str += f"{msg['role']}: {msg['content']}\n"
-    return context_str
+    return await run_state(conversations.context, user_id, last_n)
 
-def get_last_action(user_id: str) -> Optional[str]:
+async def get_last_action(user_id: str) -> Optional[str]:
     """Get the last action taken by the assistant."""
-    if user_id not in conversation_memory:
-        return None
-    
-    for msg in reversed(conversation_memory[user_id]):
-        if msg.get('action_taken'):
-            return msg['action_taken']
-    return None
+    return await run_state(conversations.last_action, user_id)
 
 # --- EMAIL CACHE MANAGEMENT ---
-def cache_emails(user_id: str, emails: List[Dict]):
+# Message summaries, sync state and each user's last shown list live in the
+# message store (SQLite by default), so they survive restarts and are shared
+# between workers.
+message_store = create_message_store(memory_governor)
+# Like run_state: SQLite queries wait in a worker thread, the memory store runs inline
+run_messages = message_runner(message_store)
+
+async def cache_emails(user_id: str, emails: List[Dict]):
     """Cache fetched emails for context reference."""
-    email_cache[user_id] = {
-        "emails": emails,
-        "timestamp": datetime.now().isoformat()
-    }
+    await run_messages(message_store.upsert, user_id, emails)
+    await run_messages(message_store.set_context, user_id, emails)
 
-def get_cached_emails(user_id: str) -> List[Dict]:
+async def get_cached_emails(user_id: str) -> List[Dict]:
     """Get cached emails if available."""
-    if user_id in email_cache:
-        return email_cache[user_id].get("emails", [])
-    return []
+    return await run_messages(message_store.get_context, user_id)
 
-def find_email_by_reference(user_id: str, reference: str) -> Optional[Dict]:
+async def find_email_by_reference(user_id: str, reference: str) -> Optional[Dict]:
     """Find an email by various references (sender, subject keywords, position)."""
-    cached = get_cached_emails(user_id)
+    cached = await get_cached_emails(user_id)
     if not cached:
-        return None
+        return await run_messages(message_store.find_message, user_id, reference)
     
     reference_lower = reference.lower()
     
@@ -138,7 +232,15 @@ def find_email_by_reference(user_id: str, reference: str) -> Optional[Dict]:
     if 'last' in reference_lower or 'oldest' in reference_lower:
         return cached[-1] if cached else None
     
-    # Check for number reference (e.g., "second email", "3rd email")
+    # Ordinal words (e.g., "second email", "the third one")
+    ordinal_match = ORDINAL_PATTERN.search(reference_lower)
+    if ordinal_match:
+        position = ORDINALS[ordinal_match.group(0)]
+        idx = position - 1 if position > 0 else position
+        if -len(cached) <= idx < len(cached):
+            return cached[idx]
+    
+    # Check for number reference (e.g., "3rd email")
     number_match = re.search(r'(\d+)(st|nd|rd|th)?', reference_lower)
     if number_match:
         idx = int(number_match.group(1)) - 1
@@ -152,78 +254,26 @@ def find_email_by_reference(user_id: str, reference: str) -> Optional[Dict]:
         if reference_lower in sender or reference_lower in subject:
             return email
     
-    return None
+    # Fall back to everything synced for this user
+    return await run_messages(message_store.find_message, user_id, reference_lower)
 
 # --- ENHANCED INTENT RECOGNITION ---
+INTENT_SECONDS = metrics.histogram(
+    "intent_classification_seconds", "Time to classify a chatbot command and extract its entities.", ("intent",),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+
 def detect_intent_and_entities(command: str, user_id: str) -> Dict:
     """
     Enhanced intent detection with entity extraction.
-    Returns a dictionary with intent, entities, and confidence.
+    Returns a dictionary with intent, confidence, per-intent scores, entities and matched spans.
     """
-    command_lower = command.lower().strip()
-    
-    # Define intents with multiple trigger patterns
-    intents = {
-        "greet": ["hello", "hi", "hey", "greetings", "good morning", "good afternoon"],
-        "help": ["help", "what can you do", "commands", "how to", "guide", "explain"],
-        "fetch_emails": ["fetch", "read", "get", "show", "display", "list", "check", "see"],
-        "delete_email": ["delete", "remove", "trash", "get rid of"],
-        "generate_reply": ["reply", "respond", "answer", "draft", "compose"],
-        "send_email": ["send", "deliver", "dispatch"],
-        "search_email": ["search", "find", "look for", "locate"],
-        "status": ["status", "what did you do", "last action", "what happened"],
-    }
-    
-    detected_intent = "unknown"
-    confidence = 0.0
-    
-    # Intent detection
-    for intent, keywords in intents.items():
-        matches = sum(1 for keyword in keywords if keyword in command_lower)
-        if matches > 0:
-            current_confidence = matches / len(keywords)
-            if current_confidence > confidence:
-                confidence = current_confidence
-                detected_intent = intent
-    
-    # Entity extraction
-    entities = {
-        "sender": None,
-        "subject": None,
-        "count": 5,  # default
-        "email_reference": None,
-        "time_reference": None
-    }
-    
-    # Extract sender (from X)
-    sender_match = re.search(r'from\s+([\w.@\s-]+)', command_lower)
-    if sender_match:
-        entities["sender"] = sender_match.group(1).strip()
-    
-    # Extract subject keywords
-    subject_match = re.search(r'(about|subject|regarding)\s+["\']?([^"\']+)["\']?', command_lower)
-    if subject_match:
-        entities["subject"] = subject_match.group(2).strip()
-    
-    # Extract count
-    count_match = re.search(r'(\d+|last|latest|recent)', command_lower)
-    if count_match:
-        count_str = count_match.group(1)
-        if count_str.isdigit():
-            entities["count"] = int(count_str)
-    
-    # Extract email references (this, that, it, the email, etc.)
-    if any(word in command_lower for word in ['this', 'that', 'it', 'the email', 'that email']):
-        entities["email_reference"] = "contextual"
-    elif any(word in command_lower for word in ['first', 'second', 'third', 'last', 'latest']):
-        entities["email_reference"] = command_lower
-    
-    return {
-        "intent": detected_intent,
-        "confidence": confidence,
-        "entities": entities,
-        "original_command": command
-    }
+    with tracer.span("intent.detect") as span:
+        start = time.perf_counter()
+        analysis = match_command(command)
+        INTENT_SECONDS.observe(time.perf_counter() - start, analysis["intent"])
+        span.set_attribute("intent", analysis["intent"])
+    return analysis
 
 # --- GREETING AND HELP ---
 def generate_greeting(user_id: str) -> str:
@@ -254,6 +304,7 @@ def generate_help_message() -> str:
 🗑️ **Deleting Emails:**
 - "Delete the email from Amazon"
 - "Remove the first email"
+- "Delete all emails from newsletter@company.com"
 
 🔍 **Searching:**
 - "Find emails about invoices"
@@ -267,7 +318,7 @@ Just ask naturally, and I'll understand what you need!"""
 
 # --- DEBUG ENDPOINT ---
 @app.get("/debug/config")
-def debug_config():
+async def debug_config():
     """Check your OAuth configuration"""
     try:
         with open('client_secret.json', 'r') as f:
@@ -284,12 +335,20 @@ def debug_config():
         return {"error": str(e)}
 
 # --- AUTHENTICATION FLOW ---
+async def fetch_gmail_profile(access_token: str):
+    return await get_http_client("gmail").get(
+        f'{GMAIL_API_URL}gmail/v1/users/me/profile',
+        headers={'Authorization': f'Bearer {access_token}'}
+    )
+
+def account_user_id(profile: Dict) -> str:
+    """Users are keyed by their Gmail address, so every session and worker agrees on the ID."""
+    return profile['emailAddress'].lower()
+
 @app.post("/auth/google")
-def auth_google(auth_data: AuthCode):
+async def auth_google(auth_data: AuthCode, response: Response):
     """Handles Google authentication with both code and token flows."""
     try:
-        print("\n========== STARTING OAUTH AUTHENTICATION ==========")
-        
         with open('client_secret.json', 'r') as f:
             client_config = json.load(f)
         
@@ -297,41 +356,39 @@ def auth_google(auth_data: AuthCode):
         client_id = web_config['client_id']
         token_uri = web_config['token_uri']
         
-        print(f"[DEBUG] Client ID: {client_id}")
-        
         if auth_data.access_token:
-            print(f"[INFO] Received direct access token (implicit flow)")
+            log.info("oauth_started", flow="token", client_id=client_id)
             
-            verify_response = requests.get(
-                'https://www.googleapis.com/gmail/v1/users/me/profile',
-                headers={'Authorization': f'Bearer {auth_data.access_token}'}
-            )
+            verify_response = await fetch_gmail_profile(auth_data.access_token)
             
             if verify_response.status_code == 200:
-                print(f"[SUCCESS] Access token verified with Gmail API!")
-                
-                user_id = "user_123"
-                user_credentials[user_id] = {
+                user_id = account_user_id(verify_response.json())
+                await run_state(save_credentials, user_id, {
                     'token': auth_data.access_token,
                     'refresh_token': None,
+                    'expiry': expiry_from_now(auth_data.expires_in),
                     'token_uri': token_uri,
                     'client_id': client_id,
                     'client_secret': web_config['client_secret'],
                     'scopes': ['https://www.googleapis.com/auth/gmail.readonly',
                               'https://www.googleapis.com/auth/gmail.send',
                               'https://www.googleapis.com/auth/gmail.modify']
-                }
+                })
+                
+                invalidate_gmail_service(user_id)
+                prefetcher.register(user_id)
                 
                 # Initialize conversation with greeting
-                add_to_conversation(user_id, "assistant", generate_greeting(user_id))
+                await add_to_conversation(user_id, "assistant", generate_greeting(user_id))
                 
-                print(f"========== OAUTH AUTHENTICATION COMPLETE ==========\n")
-                return {"status": "success", "user_id": user_id}
+                session_id = await run_state(create_session, user_id, response)
+                log.info("oauth_complete", flow="token", user_id=user_id)
+                return {"status": "success", "user_id": user_id, "session_id": session_id}
             else:
                 raise Exception(f"Token verification failed: {verify_response.text}")
         
         elif auth_data.code:
-            print(f"[INFO] Received authorization code (code flow)")
+            log.info("oauth_started", flow="code", client_id=client_id)
             
             redirect_uris_to_try = ['http://localhost:5173/', 'http://localhost:5173/api/oauth2/callback', 'postMessage']
             
@@ -344,26 +401,34 @@ def auth_google(auth_data: AuthCode):
                     'grant_type': 'authorization_code'
                 }
                 
-                token_response = requests.post(token_uri, data=payload)
+                token_response = await get_http_client("oauth").post(token_uri, data=payload)
                 
                 if token_response.status_code == 200:
                     token_data = token_response.json()
                     
-                    user_id = "user_123"
-                    user_credentials[user_id] = {
+                    profile_response = await fetch_gmail_profile(token_data.get('access_token'))
+                    if profile_response.status_code != 200:
+                        raise Exception(f"Could not read Gmail profile: {profile_response.text}")
+                    user_id = account_user_id(profile_response.json())
+                    await run_state(save_credentials, user_id, {
                         'token': token_data.get('access_token'),
                         'refresh_token': token_data.get('refresh_token'),
+                        'expiry': expiry_from_now(token_data.get('expires_in')),
                         'token_uri': token_uri,
                         'client_id': client_id,
                         'client_secret': web_config['client_secret'],
                         'scopes': token_data.get('scope', '').split()
-                    }
+                    })
+                    
+                    invalidate_gmail_service(user_id)
+                    prefetcher.register(user_id)
                     
                     # Initialize conversation with greeting
-                    add_to_conversation(user_id, "assistant", generate_greeting(user_id))
+                    await add_to_conversation(user_id, "assistant", generate_greeting(user_id))
                     
-                    print(f"========== OAUTH AUTHENTICATION COMPLETE ==========\n")
-                    return {"status": "success", "user_id": user_id}
+                    session_id = await run_state(create_session, user_id, response)
+                    log.info("oauth_complete", flow="code", user_id=user_id, redirect_uri=redirect_uri)
+                    return {"status": "success", "user_id": user_id, "session_id": session_id}
             
             raise Exception("Token exchange failed with all attempted redirect URIs")
         
@@ -371,251 +436,982 @@ def auth_google(auth_data: AuthCode):
             raise Exception("No access token or authorization code provided")
         
     except Exception as e:
-        print(f"\n[CRITICAL ERROR] {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("oauth_failed", error=str(e))
         raise HTTPException(status_code=400, detail=f"Error fetching token: {str(e)}")
 
+@app.post("/auth/logout")
+async def logout(request: Request, response: Response):
+    """Ends the current browser session; stored credentials stay for background sync."""
+    session_id = request.cookies.get(SESSION_COOKIE) or request.headers.get("X-Session-Id")
+    if session_id:
+        await run_state(state.delete, "sessions", session_id)
+    response.delete_cookie(SESSION_COOKIE)
+    return {"status": "signed_out"}
+
 # --- GMAIL SERVICE ---
-def get_gmail_service(user_id: str):
-    """Creates a Gmail service object from stored credentials."""
-    creds_dict = user_credentials.get(user_id)
+# Per-user cache of (access token, Credentials, client). An entry is rebuilt when the
+# token changes (a refresh); login invalidates it explicitly.
+gmail_service_cache = {}
+gmail_service_stats = {"hits": 0, "misses": 0, "build_seconds": 0.0, "lookup_seconds": 0.0}
+memory_governor.register("gmail_services", lambda user_id: gmail_service_cache.pop(user_id, None))
+
+def invalidate_gmail_service(user_id: str):
+    """Drops the cached Gmail service for a user."""
+    gmail_service_cache.pop(user_id, None)
+    memory_governor.release("gmail_services", user_id)
+
+async def get_gmail_service(user_id: str) -> AsyncGmailClient:
+    """Returns the cached Gmail service for a user, refreshing the access token and rebuilding it if needed."""
+    start = time.perf_counter()
+    creds_dict = await run_state(load_credentials, user_id)
     if not creds_dict:
         raise HTTPException(status_code=401, detail="User not authenticated")
-    
-    credentials = google.oauth2.credentials.Credentials(**creds_dict)
+
+    try:
+        creds_dict = await token_refresher.ensure_fresh(user_id, creds_dict)
+    except TokenRefreshError as e:
+        if e.reauthenticate:
+            raise HTTPException(status_code=401, detail=f"Session expired, please sign in again: {e}")
+        raise HTTPException(status_code=503, detail=f"Could not refresh Google credentials: {e}", headers={"Retry-After": "5"})
+
+    remaining = seconds_until_expiry(creds_dict)
+    if remaining is not None and remaining <= 0:
+        raise HTTPException(status_code=401, detail="Invalid or expired credentials")
+
+    cached = gmail_service_cache.get(user_id)
+    if cached and cached[0] == creds_dict.get('token'):
+        memory_governor.touch("gmail_services", user_id)
+        gmail_service_stats["hits"] += 1
+        gmail_service_stats["lookup_seconds"] += time.perf_counter() - start
+        return cached[2]
+
+    # Expiry is tracked by token_refresher; Credentials only validates the remaining fields
+    credentials = google.oauth2.credentials.Credentials(**{k: v for k, v in creds_dict.items() if k != 'expiry'})
     if not credentials or not credentials.valid:
         raise HTTPException(status_code=401, detail="Invalid or expired credentials")
 
+    service = AsyncGmailClient(credentials.token, user_key=user_id)
+    gmail_service_cache[user_id] = (credentials.token, credentials, service)
+    memory_governor.charge("gmail_services", user_id, estimate_size(gmail_service_cache[user_id]))
+    gmail_service_stats["misses"] += 1
+    gmail_service_stats["build_seconds"] += time.perf_counter() - start
+    return service
+
+def gmail_http_exception(error: GmailApiError, message: str) -> HTTPException:
+    """Maps a Gmail error to an HTTP error; rate limits become 429 with Retry-After."""
+    if is_rate_limited(error.status_code, error.reason):
+        headers = {"Retry-After": str(math.ceil(error.retry_after))} if error.retry_after else None
+        return HTTPException(status_code=429, detail=f"Gmail rate limit reached, please retry shortly: {error.message}", headers=headers)
+    return HTTPException(status_code=500, detail=f"{message}: {error}")
+
+# Per-user debug numbers are only shown to that user: user IDs are Gmail addresses
+@app.get("/debug/gmail-quota")
+async def debug_gmail_quota(user_id: str = Depends(current_user)):
+    """Reports the Gmail quota budget and the signed-in user's usage."""
+    return gmail_quota.snapshot(user_id)
+
+@app.get("/debug/gmail-service-cache")
+async def debug_gmail_service_cache():
+    """Reports Gmail service cache effectiveness and startup timings."""
+    hits, misses = gmail_service_stats["hits"], gmail_service_stats["misses"]
+    return {
+        **gmail_service_stats,
+        "cached_users": len(gmail_service_cache),
+        "avg_build_ms": gmail_service_stats["build_seconds"] / misses * 1000 if misses else None,
+        "avg_lookup_ms": gmail_service_stats["lookup_seconds"] / hits * 1000 if hits else None,
+        "startup": startup_timings
+    }
+
+@app.get("/debug/memory")
+async def debug_memory():
+    """Reports the memory budget and per-cache bytes, entries, evictions and expirations."""
+    return memory_governor.snapshot()
+
+@app.get("/debug/token-refresh")
+async def debug_token_refresh(user_id: str = Depends(current_user)):
+    """Reports OAuth token refresh counters and the signed-in user's token lifetime."""
+    creds = await run_state(load_credentials, user_id) or {}
+    return {
+        **token_refresher.snapshot(),
+        "authenticated_users": len(await run_state(authenticated_users)),
+        "token": {"expires_in": seconds_until_expiry(creds), "refreshable": bool(creds.get('refresh_token'))},
+    }
+
+@app.get("/debug/http-pool")
+async def debug_http_pool():
+    """Reports pool limits, HTTP versions and connection reuse per upstream host."""
+    return pool_stats()
+
+# --- BATCHED MESSAGE FETCH ---
+# Gmail accepts up to 100 calls per batch but recommends staying at or below 50.
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+GMAIL_BATCH_LIMIT = 100
+
+async def fetch_messages_batched(service: AsyncGmailClient, message_ids: List[str], chunk_size: int = GMAIL_BATCH_SIZE, **get_kwargs) -> List[Dict]:
+    """
+    Fetches many messages through the Gmail batch endpoint instead of one round-trip each.
+    Results keep the order of `message_ids`; messages whose sub-request failed are skipped.
+    """
+    chunk_size = max(1, min(chunk_size, GMAIL_BATCH_LIMIT))
+    unique_ids = list(dict.fromkeys(message_ids))
+    fetched, failed = await service.get_messages_batched(unique_ids, chunk_size, **get_kwargs)
+
+    for msg_id, error in failed.items():
+        log.warning("message_fetch_failed", message_id=msg_id, error=str(error))
+
+    return [fetched[msg_id] for msg_id in unique_ids if msg_id in fetched]
+
+def summarize_message(msg: Dict, default_sender: str = 'Unknown', default_snippet: str = '') -> Dict:
+    """Reduces a Gmail message resource to the summary shape used by the list views."""
+    headers = {h['name']: h['value'] for h in msg.get('payload', {}).get('headers', [])}
+    return {
+        "id": msg['id'],
+        "sender": headers.get('From', default_sender),
+        "subject": headers.get('Subject', 'No Subject'),
+        "snippet": msg.get('snippet', default_snippet),
+        "date": headers.get('Date'),
+        "thread_id": msg.get('threadId'),
+        "internal_date": msg.get('internalDate'),
+        "label_ids": msg.get('labelIds', [])
+    }
+
+# --- FETCH MODES ---
+# List views only need a few headers and the snippet, so they ask Gmail for
+# `format=metadata` and skip the message body and attachments entirely.
+SUMMARY_HEADERS = ['From', 'Subject', 'Date', 'Message-ID']
+SUMMARY_FETCH_FORMAT = os.getenv("GMAIL_SUMMARY_FORMAT", "metadata")
+
+def summary_fetch_kwargs(fetch_format: str = SUMMARY_FETCH_FORMAT) -> Dict:
+    """Returns the messages.get arguments for the given fetch mode."""
+    if fetch_format == 'metadata':
+        return {"format": "metadata", "metadataHeaders": SUMMARY_HEADERS}
+    return {"format": fetch_format}
+
+async def fetch_message_summaries(service: AsyncGmailClient, message_ids: List[str], fetch_format: str = SUMMARY_FETCH_FORMAT, **summary_defaults) -> List[Dict]:
+    """Fetches summary views for a list of message IDs in as few round-trips as possible."""
+    fetched = await fetch_messages_batched(service, message_ids, **summary_fetch_kwargs(fetch_format))
+    return [summarize_message(msg, **summary_defaults) for msg in fetched]
+
+def extract_message_body(payload: Dict) -> Dict:
+    """Walks a `format=full` payload and returns its decoded text body, preferring text/plain."""
+    found = {}
+
+    def walk(part: Dict):
+        if part.get('filename'):
+            return
+        mime_type = part.get('mimeType', '')
+        data = part.get('body', {}).get('data')
+        if data and mime_type in ('text/plain', 'text/html') and mime_type not in found:
+            found[mime_type] = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)).decode('utf-8', errors='replace')
+        for child in part.get('parts', []):
+            walk(child)
+
+    walk(payload)
+    if 'text/plain' in found:
+        return {"mime_type": "text/plain", "body": found['text/plain']}
+    if 'text/html' in found:
+        return {"mime_type": "text/html", "body": found['text/html']}
+    return {"mime_type": None, "body": ""}
+
+def plain_text(body: Dict) -> str:
+    """Body text from `extract_message_body`, with tags stripped from HTML-only bodies."""
+    if body["mime_type"] == "text/html":
+        return re.sub(r'<[^>]+>', ' ', body["body"])
+    return body["body"]
+
+# --- THREADS ---
+# Reply drafting and sending read the email's thread through `thread_cache`:
+# one threads.get (metadata format) per thread, invalidated by mailbox sync.
+thread_cache = ThreadCache(governor=memory_governor)
+THREAD_CONTEXT_MESSAGES = int(os.getenv("THREAD_CONTEXT_MESSAGES", "4"))
+THREAD_SNIPPET_CHARS = 300
+
+async def message_thread(user_id: str, service: AsyncGmailClient, message_id: str) -> Tuple[Dict, Dict]:
+    """Returns (thread, message) for a message, looking up its thread ID locally before asking Gmail."""
+    thread_id = thread_cache.thread_id_for(user_id, message_id)
+    if thread_id is None:
+        record = await run_messages(message_store.get, user_id, message_id)
+        thread_id = record.get("thread_id") if record else None
+    if thread_id is None:
+        thread_id = (await service.get_message(message_id, format='minimal'))['threadId']
+
+    thread = await thread_cache.get(user_id, service, thread_id)
+    message = next((m for m in thread["messages"] if m["id"] == message_id), None)
+    if message is None:
+        # Cached before this message arrived and before sync caught up
+        thread_cache.invalidate(user_id, [thread_id])
+        thread = await thread_cache.get(user_id, service, thread_id)
+        message = next((m for m in thread["messages"] if m["id"] == message_id), None)
+    if message is None:
+        raise HTTPException(status_code=404, detail=f"Message {message_id} not found in its thread")
+    return thread, message
+
+def format_thread_context(thread: Dict, message_id: str) -> str:
+    """Sender, date and snippet of the thread's other messages, one line each."""
+    others = context_messages(thread, message_id, THREAD_CONTEXT_MESSAGES)
+    if not others:
+        return ""
+    lines = [f"- {m['sender']} ({m['date']}): {m['snippet'][:THREAD_SNIPPET_CHARS]}" for m in others]
+    return "Other messages in this thread:\n" + "\n".join(lines)
+
+async def reply_thread_context(user_id: str, message_id: Optional[str]) -> str:
+    """Thread context for drafting a reply to `message_id`; drafting goes ahead without it if the thread can't be read."""
+    if not message_id:
+        return ""
     try:
-        service = build('gmail', 'v1', credentials=credentials)
-        return service
-    except HttpError as error:
-        raise HTTPException(status_code=500, detail=f"Failed to create Gmail service: {error}")
+        with tracer.span("thread.context", **{"gmail.message_id": message_id}):
+            service = await get_gmail_service(user_id)
+            thread, _ = await message_thread(user_id, service, message_id)
+    except GmailApiError as error:
+        log.warning("thread_context_unavailable", message_id=message_id, error=str(error))
+        return ""
+    except HTTPException as error:
+        log.warning("thread_context_unavailable", message_id=message_id, error=error.detail)
+        return ""
+    return format_thread_context(thread, message_id)
+
+@app.get("/debug/thread-cache")
+async def debug_thread_cache():
+    """Reports thread cache hit ratio and invalidations."""
+    return thread_cache.snapshot()
+
+# --- MAILBOX SYNC ---
+# The message store's copy of each user's inbox is refreshed through Gmail history deltas,
+# which also invalidate cached threads that gained or lost messages.
+mailbox_sync = MailboxSync(message_store, fetch_message_summaries, on_threads_changed=thread_cache.invalidate,
+                           governor=memory_governor, run=run_messages)
+
+# A sync this recent (usually the background prefetch) is served without calling Gmail
+WARM_MAX_AGE = float(os.getenv("WARM_MAX_AGE", "15"))
+
+async def sync_recent_emails(user_id: str, service: AsyncGmailClient, max_results: int) -> List[Dict]:
+    """Syncs the user's inbox and returns the newest `max_results` summaries (at most one list page)."""
+    # Unbounded, a full sync would page through that many IDs and batch-fetch them all at once
+    max_results = max(1, min(max_results, LISTING_PAGE_LIMIT))
+    if mailbox_sync.synced_within(user_id, WARM_MAX_AGE) and await run_messages(message_store.count_by_label, user_id, 'INBOX') >= max_results:
+        return await run_messages(message_store.list_by_label, user_id, 'INBOX', limit=max_results)
+    sync_result = await mailbox_sync.sync(user_id, service, min_messages=max_results)
+    log.debug("mailbox_sync", user_id=user_id, **sync_result)
+    return await run_messages(message_store.list_by_label, user_id, 'INBOX', limit=max_results)
+
+async def trash_email(user_id: str, service: AsyncGmailClient, message_id: str):
+    """Trashes one message and drops it from the local store so warm reads don't show it."""
+    await service.trash_message(message_id)
+    await run_messages(message_store.delete, user_id, [message_id])
+
+# --- BACKGROUND PREFETCH ---
+async def prefetch_user(user_id: str) -> Dict:
+    """Warms (or refreshes) a user's inbox in the message store."""
+    if await run_state(load_credentials, user_id) is None:
+        prefetcher.unregister(user_id)
+        return {"mode": "skipped"}
+    service = await get_gmail_service(user_id)
+    return await mailbox_sync.sync(user_id, service, min_messages=mailbox_sync.window)
+
+prefetcher = PrefetchWorker(prefetch_user, governor=memory_governor)
+
+@app.get("/debug/prefetch")
+async def debug_prefetch():
+    """Reports background prefetch activity."""
+    return prefetcher.snapshot()
 
 # --- EMAIL OPERATIONS ---
 @app.get("/emails/recent")
-def read_recent_emails(user_id: str = "user_123", max_results: int = 5):
+async def read_recent_emails(user_id: str = Depends(current_user), max_results: int = 5):
     """Fetches recent emails and caches them for context."""
-    service = get_gmail_service(user_id)
+    service = await get_gmail_service(user_id)
     try:
-        results = service.users().messages().list(userId='me', labelIds=['INBOX'], maxResults=max_results).execute()
-        messages = results.get('messages', [])
-        
-        email_summaries = []
-        if not messages:
-            return []
-
-        for message in messages:
-            msg = service.users().messages().get(userId='me', id=message['id']).execute()
-            payload = msg.get('payload', {})
-            headers = payload.get('headers', [])
-            
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            snippet = msg.get('snippet', 'No content available.')
-
-            email_summaries.append({
-                "id": msg['id'],
-                "sender": sender,
-                "subject": subject,
-                "snippet": snippet
-            })
+        email_summaries = await sync_recent_emails(user_id, service, max_results)
         
         # Cache emails for context
-        cache_emails(user_id, email_summaries)
+        await cache_emails(user_id, email_summaries)
         
         return email_summaries
-    except HttpError as error:
-        raise HTTPException(status_code=500, detail=f"An error occurred with the Gmail API: {error}")
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "An error occurred with the Gmail API")
 
-# --- AI REPLY GENERATION ---
-@app.post("/emails/generate-reply")
-def generate_ai_response(email_data: EmailContent, user_id: str = "user_123"):
-    """Generates an AI reply with conversation context."""
+@app.get("/emails/{message_id}/body")
+async def read_email_body(message_id: str, user_id: str = Depends(current_user)):
+    """Fetches the full body of a single email on demand."""
+    service = await get_gmail_service(user_id)
     try:
-        print("\n========== GENERATING AI REPLY ==========")
-        
-        api_key = os.getenv("MISTRAL_API_KEY")
-        model = os.getenv("MISTRAL_MODEL", "mistral-small")
-        if not api_key:
-            raise Exception("MISTRAL_API_KEY not set in environment")
+        msg = await service.get_message(message_id, format='full')
+        body = extract_message_body(msg.get('payload', {}))
 
-        endpoint = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
-        
-        # Include conversation context
-        context = get_conversation_context(user_id, last_n=3)
-        
-        system_prompt = """You are a professional email assistant. Write clear, concise, and context-aware replies.
+        # Index the body so later searches can match on it
+        await run_messages(message_store.upsert, user_id, [summarize_message(msg)])
+        await run_messages(message_store.set_body, user_id, msg['id'], plain_text(body))
+
+        return {"id": msg['id'], **body}
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "An error occurred with the Gmail API")
+
+# --- PAGINATED LISTING ---
+# Large mailboxes are listed a page at a time. The cursor handed to the client
+# wraps Gmail's nextPageToken together with the query it belongs to, since a
+# page token is only valid for the query that produced it.
+LISTING_PAGE_SIZE = 50
+LISTING_PAGE_LIMIT = 500
+
+def encode_cursor(label: Optional[str], q: Optional[str], page_size: int, page_token: str) -> str:
+    cursor_state = {"label": label, "q": q, "page_size": page_size, "page_token": page_token}
+    return base64.urlsafe_b64encode(json.dumps(cursor_state).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Dict:
+    try:
+        cursor_state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not cursor_state.get("page_token"):
+            raise ValueError("missing page token")
+        return cursor_state
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def listing_params(label: Optional[str], q: Optional[str], page_size: int, page_token: Optional[str]) -> Dict:
+    params = {"maxResults": max(1, min(page_size, LISTING_PAGE_LIMIT))}
+    if label:
+        params["labelIds"] = [label]
+    if q:
+        params["q"] = q
+    if page_token:
+        params["pageToken"] = page_token
+    return params
+
+@app.get("/emails/page")
+async def list_emails_page(user_id: str = Depends(current_user), cursor: Optional[str] = None, label: Optional[str] = "INBOX", q: Optional[str] = None, page_size: int = LISTING_PAGE_SIZE):
+    """
+    Returns one page of email summaries plus `next_cursor` for the following page.
+    Pass only `cursor` to continue a listing; it carries the label, query and page size.
+    """
+    page_token = None
+    if cursor:
+        cursor_state = decode_cursor(cursor)
+        label, q, page_size, page_token = cursor_state["label"], cursor_state["q"], cursor_state["page_size"], cursor_state["page_token"]
+    service = await get_gmail_service(user_id)
+    try:
+        results = await service.list_messages(**listing_params(label, q, page_size, page_token))
+        summaries = await fetch_message_summaries(service, [m['id'] for m in results.get('messages', [])])
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "An error occurred with the Gmail API")
+
+    await run_messages(message_store.upsert, user_id, summaries)
+    if not cursor:
+        await cache_emails(user_id, summaries)
+    next_token = results.get('nextPageToken')
+    return {
+        "emails": summaries,
+        "next_cursor": encode_cursor(label, q, page_size, next_token) if next_token else None,
+        "result_size_estimate": results.get('resultSizeEstimate')
+    }
+
+async def stream_email_summaries(user_id: str, service: AsyncGmailClient, label: Optional[str], q: Optional[str], page_size: int, page_token: Optional[str], max_pages: Optional[int]):
+    """
+    Yields NDJSON lines: one {"type": "email"} line per summary, in listing order,
+    as soon as the batch holding it arrives, then a final {"type": "end"} line.
+    Only one page is held in memory; the next page is listed while the current one is fetched.
+    """
+    count, pages = 0, 0
+    listing = asyncio.create_task(service.list_messages(**listing_params(label, q, page_size, page_token)))
+    pending = []
+    try:
+        while listing is not None:
+            results = await listing
+            listing = None
+            pages += 1
+            next_token = results.get('nextPageToken')
+            if next_token and (max_pages is None or pages < max_pages):
+                listing = asyncio.create_task(service.list_messages(**listing_params(label, q, page_size, next_token)))
+
+            ids = [m['id'] for m in results.get('messages', [])]
+            pending = [
+                asyncio.create_task(fetch_message_summaries(service, ids[i:i + GMAIL_BATCH_SIZE]))
+                for i in range(0, len(ids), GMAIL_BATCH_SIZE)
+            ]
+            for task in pending:
+                summaries = await task
+                await run_messages(message_store.upsert, user_id, summaries)
+                for summary in summaries:
+                    count += 1
+                    yield json.dumps({"type": "email", "email": summary}) + "\n"
+            pending = []
+
+        next_cursor = encode_cursor(label, q, page_size, next_token) if next_token else None
+        yield json.dumps({"type": "end", "count": count, "pages": pages, "next_cursor": next_cursor}) + "\n"
+    except GmailApiError as error:
+        yield json.dumps({"type": "error", "count": count, "detail": str(error)}) + "\n"
+    finally:
+        # Client went away or an error stopped us: drop in-flight Gmail calls
+        for task in pending + ([listing] if listing else []):
+            task.cancel()
+
+@app.get("/emails/stream")
+async def stream_emails(user_id: str = Depends(current_user), cursor: Optional[str] = None, label: Optional[str] = "INBOX", q: Optional[str] = None, page_size: int = LISTING_PAGE_LIMIT, max_pages: Optional[int] = None):
+    """Streams email summaries as NDJSON across as many pages as needed (or `max_pages`)."""
+    page_token = None
+    if cursor:
+        cursor_state = decode_cursor(cursor)
+        label, q, page_size, page_token = cursor_state["label"], cursor_state["q"], cursor_state["page_size"], cursor_state["page_token"]
+    service = await get_gmail_service(user_id)
+    return StreamingResponse(
+        stream_email_summaries(user_id, service, label, q, page_size, page_token, max_pages),
+        media_type="application/x-ndjson"
+    )
+
+# --- SEARCH ---
+async def search_emails(user_id: str, service: AsyncGmailClient, text: str = "", sender: Optional[str] = None, limit: int = 10) -> List[Dict]:
+    """
+    Searches the local full-text index after a cheap history sync (skipped
+    when one ran in the last WARM_MAX_AGE seconds). Only when nothing matches
+    locally does it fall back to a Gmail query.
+    """
+    if not mailbox_sync.synced_within(user_id, WARM_MAX_AGE):
+        await mailbox_sync.sync(user_id, service)
+    results = await run_messages(message_store.search, user_id, text, sender=sender, limit=limit)
+    if results:
+        return results
+
+    query = " ".join(filter(None, [sender_query(sender) if sender else None, text]))
+    if not query:
+        return []
+    listed = await service.list_messages(q=query, maxResults=limit)
+    results = await fetch_message_summaries(service, [m['id'] for m in listed.get('messages', [])])
+    await run_messages(message_store.upsert, user_id, results)
+    return results
+
+@app.get("/emails/search")
+async def search_emails_endpoint(q: str = "", sender: Optional[str] = None, limit: int = 10, user_id: str = Depends(current_user)):
+    """Searches cached mail by sender, subject, snippet and fetched body text."""
+    service = await get_gmail_service(user_id)
+    try:
+        results = await search_emails(user_id, service, q, sender=sender, limit=limit)
+        await cache_emails(user_id, results)
+        return results
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "An error occurred with the Gmail API")
+
+# --- REPLY CACHE ---
+reply_cache = create_reply_cache()
+
+@app.get("/debug/reply-cache")
+async def debug_reply_cache():
+    """Reports reply cache hit/miss counters and size."""
+    return reply_cache.snapshot()
+
+# --- AI REPLY GENERATION ---
+REPLY_FALLBACK = """Thank you for your email. I've reviewed your message and will get back to you with a detailed response shortly.
+
+Best regards"""
+
+def get_mistral_client() -> AsyncMistralClient:
+    """Mistral client from MISTRAL_API_KEY / MISTRAL_API_URL."""
+    api_key = os.getenv("MISTRAL_API_KEY")
+    if not api_key:
+        raise Exception("MISTRAL_API_KEY not set in environment")
+    endpoint = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+    return AsyncMistralClient(api_key, endpoint)
+
+# Emails are condensed (quoted history and signatures stripped, cached per email)
+# and the prompt is kept within PROMPT_TOKEN_BUDGET; see prompt_builder.py.
+prompt_builder = PromptBuilder()
+
+REPLY_SYSTEM_PROMPT = """You are a professional email assistant. Write clear, concise, and context-aware replies.
 Consider the conversation history and maintain consistency in tone and style.
 Your replies should be professional, helpful, and ready to send."""
 
-        user_prompt = f"""{context}
+REPLY_USER_PROMPT = """{context}
 
 Based on this email content, write a professional reply:
 
-{email_data.content}
+{content}
 
 Generate a reply that is appropriate, professional, and addresses the key points."""
 
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 200
-        }
+def join_context(*sections: str) -> str:
+    return "\n\n".join(section for section in sections if section)
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+def build_reply_payload(content: str, context: str = "", thread_context: str = "") -> Tuple[Dict, Dict]:
+    """Chat completion payload for drafting a reply, and its prompt token report."""
+    model = os.getenv("MISTRAL_MODEL", "mistral-small")
+    
+    email = prompt_builder.condense(content)
+
+    # The email gets its own budget; thread context outranks the chatbot conversation for the rest
+    fixed_tokens = estimate_tokens(REPLY_SYSTEM_PROMPT) + estimate_tokens(REPLY_USER_PROMPT.format(context="", content="")) + email["tokens"]
+    fitted_thread, fitted_context = prompt_builder.fit([thread_context, context], prompt_builder.budget - fixed_tokens)
+    user_prompt = REPLY_USER_PROMPT.format(context=join_context(fitted_context, fitted_thread), content=email["text"])
+
+    prompt_tokens = estimate_tokens(REPLY_SYSTEM_PROMPT) + estimate_tokens(user_prompt)
+    unbounded_tokens = estimate_tokens(REPLY_SYSTEM_PROMPT) + \
+        estimate_tokens(REPLY_USER_PROMPT.format(context=join_context(context, thread_context), content=content))
+    report = {
+        "prompt_tokens": prompt_tokens,
+        "email_tokens": email["tokens"],
+        "context_tokens": estimate_tokens(fitted_context) + estimate_tokens(fitted_thread),
+        "tokens_saved": max(0, unbounded_tokens - prompt_tokens),
+        "truncated": email["truncated"] or fitted_thread != thread_context or fitted_context != context,
+    }
+    prompt_builder.record(report)
+    log.debug("reply_prompt", tokens=prompt_tokens, saved=report["tokens_saved"], truncated=report["truncated"])
+
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": REPLY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 200
+    }
+    return payload, report
+
+@app.get("/debug/prompt")
+async def debug_prompt():
+    """Reports prompt sizes, tokens saved by condensing and the condensed-email cache hit ratio."""
+    return prompt_builder.snapshot()
+
+async def draft_reply(mistral: AsyncMistralClient, content: str, user_id: str, refresh: bool = False, thread_context: str = "") -> Dict:
+    """Drafts one reply through the reply cache; returns {"reply", "cached", "prompt"}."""
+    # Include conversation context
+    context = await get_conversation_context(user_id, last_n=3)
+    with tracer.span("reply.prompt") as span:
+        payload, prompt = build_reply_payload(content, context, thread_context)
+        span.set_attribute("llm.prompt_tokens", prompt["prompt_tokens"])
+
+    cache_key = reply_cache_key(payload)
+    if not refresh:
+        cached_reply = reply_cache.get(cache_key)
+        if cached_reply is not None:
+            return {"reply": cached_reply, "cached": True, "prompt": prompt}
+
+    resp = await mistral.chat(payload, timeout=30)
+    
+    if resp.status_code != 200:
+        return {"reply": REPLY_FALLBACK, "cached": False, "prompt": prompt}
 
-        resp = requests.post(endpoint, headers=headers, json=payload, timeout=30)
+    data = resp.json()
+    reply_text = None
+    
+    if isinstance(data, dict):
+        choices = data.get("choices")
+        if choices and isinstance(choices, list):
+            first = choices[0]
+            if isinstance(first, dict):
+                msg = first.get("message") or first.get("delta")
+                if isinstance(msg, dict):
+                    reply_text = msg.get("content") or msg.get("text")
+
+    reply_text = (reply_text or "").strip()
+    if reply_text:
+        reply_cache.put(cache_key, reply_text)
+    return {"reply": reply_text, "cached": False, "prompt": prompt}
+
+@app.post("/emails/generate-reply")
+async def generate_ai_response(email_data: EmailContent, user_id: str = Depends(current_user), refresh: bool = False):
+    """Generates an AI reply with conversation context. Pass refresh=true to bypass the reply cache."""
+    try:
+        mistral = get_mistral_client()
+        thread_context = await reply_thread_context(user_id, email_data.message_id)
+        result = await draft_reply(mistral, email_data.content, user_id, refresh, thread_context)
+        log.debug("reply_generated", user_id=user_id, cached=result["cached"])
+        return {"reply": result["reply"], "prompt": result["prompt"]}
         
-        if resp.status_code != 200:
-            fallback = """Thank you for your email. I've reviewed your message and will get back to you with a detailed response shortly.
+    except Exception as e:
+        log.error("reply_failed", user_id=user_id, error=str(e))
+        raise HTTPException(status_code=500, detail=f"Error with AI: {str(e)}")
 
-Best regards"""
-            return {"reply": fallback}
+def sse_event(event: str, data: Dict) -> str:
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        data = resp.json()
-        reply_text = None
-        
-        if isinstance(data, dict):
-            choices = data.get("choices")
-            if choices and isinstance(choices, list):
-                first = choices[0]
-                if isinstance(first, dict):
-                    msg = first.get("message") or first.get("delta")
-                    if isinstance(msg, dict):
-                        reply_text = msg.get("content") or msg.get("text")
-
-        reply_text = (reply_text or "").strip()
-        
-        print(f"[SUCCESS] Generated reply")
-        return {"reply": reply_text}
-        
+@app.post("/emails/generate-reply/stream")
+async def stream_ai_response(email_data: EmailContent, request: Request, user_id: str = Depends(current_user), refresh: bool = False):
+    """
+    Streams an AI reply as server-sent events: `token` events carry text deltas,
+    then a final `done` event carries the whole reply (or `error` on failure).
+    Generation stops when the client disconnects.
+    """
+    try:
+        mistral = get_mistral_client()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error with AI: {str(e)}")
+    thread_context = await reply_thread_context(user_id, email_data.message_id)
+    context = await get_conversation_context(user_id, last_n=3)
+    payload, prompt = build_reply_payload(email_data.content, context, thread_context)
+    cache_key = reply_cache_key(payload)
+
+    async def events():
+        cached_reply = None if refresh else reply_cache.get(cache_key)
+        if cached_reply is not None:
+            yield sse_event("token", {"delta": cached_reply})
+            yield sse_event("done", {"reply": cached_reply, "cached": True, "prompt": prompt})
+            return
+
+        parts = []
+        try:
+            # aclosing() shuts the upstream stream as soon as we stop reading
+            async with aclosing(mistral.stream_chat(payload, timeout=30)) as deltas:
+                async for delta in deltas:
+                    if await request.is_disconnected():
+                        log.debug("reply_stream_cancelled", user_id=user_id)
+                        return
+                    parts.append(delta)
+                    yield sse_event("token", {"delta": delta})
+        except MistralApiError as error:
+            log.error("reply_stream_failed", user_id=user_id, error=str(error))
+            if not parts:
+                yield sse_event("token", {"delta": REPLY_FALLBACK})
+                yield sse_event("done", {"reply": REPLY_FALLBACK, "cached": False, "prompt": prompt})
+                return
+            yield sse_event("error", {"detail": str(error)})
+            return
+        except Exception as e:
+            log.error("reply_stream_failed", user_id=user_id, error=str(e))
+            yield sse_event("error", {"detail": f"Error with AI: {str(e)}"})
+            return
+
+        reply_text = "".join(parts).strip()
+        if reply_text:
+            reply_cache.put(cache_key, reply_text)
+        log.debug("reply_streamed", user_id=user_id, chars=len(reply_text))
+        yield sse_event("done", {"reply": reply_text, "cached": False, "prompt": prompt})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- BATCH REPLY DRAFTING ---
+# Drafts for a batch of emails run concurrently, so a batch takes about as long as
+# its slowest draft. Each request runs at most DRAFT_CONCURRENCY drafts at once
+# (the Mistral client's semaphore still bounds the whole process) and gives each
+# one DRAFT_TIMEOUT seconds.
+DRAFT_CONCURRENCY = int(os.getenv("DRAFT_CONCURRENCY", "32"))
+DRAFT_TIMEOUT = float(os.getenv("DRAFT_TIMEOUT", "45"))
+DRAFT_BATCH_MAX = 50
+
+async def draft_sources(user_id: str, request: BatchDraftRequest) -> List[Dict]:
+    """One {"index", "message_id", "content"} item per requested email, fetching bodies and thread context for message IDs."""
+    items = [{"index": i, "message_id": None, "content": content} for i, content in enumerate(request.contents or [])]
+    message_ids = list(dict.fromkeys(request.message_ids or []))
+    if message_ids:
+        service = await get_gmail_service(user_id)
+        fetched = {msg['id']: msg for msg in await fetch_messages_batched(service, message_ids, format='full')}
+        for message_id in message_ids:
+            msg = fetched.get(message_id)
+            content = None
+            if msg is not None:
+                summary = summarize_message(msg)
+                content = f"From: {summary['sender']}\nSubject: {summary['subject']}\n\n{plain_text(extract_message_body(msg.get('payload', {})))}"
+            items.append({"index": len(items), "message_id": message_id, "content": content})
+        contexts = await asyncio.gather(*(reply_thread_context(user_id, item["message_id"]) for item in items))
+        for item, thread_context in zip(items, contexts):
+            item["thread_context"] = thread_context
+    return items
+
+async def draft_batch(user_id: str, items: List[Dict], concurrency: int, timeout: float, refresh: bool = False):
+    """Drafts replies concurrently, yielding each result as soon as it completes."""
+    mistral = get_mistral_client()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def draft(item: Dict) -> Dict:
+        result = {"index": item["index"], "message_id": item["message_id"]}
+        if item["content"] is None:
+            return {**result, "status": "error", "detail": "Message not found"}
+        async with slots:
+            start = time.perf_counter()
+            try:
+                draft = await asyncio.wait_for(draft_reply(mistral, item["content"], user_id, refresh, item.get("thread_context", "")), timeout)
+                return {**result, "status": "ok", **draft, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+            except asyncio.TimeoutError:
+                return {**result, "status": "timeout", "detail": f"No reply within {timeout:g}s"}
+            except Exception as e:
+                return {**result, "status": "error", "detail": str(e)}
+
+    tasks = [asyncio.create_task(draft(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client went away (or the caller stopped early): don't keep drafting
+        for task in tasks:
+            task.cancel()
+
+@app.post("/emails/generate-replies")
+async def generate_ai_responses(request: BatchDraftRequest, user_id: str = Depends(current_user), stream: bool = False):
+    """
+    Drafts replies for several emails (message_ids and/or raw contents) concurrently.
+    With stream=true, each draft is sent as a `draft` server-sent event as soon as it
+    completes, followed by a `done` summary; otherwise all drafts are returned in request order.
+    """
+    if not request.message_ids and not request.contents:
+        raise HTTPException(status_code=400, detail="Provide message_ids or contents")
+    if len(request.message_ids or []) + len(request.contents or []) > DRAFT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {DRAFT_BATCH_MAX} emails per batch")
+    concurrency = max(1, min(request.concurrency or DRAFT_CONCURRENCY, DRAFT_BATCH_MAX))
+    timeout = request.timeout or DRAFT_TIMEOUT
+
+    try:
+        items = await draft_sources(user_id, request)
+        get_mistral_client()
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "Failed to fetch emails to draft")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"\n[ERROR] AI generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error with AI: {str(e)}")
 
+    start = time.perf_counter()
+    summary = {"total": len(items), "completed": 0, "failed": 0}
+
+    def record(result: Dict):
+        summary["completed" if result["status"] == "ok" else "failed"] += 1
+
+    def finish() -> Dict:
+        summary["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        log.info("replies_drafted", user_id=user_id, completed=summary["completed"], total=summary["total"],
+                 elapsed_ms=summary["elapsed_ms"])
+        return summary
+
+    if stream:
+        async def events():
+            async with aclosing(draft_batch(user_id, items, concurrency, timeout, request.refresh)) as results:
+                async for result in results:
+                    record(result)
+                    yield sse_event("draft", result)
+            yield sse_event("done", finish())
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    drafts = []
+    async for result in draft_batch(user_id, items, concurrency, timeout, request.refresh):
+        record(result)
+        drafts.append(result)
+    return {**finish(), "drafts": sorted(drafts, key=lambda d: d["index"])}
+
 # --- DELETE EMAIL ---
 @app.post("/emails/delete")
-def delete_email(message: MessageId, user_id: str = "user_123"):
+async def delete_email(message: MessageId, user_id: str = Depends(current_user)):
     """Deletes a specific email by its message ID."""
-    service = get_gmail_service(user_id)
+    service = await get_gmail_service(user_id)
     try:
-        service.users().messages().trash(userId='me', id=message.message_id).execute()
-        add_to_conversation(user_id, "assistant", f"Email deleted successfully.", "delete_email")
+        await trash_email(user_id, service, message.message_id)
+        await add_to_conversation(user_id, "assistant", f"Email deleted successfully.", "delete_email")
         return {"status": "success", "message": f"Email with ID {message.message_id} moved to trash."}
-    except HttpError as error:
-        raise HTTPException(status_code=500, detail=f"Failed to delete email: {error}")
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "Failed to delete email")
+
+# --- BULK DELETE ---
+# users.messages.batchModify accepts at most 1000 IDs per call.
+BULK_CHUNK_SIZE = 1000
+# Upper bound on how many messages one bulk delete may touch
+BULK_DELETE_MAX = int(os.getenv("BULK_DELETE_MAX", "5000"))
+# How long a chatbot bulk delete waits for its "yes"
+BULK_CONFIRM_TTL = int(os.getenv("BULK_CONFIRM_TTL", "300"))
+LIST_PAGE_SIZE = 500
+
+def gmail_phrase(value: str) -> str:
+    """Quotes a value for a Gmail search operator, so `from:"my boss"` matches the whole name."""
+    return '"' + value.replace('"', ' ').strip() + '"'
+
+def sender_query(sender: str, subject: Optional[str] = None) -> str:
+    """Gmail search query for mail from `sender`, optionally narrowed to a subject."""
+    query = f"from:{gmail_phrase(sender)}"
+    if subject:
+        query += f" subject:{gmail_phrase(subject)}"
+    return query
+
+async def list_matching_ids(service: AsyncGmailClient, query: str, max_ids: int = BULK_DELETE_MAX) -> List[str]:
+    """Collects message IDs for a Gmail search query across result pages."""
+    message_ids, page_token = [], None
+    while len(message_ids) < max_ids:
+        params = {"q": query, "maxResults": min(LIST_PAGE_SIZE, max_ids - len(message_ids))}
+        if page_token:
+            params["pageToken"] = page_token
+        results = await service.list_messages(**params)
+        message_ids.extend(m['id'] for m in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return message_ids
+
+async def bulk_trash(user_id: str, service: AsyncGmailClient, message_ids: List[str]):
+    """Trashes messages in chunks of up to 1000, yielding a progress dict after each chunk."""
+    total = len(message_ids)
+    done = 0
+    for offset in range(0, total, BULK_CHUNK_SIZE):
+        chunk = message_ids[offset:offset + BULK_CHUNK_SIZE]
+        await service.batch_modify(chunk, add_label_ids=['TRASH'], remove_label_ids=['INBOX'])
+        await run_messages(message_store.delete, user_id, chunk)
+        done += len(chunk)
+        log.debug("bulk_delete_progress", user_id=user_id, done=done, total=total)
+        yield {"done": done, "total": total, "chunk": offset // BULK_CHUNK_SIZE + 1}
+
+def bulk_query(request: BulkDeleteRequest) -> Optional[str]:
+    """Gmail search query for a bulk delete request."""
+    terms = []
+    if request.sender:
+        terms.append(f"from:{gmail_phrase(request.sender)}")
+    if request.query:
+        terms.append(request.query)
+    return " ".join(terms) or None
+
+@app.post("/emails/bulk-delete")
+async def bulk_delete_emails(request: BulkDeleteRequest, user_id: str = Depends(current_user), stream: bool = False):
+    """
+    Trashes every email matching a sender/query, or an explicit ID list, with batchModify.
+    With stream=true, progress is sent as server-sent events.
+    """
+    service = await get_gmail_service(user_id)
+    query = bulk_query(request)
+    if not query and not request.message_ids:
+        raise HTTPException(status_code=400, detail="Provide a sender, query or message_ids")
+    if query and request.message_ids:
+        raise HTTPException(status_code=400, detail="Provide either a sender/query or message_ids, not both")
+    max_messages = min(request.max_messages or BULK_DELETE_MAX, BULK_DELETE_MAX)
+
+    try:
+        if query:
+            message_ids = await list_matching_ids(service, query, max_messages)
+        else:
+            message_ids = list(dict.fromkeys(request.message_ids))[:max_messages]
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "Failed to list emails")
+
+    summary = {"status": "success", "query": query, "matched": len(message_ids), "trashed": 0}
+
+    async def record_action():
+        if summary["trashed"]:
+            await add_to_conversation(user_id, "assistant", f"Bulk trashed {summary['trashed']} email(s).", "bulk_delete")
+
+    if stream:
+        async def events():
+            try:
+                async for progress in bulk_trash(user_id, service, message_ids):
+                    summary["trashed"] = progress["done"]
+                    yield sse_event("progress", progress)
+            except GmailApiError as error:
+                summary["status"] = "error"
+                summary["detail"] = str(error)
+            await record_action()
+            yield sse_event("done", summary)
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    progress_log = []
+    try:
+        async for progress in bulk_trash(user_id, service, message_ids):
+            summary["trashed"] = progress["done"]
+            progress_log.append(progress)
+    except GmailApiError as error:
+        await record_action()
+        raise gmail_http_exception(error, f"Bulk delete stopped after {summary['trashed']} email(s)")
+    await record_action()
+    return {**summary, "progress": progress_log}
+
+async def confirm_bulk_delete(user_id: str, service: AsyncGmailClient, pending: Dict) -> Dict:
+    """Trashes the messages a chatbot bulk delete listed, once the user has said yes."""
+    message_ids, description = pending["message_ids"], pending["description"]
+    trashed = 0
+    try:
+        async for progress in bulk_trash(user_id, service, message_ids):
+            trashed = progress["done"]
+    except GmailApiError as error:
+        response = (f"I moved {trashed} of {len(message_ids)} email(s) {description} to trash, "
+                    f"then Gmail returned an error: {error}. Ask again to retry the rest.")
+        await add_to_conversation(user_id, "assistant", response, "bulk_delete" if trashed else None)
+        return {"reply": response, "deleted_count": trashed}
+    response = f"I've moved {trashed} email(s) {description} to trash."
+    if trashed >= BULK_DELETE_MAX:
+        response += f" I stopped at {BULK_DELETE_MAX}; ask again to continue."
+    await add_to_conversation(user_id, "assistant", response, "bulk_delete")
+    return {"reply": response, "deleted_count": trashed}
 
 # --- ENHANCED CHATBOT COMMAND PROCESSOR ---
 @app.post("/chatbot/command")
-def process_chatbot_command(request: ChatCommand, user_id: str = "user_123"):
+async def process_chatbot_command(request: ChatCommand, user_id: str = Depends(current_user)):
     """
     Enhanced chatbot with context awareness and better intent understanding.
     """
     command = request.command.strip()
     
     # Add user message to conversation
-    add_to_conversation(user_id, "user", command)
+    await add_to_conversation(user_id, "user", command)
     
     # Detect intent and extract entities
     analysis = detect_intent_and_entities(command, user_id)
     intent = analysis["intent"]
     entities = analysis["entities"]
     
-    print(f"[DEBUG] Detected Intent: {intent}, Entities: {entities}")
+    log.debug("intent_detected", user_id=user_id, intent=intent, entities=entities)
     
-    service = get_gmail_service(user_id)
+    service = await get_gmail_service(user_id)
     
     try:
+        # A bulk delete waits for a yes/no; anything else drops it
+        pending = await run_state(state.get, "pending_bulk_delete", user_id)
+        if pending is not None:
+            await run_state(state.delete, "pending_bulk_delete", user_id)
+            answer = match_confirmation(command)
+            if answer:
+                return await confirm_bulk_delete(user_id, service, pending)
+            if answer is False:
+                response = "Okay, I won't delete anything."
+                await add_to_conversation(user_id, "assistant", response)
+                return {"reply": response}
+        
         # Handle greetings
         if intent == "greet":
             response = "Hello! How can I help you with your emails today?"
-            add_to_conversation(user_id, "assistant", response)
+            await add_to_conversation(user_id, "assistant", response)
             return {"reply": response}
         
         # Handle help requests
         if intent == "help":
             response = generate_help_message()
-            add_to_conversation(user_id, "assistant", response)
+            await add_to_conversation(user_id, "assistant", response)
             return {"reply": response}
         
         # Handle status requests
         if intent == "status":
-            last_action = get_last_action(user_id)
+            last_action = await get_last_action(user_id)
             if last_action:
                 response = f"The last action I performed was: {last_action}"
             else:
                 response = "I haven't performed any actions yet. How can I help you?"
-            add_to_conversation(user_id, "assistant", response)
+            await add_to_conversation(user_id, "assistant", response)
             return {"reply": response}
         
         # Handle fetch/read emails
         if intent == "fetch_emails":
-            count = entities.get("count", 5)
+            count = min(entities.get("count", 5), LISTING_PAGE_LIMIT)
             sender = entities.get("sender")
             
             if sender:
-                query = f"from:{sender}"
-                results = service.users().messages().list(userId='me', q=query, maxResults=count).execute()
+                results = await service.list_messages(q=sender_query(sender), maxResults=count)
                 messages = results.get('messages', [])
                 
                 if not messages:
                     response = f"I couldn't find any emails from '{sender}'."
-                    add_to_conversation(user_id, "assistant", response)
+                    await add_to_conversation(user_id, "assistant", response)
                     return {"reply": response}
                 
                 # Fetch and format emails
-                email_list = []
-                for msg_stub in messages:
-                    msg = service.users().messages().get(userId='me', id=msg_stub['id']).execute()
-                    headers = {h['name']: h['value'] for h in msg['payload']['headers']}
-                    email_list.append({
-                        "id": msg['id'],
-                        "sender": headers.get('From', 'Unknown'),
-                        "subject": headers.get('Subject', 'No Subject'),
-                        "snippet": msg.get('snippet', '')
-                    })
+                email_list = await fetch_message_summaries(service, [m['id'] for m in messages])
                 
-                cache_emails(user_id, email_list)
+                await cache_emails(user_id, email_list)
                 
                 response = f"Found {len(email_list)} email(s) from '{sender}':\n\n"
                 for i, email in enumerate(email_list, 1):
                     response += f"{i}. **{email['subject']}**\n   From: {email['sender']}\n   {email['snippet'][:100]}...\n\n"
                 
-                add_to_conversation(user_id, "assistant", response, "fetch_emails")
+                await add_to_conversation(user_id, "assistant", response, "fetch_emails")
                 return {"reply": response}
             
             else:
                 # Fetch recent emails
-                results = service.users().messages().list(userId='me', labelIds=['INBOX'], maxResults=count).execute()
-                messages = results.get('messages', [])
+                email_list = await sync_recent_emails(user_id, service, count)
                 
-                email_list = []
-                for msg_stub in messages:
-                    msg = service.users().messages().get(userId='me', id=msg_stub['id']).execute()
-                    headers = {h['name']: h['value'] for h in msg['payload']['headers']}
-                    email_list.append({
-                        "id": msg['id'],
-                        "sender": headers.get('From', 'Unknown'),
-                        "subject": headers.get('Subject', 'No Subject'),
-                        "snippet": msg.get('snippet', '')
-                    })
-                
-                cache_emails(user_id, email_list)
+                await cache_emails(user_id, email_list)
                 
                 response = f"Here are your latest {len(email_list)} emails:\n\n"
                 for i, email in enumerate(email_list, 1):
                     response += f"{i}. **{email['subject']}**\n   From: {email['sender']}\n   {email['snippet'][:100]}...\n\n"
                 
-                add_to_conversation(user_id, "assistant", response, "fetch_emails")
+                await add_to_conversation(user_id, "assistant", response, "fetch_emails")
                 return {"reply": response}
         
         # Handle delete requests
@@ -623,53 +1419,97 @@ def process_chatbot_command(request: ChatCommand, user_id: str = "user_123"):
             sender = entities.get("sender")
             email_ref = entities.get("email_reference")
             
-            if sender:
+            if sender and entities.get("bulk"):
+                # List what would be trashed and ask first; the "yes" is handled above
+                subject = entities.get("subject")
+                message_ids = await list_matching_ids(service, sender_query(sender, subject))
+                description = f"from '{sender}'" + (f" about '{subject}'" if subject else "")
+                if not message_ids:
+                    response = f"I couldn't find any emails {description}."
+                    await add_to_conversation(user_id, "assistant", response)
+                    return {"reply": response}
+                
+                await run_state(state.set, "pending_bulk_delete", user_id,
+                                {"message_ids": message_ids, "description": description}, BULK_CONFIRM_TTL)
+                found = f"at least {len(message_ids)}" if len(message_ids) >= BULK_DELETE_MAX else str(len(message_ids))
+                response = (f"I found {found} email(s) {description}. Move {len(message_ids)} of them to trash? "
+                            "Reply 'yes' to confirm or 'no' to cancel.")
+                await add_to_conversation(user_id, "assistant", response)
+                return {"reply": response, "matched": len(message_ids), "needs_confirmation": True}
+            
+            elif sender:
                 # Delete by sender
-                results = service.users().messages().list(userId='me', q=f"from:{sender}", maxResults=1).execute()
+                results = await service.list_messages(q=sender_query(sender), maxResults=1)
                 messages = results.get('messages', [])
                 
                 if not messages:
                     response = f"I couldn't find any emails from '{sender}'."
-                    add_to_conversation(user_id, "assistant", response)
+                    await add_to_conversation(user_id, "assistant", response)
                     return {"reply": response}
                 
                 message_id = messages[0]['id']
-                service.users().messages().trash(userId='me', id=message_id).execute()
+                await trash_email(user_id, service, message_id)
                 response = f"I've deleted the latest email from '{sender}'."
-                add_to_conversation(user_id, "assistant", response, "delete_email")
+                await add_to_conversation(user_id, "assistant", response, "delete_email")
                 return {"reply": response}
             
             elif email_ref:
                 # Delete by reference (this, that, first, etc.)
-                email = find_email_by_reference(user_id, email_ref)
+                email = await find_email_by_reference(user_id, email_ref)
                 
                 if not email:
                     response = "I couldn't identify which email you want to delete. Could you be more specific?"
-                    add_to_conversation(user_id, "assistant", response)
+                    await add_to_conversation(user_id, "assistant", response)
                     return {"reply": response}
                 
-                service.users().messages().trash(userId='me', id=email['id']).execute()
+                await trash_email(user_id, service, email['id'])
                 response = f"I've deleted the email '{email['subject']}' from {email['sender']}."
-                add_to_conversation(user_id, "assistant", response, "delete_email")
+                await add_to_conversation(user_id, "assistant", response, "delete_email")
                 return {"reply": response}
             
             else:
                 response = "Please specify which email you want to delete. For example: 'delete the email from Amazon' or 'delete the first email'."
-                add_to_conversation(user_id, "assistant", response)
+                await add_to_conversation(user_id, "assistant", response)
                 return {"reply": response}
         
+        # Handle search requests
+        if intent == "search_email":
+            sender = entities.get("sender")
+            text = entities.get("subject")
+            if not text and not sender:
+                text = re.sub(r'\b(search|find|look for|locate)\b', ' ', command.lower())
+            # Filler such as "my emails for" would otherwise reach the FTS and Gmail queries
+            text = " ".join(search_terms(text))
+            
+            email_list = await search_emails(user_id, service, text or "", sender=sender, limit=min(entities.get("count", 5), LISTING_PAGE_LIMIT))
+            description = " ".join(filter(None, [text and f"matching '{text}'", sender and f"from '{sender}'"]))
+            
+            if not email_list:
+                response = f"I couldn't find any emails {description}."
+                await add_to_conversation(user_id, "assistant", response)
+                return {"reply": response}
+            
+            await cache_emails(user_id, email_list)
+            
+            response = f"Found {len(email_list)} email(s) {description}:\n\n"
+            for i, email in enumerate(email_list, 1):
+                response += f"{i}. **{email['subject']}**\n   From: {email['sender']}\n   {email['snippet'][:100]}...\n\n"
+            
+            await add_to_conversation(user_id, "assistant", response, "search_email")
+            return {"reply": response}
+        
         # Handle generate reply
         if intent == "generate_reply":
             email_ref = entities.get("email_reference") or command
-            email = find_email_by_reference(user_id, email_ref)
+            email = await find_email_by_reference(user_id, email_ref)
             
             if not email:
                 response = "Please fetch emails first, then I can help you draft a reply."
-                add_to_conversation(user_id, "assistant", response)
+                await add_to_conversation(user_id, "assistant", response)
                 return {"reply": response}
             
             response = f"I'll draft a reply for the email '{email['subject']}'. Please use the 'Generate Reply' button on the email."
-            add_to_conversation(user_id, "assistant", response, "generate_reply")
+            await add_to_conversation(user_id, "assistant", response, "generate_reply")
             return {"reply": response}
         
         # Default fallback with suggestions
@@ -682,32 +1522,33 @@ def process_chatbot_command(request: ChatCommand, user_id: str = "user_123"):
 
 What would you like to do?"""
         
-        add_to_conversation(user_id, "assistant", response)
+        await add_to_conversation(user_id, "assistant", response)
         return {"reply": response}
         
-    except HttpError as error:
-        response = f"I encountered an error: {str(error)}. Please try again."
-        add_to_conversation(user_id, "assistant", response)
+    except GmailApiError as error:
+        if is_rate_limited(error.status_code, error.reason):
+            response = "Gmail is limiting how fast I can work on your mailbox right now. Please try again in a few seconds."
+        else:
+            response = f"I encountered an error: {str(error)}. Please try again."
+        await add_to_conversation(user_id, "assistant", response)
         return {"reply": response}
     except Exception as e:
         response = f"Something went wrong: {str(e)}. Please try again."
-        add_to_conversation(user_id, "assistant", response)
+        await add_to_conversation(user_id, "assistant", response)
         return {"reply": response}
 
 # --- SEND EMAIL REPLY ---
 @app.post("/emails/send")
-def send_email_reply(payload: SendRequest, user_id: str = "user_123"):
-    """Sends a reply to the original email."""
-    service = get_gmail_service(user_id)
+async def send_email_reply(payload: SendRequest, user_id: str = Depends(current_user)):
+    """Sends a reply to the original email, in its thread."""
+    service = await get_gmail_service(user_id)
     try:
-        original = service.users().messages().get(userId='me', id=payload.message_id, format='full').execute()
-        headers = {h['name']: h['value'] for h in original.get('payload', {}).get('headers', [])}
-
-        orig_from = headers.get('From', '')
-        orig_subject = headers.get('Subject', '')
-        orig_message_id = headers.get('Message-ID') or headers.get('Message-Id')
+        # Headers come from the cached thread (usually already read while drafting)
+        thread, original = await message_thread(user_id, service, payload.message_id)
+        orig_subject = original['subject']
+        orig_message_id = original['message_id']
 
-        _, from_email = parseaddr(orig_from)
+        _, from_email = parseaddr(original['sender'])
         if not from_email:
             raise HTTPException(status_code=400, detail="Unable to determine recipient")
 
@@ -718,7 +1559,7 @@ def send_email_reply(payload: SendRequest, user_id: str = "user_123"):
         msg['Subject'] = reply_subject
         if orig_message_id:
             msg['In-Reply-To'] = orig_message_id
-            msg['References'] = orig_message_id
+            msg['References'] = f"{original['references']} {orig_message_id}".strip()
 
         body = MIMEText(payload.reply_text, 'plain')
         msg.attach(body)
@@ -726,35 +1567,71 @@ def send_email_reply(payload: SendRequest, user_id: str = "user_123"):
         raw_bytes = base64.urlsafe_b64encode(msg.as_bytes())
         raw_str = raw_bytes.decode('utf-8')
 
-        send_response = service.users().messages().send(userId='me', body={'raw': raw_str}).execute()
+        send_response = await service.send_message({'raw': raw_str, 'threadId': thread['id']})
+        thread_cache.invalidate(user_id, [thread['id']])
         
-        add_to_conversation(user_id, "assistant", f"Email sent successfully to {from_email}.", "send_email")
+        await add_to_conversation(user_id, "assistant", f"Email sent successfully to {from_email}.", "send_email")
 
         return {"status": "sent", "gmail_message_id": send_response.get('id')}
 
-    except HttpError as error:
-        raise HTTPException(status_code=500, detail=f"Failed to send reply: {error}")
+    except GmailApiError as error:
+        raise gmail_http_exception(error, "Failed to send reply")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- CONVERSATION HISTORY ENDPOINT ---
 @app.get("/chatbot/history")
-def get_conversation_history(user_id: str = "user_123"):
+async def get_conversation_history(user_id: str = Depends(current_user)):
     """Get the conversation history for a user."""
-    if user_id not in conversation_memory:
-        return {"history": []}
-    return {"history": conversation_memory[user_id]}
+    return {"history": await run_state(conversations.history, user_id)}
 
 # --- CLEAR CONVERSATION ---
 @app.post("/chatbot/clear")
-def clear_conversation(user_id: str = "user_123"):
+async def clear_conversation(user_id: str = Depends(current_user)):
     """Clear conversation history for a user."""
-    if user_id in conversation_memory:
-        conversation_memory[user_id] = []
-    if user_id in email_cache:
-        email_cache[user_id] = {"emails": [], "timestamp": ""}
+    await run_state(conversations.clear, user_id)
+    await run_messages(message_store.clear_context, user_id)
     return {"status": "cleared"}
 
+# --- METRICS AND TRACING ---
+def collect_cache_metrics():
+    """Cache hit ratios and governed memory, read from each component's own stats at scrape time."""
+    yield from cache_families({
+        "reply": (reply_cache.stats["hits"], reply_cache.stats["misses"]),
+        "prompt": (prompt_builder.stats["cache_hits"], prompt_builder.stats["cache_misses"]),
+        "thread": (thread_cache.stats["hits"], thread_cache.stats["misses"]),
+        "gmail_service": (gmail_service_stats["hits"], gmail_service_stats["misses"]),
+    })
+    memory = memory_governor.snapshot()
+    yield ("memory_governed_bytes", "gauge", "Approximate bytes held by each governed cache.",
+           [({"cache": name}, stats["bytes"]) for name, stats in memory["caches"].items()])
+    yield ("memory_evictions_total", "counter", "Entries evicted to stay within the memory budget.",
+           [({"cache": name}, stats["evictions"]) for name, stats in memory["caches"].items()])
+
+def collect_gmail_quota_metrics():
+    """Gmail quota units and throttling summed over users (per-user numbers stay on /debug/gmail-quota)."""
+    totals = gmail_quota.totals()
+    yield ("gmail_quota_units_total", "counter", "Gmail quota units spent, by API method.",
+           [({"method": method}, value) for method, value in sorted(totals["by_method"].items())])
+    yield ("gmail_quota_wait_seconds_total", "counter", "Time calls waited for quota before being sent.",
+           [({}, totals["wait_seconds"])])
+    yield ("gmail_rate_limited_total", "counter", "Gmail responses that were rate limits.", [({}, totals["rate_limited"])])
+
+metrics.add_collector(collect_cache_metrics)
+metrics.add_collector(collect_gmail_quota_metrics)
+
+@app.get("/debug/traces")
+async def debug_traces(limit: int = 20, slowest: bool = False, user_id: str = Depends(current_user)):
+    """Recent traces as span trees (slowest first with slowest=true); exported to TRACE_EXPORT_PATH when set."""
+    return tracer.snapshot(limit, slowest, viewer=user_id)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: request, Gmail, Mistral and intent latencies, cache hit ratios."""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
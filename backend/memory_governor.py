@@ -0,0 +1,181 @@
+"""
+Global memory budget for the per-user caches kept in process.
+
+Each cache registers a name and an `evict(key)` callback, then reports an
+entry's approximate size whenever the entry changes (`charge`) and each time
+it is read (`touch`). The governor keeps the entries of every cache in one
+LRU:
+
+- when the total goes over MEMORY_BUDGET_MB, the least recently used entries
+  are evicted, whichever cache and user they belong to;
+- entries idle for longer than MEMORY_IDLE_TTL are evicted by a periodic
+  sweep, which also runs the registered sweepers (e.g. purging expired
+  sessions).
+
+Sizes come from `estimate_size`, which follows containers and __slots__
+records but not arbitrary objects, so a cached client counts as itself and
+not as the connection pool it points to.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from structured_log import get_logger
+
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "256"))
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", str(6 * 3600)))
+MEMORY_SWEEP_INTERVAL = float(os.getenv("MEMORY_SWEEP_INTERVAL", "60"))
+
+log = get_logger("memory")
+
+
+# Leaf values, measured without recursion or cycle tracking
+ATOMIC_TYPES = frozenset((str, bytes, int, float, bool, type(None)))
+
+
+def estimate_size(obj: Any, seen: Optional[set] = None) -> int:
+    """Approximate bytes held by `obj` and the containers and slotted records it references."""
+    if type(obj) in ATOMIC_TYPES:
+        return sys.getsizeof(obj)
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        items = [item for pair in obj.items() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        items = obj
+    elif hasattr(type(obj), "__slots__"):
+        items = [getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name)]
+    else:
+        return size
+    for item in items:
+        size += sys.getsizeof(item) if type(item) in ATOMIC_TYPES else estimate_size(item, seen)
+    return size
+
+
+class MemoryGovernor:
+    """One LRU over the entries of every registered cache, bounded in bytes and idle time."""
+
+    def __init__(self, budget_bytes: float = MEMORY_BUDGET_MB * 1024 * 1024, idle_ttl: float = MEMORY_IDLE_TTL,
+                 sweep_interval: float = MEMORY_SWEEP_INTERVAL):
+        self.budget_bytes = budget_bytes
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.total_bytes = 0
+        # (cache name, key) -> [size, last used]
+        self._entries: "OrderedDict[tuple, list]" = OrderedDict()
+        self._evictors: Dict[str, Callable[[Hashable], None]] = {}
+        self._sweepers: List[Callable[[], Any]] = []
+        self.caches: Dict[str, Dict] = {}
+        self.sweeps = 0
+        self._lock = threading.RLock()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, evict: Callable[[Hashable], None]):
+        """Adds a cache; `evict(key)` must drop the entry without calling back into the governor."""
+        self._evictors[name] = evict
+        self.caches[name] = {"entries": 0, "bytes": 0, "evictions": 0, "expirations": 0}
+
+    def add_sweeper(self, sweep: Callable[[], Any]):
+        """Runs `sweep()` on every periodic sweep."""
+        self._sweepers.append(sweep)
+
+    def charge(self, name: str, key: Hashable, size: int):
+        """Records an entry's current size and marks it most recently used."""
+        with self._lock:
+            entry = self._entries.get((name, key))
+            stats = self.caches[name]
+            if entry is None:
+                self._entries[(name, key)] = [size, time.monotonic()]
+                stats["entries"] += 1
+                delta = size
+            else:
+                delta = size - entry[0]
+                entry[0], entry[1] = size, time.monotonic()
+                self._entries.move_to_end((name, key))
+            stats["bytes"] += delta
+            self.total_bytes += delta
+            while self.total_bytes > self.budget_bytes and self._entries:
+                self._evict(next(iter(self._entries)), "evictions")
+
+    def touch(self, name: str, key: Hashable):
+        with self._lock:
+            entry = self._entries.get((name, key))
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._entries.move_to_end((name, key))
+
+    def release(self, name: str, key: Hashable):
+        """Forgets an entry its cache removed itself."""
+        with self._lock:
+            entry = self._entries.pop((name, key), None)
+            if entry is not None:
+                self._account_removal(name, entry[0])
+
+    def _account_removal(self, name: str, size: int):
+        self.caches[name]["entries"] -= 1
+        self.caches[name]["bytes"] -= size
+        self.total_bytes -= size
+
+    def _evict(self, entry_key: tuple, reason: str):
+        size, _ = self._entries.pop(entry_key)
+        name, key = entry_key
+        self._account_removal(name, size)
+        self.caches[name][reason] += 1
+        self._evictors[name](key)
+
+    def sweep(self) -> int:
+        """Evicts idle entries and runs the sweepers; returns how many entries expired."""
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = 0
+        with self._lock:
+            # The LRU order is also last-used order, so idle entries are at the front
+            while self._entries:
+                entry_key = next(iter(self._entries))
+                if self._entries[entry_key][1] > cutoff:
+                    break
+                self._evict(entry_key, "expirations")
+                expired += 1
+        for sweep in self._sweepers:
+            try:
+                sweep()
+            except Exception as e:
+                log.warning("memory_sweep_failed", error=str(e))
+        self.sweeps += 1
+        return expired
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "budget_bytes": int(self.budget_bytes),
+                "total_bytes": self.total_bytes,
+                "utilization": self.total_bytes / self.budget_bytes if self.budget_bytes else None,
+                "entries": len(self._entries),
+                "idle_ttl": self.idle_ttl,
+                "sweeps": self.sweeps,
+                "caches": {name: dict(stats) for name, stats in self.caches.items()},
+            }
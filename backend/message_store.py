@@ -0,0 +1,498 @@
+"""
+Local store of message summaries, kept in step with Gmail by `mailbox_sync`.
+
+Records are the summary dicts produced by `summarize_message` in main_new.py:
+id, thread_id, sender, subject, snippet, date, internal_date and label_ids.
+The store also keeps each user's "context list", the last list of emails
+shown to them, which chatbot references such as "the second one" resolve
+against, and a full-text index over sender, subject, snippet and any body
+text fetched so far.
+
+`SQLiteMessageStore` is the default. It persists across restarts and can be
+shared by several uvicorn workers; `InMemoryMessageStore` is kept for tests
+and single-process setups (MESSAGE_STORE=memory). The in-memory store
+charges each user's messages and context list to the memory governor; when a
+user's messages are evicted their sync state goes with them, so the next
+request does a full sync.
+
+Async code calls the store through `message_runner`, so SQLite queries run in
+a worker thread instead of blocking the event loop.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from email.utils import parseaddr
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from memory_governor import estimate_size
+from state_store import run_inline
+
+DEFAULT_STORE_PATH = "email_store.sqlite3"
+
+# Words that carry no meaning in "find emails about X"-style queries
+SEARCH_STOPWORDS = {
+    "a", "an", "the", "my", "me", "i", "of", "for", "to", "in", "on", "and", "or",
+    "about", "from", "regarding", "with", "email", "emails", "mail", "message", "messages",
+}
+
+
+def sender_address(sender: Optional[str]) -> str:
+    """Lower-cased email address from a From header, used for indexed sender lookups."""
+    return parseaddr(sender or "")[1].lower()
+
+
+def search_terms(text: Optional[str]) -> List[str]:
+    """Splits free text into lower-cased search terms, dropping stopwords."""
+    return [t for t in re.findall(r"\w+", (text or "").lower()) if t not in SEARCH_STOPWORDS]
+
+
+class InMemoryMessageStore:
+    """Per-user message summaries plus the Gmail history ID they were synced at."""
+
+    def __init__(self, governor=None):
+        self._messages: Dict[str, Dict[str, Dict]] = {}
+        self._state: Dict[str, Dict] = {}
+        self._context: Dict[str, Dict] = {}
+        # Per-record sizes, so a change re-measures one record rather than the mailbox
+        self._sizes: Dict[str, Dict[str, int]] = {}
+        self.governor = governor
+        if governor is not None:
+            governor.register("messages", self._evict_messages)
+            governor.register("email_context", lambda user_id: self._context.pop(user_id, None))
+
+    # --- MEMORY ACCOUNTING ---
+    def _evict_messages(self, user_id: str):
+        self._messages.pop(user_id, None)
+        self._state.pop(user_id, None)
+        self._sizes.pop(user_id, None)
+
+    def _measure(self, user_id: str, records: Iterable[Dict]):
+        if self.governor is None:
+            return
+        sizes = self._sizes.setdefault(user_id, {})
+        for record in records:
+            sizes[record["id"]] = estimate_size(record)
+        self.governor.charge("messages", user_id, sum(sizes.values()))
+
+    def _forget(self, user_id: str, message_ids: Iterable[str]):
+        if self.governor is None:
+            return
+        sizes = self._sizes.get(user_id, {})
+        for message_id in message_ids:
+            sizes.pop(message_id, None)
+        self.governor.charge("messages", user_id, sum(sizes.values()))
+
+    def _touch(self, user_id: str):
+        if self.governor is not None and user_id in self._messages:
+            self.governor.touch("messages", user_id)
+
+    # --- SYNC STATE ---
+    def get_state(self, user_id: str) -> Optional[Dict]:
+        """Returns {"history_id", "complete", "window"} for a user, or None if never synced."""
+        self._touch(user_id)
+        return self._state.get(user_id)
+
+    def set_state(self, user_id: str, history_id: str, complete: bool, window: int = 0):
+        """`window` is how many inbox messages the last full sync asked for."""
+        self._state[user_id] = {"history_id": history_id, "complete": complete, "window": window}
+
+    # --- MESSAGES ---
+    def upsert(self, user_id: str, records: Iterable[Dict]):
+        messages = self._messages.setdefault(user_id, {})
+        stored = []
+        for record in records:
+            existing = messages.get(record["id"])
+            stored_record = messages[record["id"]] = dict(record)
+            if existing is not None and "body" in existing:
+                # A fetched body outlives summary refreshes, as the SQLite store's body column does
+                stored_record.setdefault("body", existing["body"])
+            stored.append(stored_record)
+        self._measure(user_id, stored)
+
+    def delete(self, user_id: str, message_ids: Iterable[str]):
+        messages = self._messages.get(user_id, {})
+        message_ids = list(message_ids)
+        for message_id in message_ids:
+            messages.pop(message_id, None)
+        self._forget(user_id, message_ids)
+
+    def prune(self, user_id: str, label: str, keep_ids: Iterable[str], since: Optional[int] = None) -> int:
+        """
+        Deletes messages carrying `label` that aren't in `keep_ids`, only those
+        at or after `since` (internal date) if given; returns how many.
+        """
+        keep = set(keep_ids)
+        stale = [m["id"] for m in self._messages.get(user_id, {}).values()
+                 if label in m.get("label_ids", []) and m["id"] not in keep
+                 and (since is None or int(m.get("internal_date") or 0) >= since)]
+        self.delete(user_id, stale)
+        return len(stale)
+
+    def get(self, user_id: str, message_id: str) -> Optional[Dict]:
+        record = self._messages.get(user_id, {}).get(message_id)
+        return dict(record) if record else None
+
+    def update_labels(self, user_id: str, message_id: str, added: Iterable[str] = (), removed: Iterable[str] = ()) -> bool:
+        """Applies a label delta; returns False if the message is not stored."""
+        record = self._messages.get(user_id, {}).get(message_id)
+        if record is None:
+            return False
+        labels = [label for label in record.get("label_ids", []) if label not in set(removed)]
+        labels.extend(label for label in added if label not in labels)
+        record["label_ids"] = labels
+        self._measure(user_id, [record])
+        return True
+
+    def list_by_label(self, user_id: str, label: str = "INBOX", limit: Optional[int] = None) -> List[Dict]:
+        """Returns messages carrying `label`, newest first."""
+        self._touch(user_id)
+        matching = [m for m in self._messages.get(user_id, {}).values() if label in m.get("label_ids", [])]
+        matching.sort(key=lambda m: int(m.get("internal_date") or 0), reverse=True)
+        return [dict(m) for m in matching[:limit]]
+
+    def count_by_label(self, user_id: str, label: str = "INBOX") -> int:
+        return sum(1 for m in self._messages.get(user_id, {}).values() if label in m.get("label_ids", []))
+
+    def find_message(self, user_id: str, reference: str) -> Optional[Dict]:
+        """Newest stored message whose sender address equals, or sender/subject contains, `reference`."""
+        reference = reference.lower()
+        messages = sorted(self._messages.get(user_id, {}).values(),
+                          key=lambda m: int(m.get("internal_date") or 0), reverse=True)
+        for m in messages:
+            if sender_address(m.get("sender")) == reference:
+                return dict(m)
+        for m in messages:
+            if reference in (m.get("sender") or "").lower() or reference in (m.get("subject") or "").lower():
+                return dict(m)
+        return None
+
+    def set_body(self, user_id: str, message_id: str, body: str):
+        """Attaches fetched body text to a stored message so it becomes searchable."""
+        record = self._messages.get(user_id, {}).get(message_id)
+        if record is not None:
+            record["body"] = body
+            self._measure(user_id, [record])
+
+    def search(self, user_id: str, text: str = "", sender: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """Messages containing every term, ranked by how often the terms occur, then by recency."""
+        # Crude plural folding stands in for the porter stemmer the SQLite index uses
+        terms = [t[:-1] if len(t) > 3 and t.endswith("s") else t for t in search_terms(text)]
+        sender_terms = search_terms(sender)
+        if not terms and not sender_terms:
+            return []
+        scored = []
+        for m in self._messages.get(user_id, {}).values():
+            sender_text = (m.get("sender") or "").lower()
+            haystack = " ".join((m.get(f) or "") for f in ("sender", "subject", "snippet", "body")).lower()
+            if all(t in sender_text for t in sender_terms) and all(t in haystack for t in terms):
+                score = sum(haystack.count(t) for t in terms)
+                scored.append((score, int(m.get("internal_date") or 0), m))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [{k: v for k, v in m.items() if k != "body"} for _, _, m in scored[:limit]]
+
+    def clear(self, user_id: str):
+        """Forgets a user's synced messages and sync state (not their context list)."""
+        self._evict_messages(user_id)
+        if self.governor is not None:
+            self.governor.release("messages", user_id)
+
+    # --- CONTEXT LIST ---
+    def set_context(self, user_id: str, emails: List[Dict]):
+        self._context[user_id] = {"emails": list(emails), "timestamp": datetime.now().isoformat()}
+        if self.governor is not None:
+            self.governor.charge("email_context", user_id, estimate_size(self._context[user_id]))
+
+    def get_context(self, user_id: str) -> List[Dict]:
+        if self.governor is not None and user_id in self._context:
+            self.governor.touch("email_context", user_id)
+        return list(self._context.get(user_id, {}).get("emails", []))
+
+    def clear_context(self, user_id: str):
+        self._context.pop(user_id, None)
+        if self.governor is not None:
+            self.governor.release("email_context", user_id)
+
+
+class SQLiteMessageStore:
+    """SQLite-backed message store in WAL mode, safe to share between worker processes."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            user_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            thread_id TEXT,
+            internal_date INTEGER,
+            sender TEXT,
+            sender_email TEXT,
+            subject TEXT,
+            snippet TEXT,
+            date TEXT,
+            label_ids TEXT NOT NULL DEFAULT '[]',
+            body TEXT,
+            PRIMARY KEY (user_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_user_date ON messages (user_id, internal_date DESC);
+        CREATE INDEX IF NOT EXISTS idx_messages_user_sender ON messages (user_id, sender_email);
+        CREATE INDEX IF NOT EXISTS idx_messages_user_thread ON messages (user_id, thread_id);
+
+        CREATE TABLE IF NOT EXISTS sync_state (
+            user_id TEXT PRIMARY KEY,
+            history_id TEXT NOT NULL,
+            complete INTEGER NOT NULL,
+            synced_window INTEGER NOT NULL DEFAULT 0,
+            synced_at TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS email_context (
+            user_id TEXT PRIMARY KEY,
+            emails TEXT NOT NULL,
+            cached_at TEXT NOT NULL
+        );
+    """
+
+    # External-content FTS5 index over `messages`, kept current by triggers.
+    # Label-only updates don't touch indexed columns and so skip reindexing.
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            sender, subject, snippet, body,
+            content='messages', content_rowid='rowid', tokenize='porter unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, sender, subject, snippet, body)
+            VALUES (new.rowid, new.sender, new.subject, new.snippet, new.body);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, sender, subject, snippet, body)
+            VALUES ('delete', old.rowid, old.sender, old.subject, old.snippet, old.body);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF sender, subject, snippet, body ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, sender, subject, snippet, body)
+            VALUES ('delete', old.rowid, old.sender, old.subject, old.snippet, old.body);
+            INSERT INTO messages_fts (rowid, sender, subject, snippet, body)
+            VALUES (new.rowid, new.sender, new.subject, new.snippet, new.body);
+        END;
+    """
+
+    # bm25() column weights: sender, subject, snippet, body
+    BM25_WEIGHTS = (4.0, 8.0, 2.0, 1.0)
+
+    COLUMNS = ("id", "sender", "subject", "snippet", "date", "thread_id", "internal_date", "label_ids")
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+        self._conn.executescript(self.FTS_SCHEMA)
+
+    def _migrate(self):
+        """Brings databases created before the full-text index or sync windows up to date."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "body" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN body TEXT")
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(sync_state)")}
+        if "synced_window" not in columns:
+            # 0 means unknown: the next sync that wants more than the stored inbox does a full sync
+            self._conn.execute("ALTER TABLE sync_state ADD COLUMN synced_window INTEGER NOT NULL DEFAULT 0")
+        has_fts = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        if not has_fts:
+            self._conn.executescript(self.FTS_SCHEMA)
+            self._conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    def _execute(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def _executemany(self, sql: str, rows: List[tuple]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _to_record(row: sqlite3.Row) -> Dict:
+        record = {key: row[key] for key in SQLiteMessageStore.COLUMNS}
+        record["label_ids"] = json.loads(record["label_ids"])
+        record["internal_date"] = str(record["internal_date"]) if record["internal_date"] is not None else None
+        return record
+
+    # --- SYNC STATE ---
+    def get_state(self, user_id: str) -> Optional[Dict]:
+        rows = self._execute("SELECT history_id, complete, synced_window FROM sync_state WHERE user_id = ?", (user_id,))
+        if not rows:
+            return None
+        return {"history_id": rows[0]["history_id"], "complete": bool(rows[0]["complete"]),
+                "window": rows[0]["synced_window"]}
+
+    def set_state(self, user_id: str, history_id: str, complete: bool, window: int = 0):
+        """`window` is how many inbox messages the last full sync asked for."""
+        self._execute(
+            "INSERT OR REPLACE INTO sync_state (user_id, history_id, complete, synced_window, synced_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (user_id, str(history_id), int(complete), window, datetime.now().isoformat()),
+        )
+
+    # --- MESSAGES ---
+    def upsert(self, user_id: str, records: Iterable[Dict]):
+        rows = [(
+            user_id, r["id"], r.get("thread_id"),
+            int(r["internal_date"]) if r.get("internal_date") else None,
+            r.get("sender"), sender_address(r.get("sender")), r.get("subject"), r.get("snippet"),
+            r.get("date"), json.dumps(r.get("label_ids") or []),
+        ) for r in records]
+        if rows:
+            # ON CONFLICT keeps the row (and any fetched body) in place so the FTS triggers see an update.
+            self._executemany(
+                "INSERT INTO messages (user_id, id, thread_id, internal_date, sender, sender_email, "
+                "subject, snippet, date, label_ids) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, id) DO UPDATE SET thread_id = excluded.thread_id, "
+                "internal_date = excluded.internal_date, sender = excluded.sender, "
+                "sender_email = excluded.sender_email, subject = excluded.subject, snippet = excluded.snippet, "
+                "date = excluded.date, label_ids = excluded.label_ids",
+                rows,
+            )
+
+    def delete(self, user_id: str, message_ids: Iterable[str]):
+        rows = [(user_id, message_id) for message_id in message_ids]
+        if rows:
+            self._executemany("DELETE FROM messages WHERE user_id = ? AND id = ?", rows)
+
+    def prune(self, user_id: str, label: str, keep_ids: Iterable[str], since: Optional[int] = None) -> int:
+        """
+        Deletes messages carrying `label` that aren't in `keep_ids`, only those
+        at or after `since` (internal date) if given; returns how many.
+        """
+        keep = set(keep_ids)
+        rows = self._execute(
+            "SELECT id FROM messages WHERE user_id = ? AND internal_date >= ? "
+            "AND EXISTS (SELECT 1 FROM json_each(messages.label_ids) WHERE value = ?)",
+            (user_id, since if since is not None else -1, label),
+        )
+        stale = [row["id"] for row in rows if row["id"] not in keep]
+        self.delete(user_id, stale)
+        return len(stale)
+
+    def get(self, user_id: str, message_id: str) -> Optional[Dict]:
+        rows = self._execute("SELECT * FROM messages WHERE user_id = ? AND id = ?", (user_id, message_id))
+        return self._to_record(rows[0]) if rows else None
+
+    def update_labels(self, user_id: str, message_id: str, added: Iterable[str] = (), removed: Iterable[str] = ()) -> bool:
+        """Applies a label delta; returns False if the message is not stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT label_ids FROM messages WHERE user_id = ? AND id = ?", (user_id, message_id)
+            ).fetchone()
+            if row is None:
+                return False
+            labels = [label for label in json.loads(row["label_ids"]) if label not in set(removed)]
+            labels.extend(label for label in added if label not in labels)
+            self._conn.execute(
+                "UPDATE messages SET label_ids = ? WHERE user_id = ? AND id = ?",
+                (json.dumps(labels), user_id, message_id),
+            )
+            return True
+
+    def list_by_label(self, user_id: str, label: str = "INBOX", limit: Optional[int] = None) -> List[Dict]:
+        """Returns messages carrying `label`, newest first."""
+        rows = self._execute(
+            "SELECT * FROM messages WHERE user_id = ? "
+            "AND EXISTS (SELECT 1 FROM json_each(messages.label_ids) WHERE value = ?) "
+            "ORDER BY internal_date DESC LIMIT ?",
+            (user_id, label, -1 if limit is None else limit),
+        )
+        return [self._to_record(row) for row in rows]
+
+    def count_by_label(self, user_id: str, label: str = "INBOX") -> int:
+        rows = self._execute(
+            "SELECT COUNT(*) AS n FROM messages WHERE user_id = ? "
+            "AND EXISTS (SELECT 1 FROM json_each(messages.label_ids) WHERE value = ?)",
+            (user_id, label),
+        )
+        return rows[0]["n"]
+
+    def find_message(self, user_id: str, reference: str) -> Optional[Dict]:
+        """Newest stored message whose sender address equals, or sender/subject contains, `reference`."""
+        reference = reference.lower()
+        rows = self._execute(
+            "SELECT * FROM messages WHERE user_id = ? AND sender_email = ? ORDER BY internal_date DESC LIMIT 1",
+            (user_id, reference),
+        )
+        if not rows:
+            pattern = "%" + reference.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = self._execute(
+                "SELECT * FROM messages WHERE user_id = ? "
+                "AND (lower(sender) LIKE ? ESCAPE '\\' OR lower(subject) LIKE ? ESCAPE '\\') "
+                "ORDER BY internal_date DESC LIMIT 1",
+                (user_id, pattern, pattern),
+            )
+        return self._to_record(rows[0]) if rows else None
+
+    def set_body(self, user_id: str, message_id: str, body: str):
+        """Attaches fetched body text to a stored message so it becomes searchable."""
+        self._execute("UPDATE messages SET body = ? WHERE user_id = ? AND id = ?", (body, user_id, message_id))
+
+    def search(self, user_id: str, text: str = "", sender: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """Full-text search over the user's messages, best BM25 match first."""
+        terms, sender_terms = search_terms(text), search_terms(sender)
+        clauses = []
+        if sender_terms:
+            clauses.append("sender : (" + " AND ".join(f'"{t}"*' for t in sender_terms) + ")")
+        clauses.extend(f'"{t}"*' for t in terms)
+        if not clauses:
+            return []
+        rows = self._execute(
+            "SELECT m.* FROM messages_fts JOIN messages AS m ON m.rowid = messages_fts.rowid "
+            "WHERE messages_fts MATCH ? AND m.user_id = ? "
+            "ORDER BY bm25(messages_fts, ?, ?, ?, ?), m.internal_date DESC LIMIT ?",
+            (" AND ".join(clauses), user_id, *self.BM25_WEIGHTS, limit),
+        )
+        return [self._to_record(row) for row in rows]
+
+    def clear(self, user_id: str):
+        """Forgets a user's synced messages and sync state (not their context list)."""
+        self._execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+        self._execute("DELETE FROM sync_state WHERE user_id = ?", (user_id,))
+
+    # --- CONTEXT LIST ---
+    def set_context(self, user_id: str, emails: List[Dict]):
+        self._execute(
+            "INSERT OR REPLACE INTO email_context (user_id, emails, cached_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(emails), datetime.now().isoformat()),
+        )
+
+    def get_context(self, user_id: str) -> List[Dict]:
+        rows = self._execute("SELECT emails FROM email_context WHERE user_id = ?", (user_id,))
+        return json.loads(rows[0]["emails"]) if rows else []
+
+    def clear_context(self, user_id: str):
+        self._execute("DELETE FROM email_context WHERE user_id = ?", (user_id,))
+
+
+def create_message_store(governor=None):
+    """Builds the store selected by MESSAGE_STORE (`sqlite` or `memory`); only the memory store is governed."""
+    if os.getenv("MESSAGE_STORE", "sqlite") == "memory":
+        return InMemoryMessageStore(governor)
+    return SQLiteMessageStore(os.getenv("MESSAGE_STORE_PATH", DEFAULT_STORE_PATH))
+
+
+def message_runner(store) -> Callable[..., Awaitable]:
+    """
+    Returns `run(fn, *args)` for calling into `store` from async code: SQLite
+    queries run in a worker thread, the in-memory store (which charges the
+    memory governor and so must stay on the loop) is called inline.
+    """
+    return run_inline if isinstance(store, InMemoryMessageStore) else asyncio.to_thread
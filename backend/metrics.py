@@ -0,0 +1,143 @@
+"""
+Prometheus metrics, rendered in the text exposition format on /metrics.
+
+There is no client library to install: `registry` holds histograms keyed by
+label values, plus collectors that turn existing stats (cache hit/miss
+counters, quota usage) into samples at scrape time, so those hot paths need
+no extra bookkeeping.
+
+Recording a sample is a dict lookup and a bisect. METRICS_ENABLED=false turns
+recording into a no-op; /metrics then reports only the collectors.
+
+`MetricsMiddleware` times every HTTP request by route template (e.g.
+`/emails/{message_id}/body`), so path parameters don't multiply series.
+"""
+import math
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+# Seconds; spans a cached lookup (ms) to a slow LLM call (tens of seconds)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help, [(labels, value)]) as produced by collectors
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram; buckets are stored per bucket and summed at render."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        if not METRICS_ENABLED:
+            return
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels({**base, 'le': format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(base)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(base)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Histogram] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collect: Callable[[], Iterable[Family]]):
+        """Registers `collect()`, called on every scrape, returning (name, type, help, samples) families."""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def cache_families(caches: Dict[str, Tuple[float, float]]) -> List[Family]:
+    """Hit, miss and hit-ratio families for {cache name: (hits, misses)}."""
+    return [
+        ("cache_hits_total", "counter", "Cache lookups served from the cache.",
+         [({"cache": name}, hits) for name, (hits, _) in caches.items()]),
+        ("cache_misses_total", "counter", "Cache lookups that missed.",
+         [({"cache": name}, misses) for name, (_, misses) in caches.items()]),
+        ("cache_hit_ratio", "gauge", "Hits over lookups since start.",
+         [({"cache": name}, hits / (hits + misses)) for name, (hits, misses) in caches.items() if hits + misses]),
+    ]
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing each HTTP request's duration by method, route template and status."""
+
+    def __init__(self, app, histogram: Optional[Histogram] = None):
+        self.app = app
+        self.histogram = histogram or registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency, until the response body is sent.",
+            ("method", "route", "status"),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the scope; unmatched paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.histogram.observe(time.perf_counter() - start, scope["method"], route, str(status[0]))
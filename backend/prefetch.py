@@ -0,0 +1,197 @@
+"""
+Background prefetch of mailbox summaries.
+
+After a user authenticates, `PrefetchWorker.schedule` queues a sync so the
+message store is already warm when the dashboard first calls
+`/emails/recent`. A ticker re-queues every registered user each
+`PREFETCH_REFRESH_INTERVAL` seconds; those refreshes are history-based
+deltas (see `mailbox_sync`), so they cost one `history.list` call when
+nothing changed. Users who make no request for `PREFETCH_IDLE_TTL` seconds
+are dropped from that set (their next request adds them back), so signed-out
+users stop spending Gmail quota and their cached entries can go idle. With a
+memory governor, each registered user is also charged to it, and an eviction
+unregisters them the same way.
+
+A fixed pool of worker tasks caps how many syncs run at once across all
+users, and each user is synced at most once per `PREFETCH_MIN_INTERVAL`.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from memory_governor import estimate_size
+from structured_log import get_logger
+from tracing import tracer
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+PREFETCH_MIN_INTERVAL = float(os.getenv("PREFETCH_MIN_INTERVAL", "30"))
+PREFETCH_REFRESH_INTERVAL = float(os.getenv("PREFETCH_REFRESH_INTERVAL", "60"))
+PREFETCH_IDLE_TTL = float(os.getenv("PREFETCH_IDLE_TTL", str(3600)))
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") != "0"
+
+SyncUser = Callable[[str], Awaitable[Dict]]
+
+log = get_logger("prefetch")
+
+
+class PrefetchWorker:
+    """Queue plus a fixed pool of asyncio tasks that run `sync_user(user_id)` in the background."""
+
+    def __init__(self, sync_user: SyncUser, workers: int = PREFETCH_WORKERS,
+                 min_interval: float = PREFETCH_MIN_INTERVAL, refresh_interval: float = PREFETCH_REFRESH_INTERVAL,
+                 idle_ttl: float = PREFETCH_IDLE_TTL, governor=None):
+        self.sync_user = sync_user
+        self.workers = max(1, workers)
+        self.min_interval = min_interval
+        self.refresh_interval = refresh_interval
+        self.idle_ttl = idle_ttl
+        self.users: Set[str] = set()
+        self.last_run: Dict[str, float] = {}
+        # user_id -> monotonic time of the user's last request
+        self.last_seen: Dict[str, float] = {}
+        self.stats = {"scheduled": 0, "runs": 0, "rate_limited": 0, "errors": 0, "idle_unregistered": 0,
+                      "run_seconds": 0.0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._tasks = []
+        self.governor = governor
+        if governor is not None:
+            governor.register("prefetch", self._forget)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Starts the worker pool and the refresh ticker on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        for user_id in self.users:
+            self._enqueue(user_id)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if self.refresh_interval > 0:
+            self._tasks.append(asyncio.create_task(self._tick()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queued.clear()
+
+    def register(self, user_id: str):
+        """Adds a user to the periodic refresh set and queues an immediate warm-up."""
+        self.touch(user_id)
+        self.schedule(user_id)
+
+    def touch(self, user_id: str):
+        """Marks a user active, adding them back to the refresh set if they had gone idle.
+
+        Call it on the event loop: charging the governor can run the eviction
+        callbacks of other caches, which are not thread-safe.
+        """
+        new = user_id not in self.users
+        self.last_seen[user_id] = time.monotonic()
+        self.users.add(user_id)
+        if self.governor is None:
+            return
+        if new:
+            self.governor.charge("prefetch", user_id, estimate_size(user_id) + 2 * estimate_size(0.0))
+        else:
+            self.governor.touch("prefetch", user_id)
+
+    def is_active(self, user_id: str) -> bool:
+        """True if the user made a request within the idle TTL (always, when the TTL is off)."""
+        if self.idle_ttl <= 0:
+            return True
+        last = self.last_seen.get(user_id)
+        return last is not None and time.monotonic() - last < self.idle_ttl
+
+    def unregister(self, user_id: str):
+        self._forget(user_id)
+        if self.governor is not None:
+            self.governor.release("prefetch", user_id)
+
+    def _forget(self, user_id: str):
+        self.users.discard(user_id)
+        self.last_run.pop(user_id, None)
+        self.last_seen.pop(user_id, None)
+
+    def _expire_idle(self):
+        if self.idle_ttl <= 0:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        for user_id in list(self.users):
+            if self.last_seen.get(user_id, 0.0) < cutoff:
+                self.unregister(user_id)
+                self.stats["idle_unregistered"] += 1
+                log.debug("prefetch_idle", user_id=user_id)
+
+    def schedule(self, user_id: str):
+        """Queues a sync for a user unless one is already waiting."""
+        self.stats["scheduled"] += 1
+        if self._queue is not None:
+            self._enqueue(user_id)
+
+    def _enqueue(self, user_id: str):
+        if user_id not in self._queued:
+            self._queued.add(user_id)
+            self._queue.put_nowait(user_id)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            # One bad pass must not end the ticker, or refreshes stop for everyone
+            try:
+                self._expire_idle()
+                for user_id in list(self.users):
+                    self._enqueue(user_id)
+            except Exception as e:
+                log.exception("prefetch_tick_failed", error=str(e))
+
+    async def _work(self):
+        while True:
+            user_id = await self._queue.get()
+            self._queued.discard(user_id)
+            try:
+                await self._run(user_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, user_id: str):
+        last = self.last_run.get(user_id)
+        if last is not None and time.monotonic() - last < self.min_interval:
+            self.stats["rate_limited"] += 1
+            return
+        self.last_run[user_id] = time.monotonic()
+        start = time.perf_counter()
+        try:
+            # Runs outside any request, so each prefetch is the root of its own trace
+            with tracer.span("prefetch", **{"enduser.id": user_id}):
+                result = await self.sync_user(user_id)
+            self.stats["runs"] += 1
+            log.debug("prefetch_done", user_id=user_id, result=result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.warning("prefetch_failed", user_id=user_id, error=str(e))
+        finally:
+            self.stats["run_seconds"] += time.perf_counter() - start
+
+    async def drain(self):
+        """Waits until every queued sync has run (used by benchmarks)."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def snapshot(self) -> Dict:
+        return {
+            **self.stats,
+            "running": self.running,
+            "workers": self.workers,
+            "registered_users": len(self.users),
+            "idle_ttl": self.idle_ttl,
+            "queued": len(self._queued),
+        }
@@ -0,0 +1,143 @@
+"""
+Token-budgeted prompt assembly for reply drafting.
+
+Emails are condensed before they reach the prompt: quoted history ("On ...
+wrote:", "-----Original Message-----", Outlook "From:/Sent:" blocks, lines
+starting with ">") and signatures ("-- ", "Sent from my ...") are stripped,
+and whatever is left is truncated to PROMPT_EMAIL_TOKENS, keeping the start and the end.
+Condensed emails are cached by content hash, so redrafting the same email, or
+drafting it for the thread and the batch endpoint, only condenses it once.
+
+Conversation and thread context then share what is left of
+PROMPT_TOKEN_BUDGET, in priority order.
+
+Token counts are estimates (about four characters per token for English
+text with the Mistral tokenizer), which is close enough for budgeting and
+needs no tokenizer download.
+"""
+import hashlib
+import math
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PROMPT_EMAIL_TOKENS = int(os.getenv("PROMPT_EMAIL_TOKENS", "900"))
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "1024"))
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[...]\n"
+
+# A line that starts quoted history; everything from it on is dropped
+QUOTE_HEADER = re.compile(
+    r"^\s*(On\b.{0,200}\bwrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|_{10,}\s*$)",
+    re.IGNORECASE,
+)
+OUTLOOK_FROM = re.compile(r"^\s*From:\s", re.IGNORECASE)
+OUTLOOK_SENT = re.compile(r"^\s*(Sent|Date):\s", re.IGNORECASE)
+SIGNATURE_DELIMITER = re.compile(r"^--\s*$")
+MOBILE_SIGNATURE = re.compile(r"^\s*(Sent from my\b|Get Outlook for\b|Sent via\b)", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def strip_quoted(text: str) -> str:
+    """Removes quoted replies, forwarded-history headers and signatures."""
+    lines = text.splitlines()
+    kept: List[str] = []
+    for i, line in enumerate(lines):
+        if QUOTE_HEADER.match(line) and kept:
+            break
+        # Outlook quotes start with a From: line followed shortly by Sent:/Date:
+        if OUTLOOK_FROM.match(line) and any(l.strip() for l in kept) and \
+                any(OUTLOOK_SENT.match(l) for l in lines[i + 1:i + 4]):
+            break
+        if SIGNATURE_DELIMITER.match(line) and kept:
+            break
+        if line.lstrip().startswith(">") or MOBILE_SIGNATURE.match(line):
+            continue
+        kept.append(line.rstrip())
+    # Collapse runs of blank lines left behind by the removed blocks
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts `text` to about `max_tokens`, keeping its start and end at word boundaries."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= estimate_tokens(TRUNCATION_MARKER):
+        return ""
+    max_chars = max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER)
+    head_chars = max_chars * 3 // 4
+    head = text[:head_chars].rsplit(None, 1)[0] if " " in text[:head_chars] else text[:head_chars]
+    tail = text[len(text) - (max_chars - len(head)):]
+    tail = tail.split(None, 1)[-1] if " " in tail else tail
+    return f"{head.rstrip()}{TRUNCATION_MARKER}{tail.lstrip()}"
+
+
+class PromptBuilder:
+    """Condenses emails (cached by content) and fits context sections into a token budget."""
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET, email_tokens: int = PROMPT_EMAIL_TOKENS,
+                 cache_size: int = PROMPT_CACHE_SIZE):
+        self.budget = budget
+        self.email_tokens = email_tokens
+        self.cache_size = cache_size
+        self._condensed: "OrderedDict[str, Dict]" = OrderedDict()
+        self.stats = {"prompts": 0, "prompt_tokens": 0, "tokens_saved": 0, "truncated": 0,
+                      "cache_hits": 0, "cache_misses": 0}
+
+    def condense(self, content: str) -> Dict:
+        """Returns {"text", "tokens", "original_tokens", "truncated"} for an email body."""
+        key = hashlib.sha256(f"{self.email_tokens}:{content}".encode("utf-8")).hexdigest()
+        condensed = self._condensed.get(key)
+        if condensed is not None:
+            self._condensed.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            return condensed
+
+        self.stats["cache_misses"] += 1
+        stripped = strip_quoted(content) or content.strip()
+        text = truncate_to_tokens(stripped, self.email_tokens)
+        condensed = {
+            "text": text,
+            "tokens": estimate_tokens(text),
+            "original_tokens": estimate_tokens(content),
+            "truncated": text != stripped,
+        }
+        self._condensed[key] = condensed
+        while len(self._condensed) > self.cache_size:
+            self._condensed.popitem(last=False)
+        return condensed
+
+    def fit(self, sections: List[str], max_tokens: int) -> List[str]:
+        """Truncates sections, highest priority first, so together they stay within `max_tokens`."""
+        fitted = []
+        for section in sections:
+            text = truncate_to_tokens(section, max(0, max_tokens))
+            max_tokens -= estimate_tokens(text)
+            fitted.append(text)
+        return fitted
+
+    def record(self, report: Dict):
+        """Adds one assembled prompt's token report to the running totals."""
+        self.stats["prompts"] += 1
+        self.stats["prompt_tokens"] += report["prompt_tokens"]
+        self.stats["tokens_saved"] += report["tokens_saved"]
+        self.stats["truncated"] += int(report["truncated"])
+
+    def snapshot(self) -> Dict:
+        prompts = self.stats["prompts"]
+        lookups = self.stats["cache_hits"] + self.stats["cache_misses"]
+        return {
+            **self.stats,
+            "budget": self.budget,
+            "email_tokens": self.email_tokens,
+            "cached_emails": len(self._condensed),
+            "avg_prompt_tokens": self.stats["prompt_tokens"] / prompts if prompts else None,
+            "cache_hit_ratio": self.stats["cache_hits"] / lookups if lookups else None,
+        }
@@ -0,0 +1,138 @@
+"""
+Cache for generated email replies.
+
+Entries are keyed by a hash of the full Mistral request payload (model,
+system prompt, recent conversation context and email content, plus sampling
+settings), so regenerating a reply for the same email and context, or
+drafting for a newsletter many users received, skips the LLM call.
+
+The memory tier is an LRU with a TTL. An optional SQLite tier
+(REPLY_CACHE_PATH) keeps replies across restarts and lets several uvicorn
+workers share them; memory misses fall through to it and hits are promoted.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "512"))
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+
+
+def reply_cache_key(payload: Dict) -> str:
+    """Stable hash of a chat-completion payload."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """LRU + TTL reply cache with an optional on-disk tier."""
+
+    def __init__(self, max_entries: int = REPLY_CACHE_SIZE, ttl: float = REPLY_CACHE_TTL, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "stores": 0, "evictions": 0, "expirations": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reply_cache (key TEXT PRIMARY KEY, reply TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created_at, reply = entry
+                if now - created_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return reply
+                del self._entries[key]
+                self.stats["expirations"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT reply, created_at FROM reply_cache WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] < self.ttl:
+                    self._remember(key, row[1], row[0])
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+                if row:
+                    self._conn.execute("DELETE FROM reply_cache WHERE key = ?", (key,))
+                    self.stats["expirations"] += 1
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, reply: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, reply)
+            self.stats["stores"] += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT INTO reply_cache (key, reply, created_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET reply = excluded.reply, created_at = excluded.created_at",
+                    (key, reply, now),
+                )
+
+    def _remember(self, key: str, created_at: float, reply: str):
+        self._entries[key] = (created_at, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def purge_expired(self) -> int:
+        """Drops expired entries from both tiers; returns how many were removed."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            stale = [key for key, (created_at, _) in self._entries.items() if created_at <= cutoff]
+            for key in stale:
+                del self._entries[key]
+            removed = len(stale)
+            if self._conn is not None:
+                removed += self._conn.execute("DELETE FROM reply_cache WHERE created_at <= ?", (cutoff,)).rowcount
+            self.stats["expirations"] += removed
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM reply_cache")
+
+    def snapshot(self) -> Dict:
+        """Counters plus current size, for the debug endpoint."""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            disk_entries = None
+            if self._conn is not None:
+                disk_entries = self._conn.execute("SELECT COUNT(*) FROM reply_cache").fetchone()[0]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else None,
+                "memory_entries": len(self._entries),
+                "disk_entries": disk_entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+            }
+
+
+def create_reply_cache() -> ReplyCache:
+    """Builds the cache from REPLY_CACHE_SIZE / REPLY_CACHE_TTL / REPLY_CACHE_PATH (empty disables the disk tier)."""
+    return ReplyCache(
+        max_entries=int(os.getenv("REPLY_CACHE_SIZE", str(REPLY_CACHE_SIZE))),
+        ttl=float(os.getenv("REPLY_CACHE_TTL", str(REPLY_CACHE_TTL))),
+        path=os.getenv("REPLY_CACHE_PATH") or None,
+    )
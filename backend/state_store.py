@@ -0,0 +1,352 @@
+"""
+Per-user application state shared between uvicorn workers.
+
+Holds the state that used to live in process-global dicts in main_new.py:
+OAuth credentials, browser sessions and chatbot conversation history. Every
+backend stores JSON values under (namespace, key) and bounded lists for
+conversations:
+
+- `InMemoryStateStore`: single process, nothing persisted (STATE_BACKEND=memory)
+- `SQLiteStateStore`: persistent, shared by workers on one host (STATE_BACKEND=sqlite)
+- `RedisStateStore`: shared by workers on any host (STATE_BACKEND=redis,
+  REDIS_URL). It speaks RESP directly over a socket, so there is no client
+  library to install, and it works against Redis, Valkey, KeyDB or the
+  stand-in in bench/fake_redis.py.
+
+The stores are synchronous. Async code calls them through `state_runner`,
+which moves the sqlite and redis backends' blocking disk and socket waits off
+the event loop.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+DEFAULT_STATE_PATH = "app_state.sqlite3"
+
+
+class InMemoryStateStore:
+    """Dict-backed store for single-process setups and tests."""
+
+    def __init__(self):
+        self._values: Dict[tuple, tuple] = {}
+        self._lists: Dict[tuple, List] = {}
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        entry = self._values.get((namespace, key))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[(namespace, key)]
+            return None
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        self._values[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, namespace: str, key: str):
+        self._values.pop((namespace, key), None)
+        self._lists.pop((namespace, key), None)
+
+    def keys(self, namespace: str) -> List[str]:
+        return [key for (ns, key) in list(self._values) if ns == namespace and self.get(ns, key) is not None]
+
+    def append(self, namespace: str, key: str, item: Any, max_items: int):
+        """Appends to a list, keeping only its last `max_items` entries."""
+        items = self._lists.setdefault((namespace, key), [])
+        items.append(item)
+        del items[:-max_items]
+
+    def get_list(self, namespace: str, key: str, last_n: Optional[int] = None) -> List:
+        items = self._lists.get((namespace, key), [])
+        return list(items[-last_n:] if last_n else items)
+
+    def purge_expired(self) -> int:
+        """Drops expired values that were never read again; returns how many."""
+        now = time.time()
+        expired = [k for k, (_, expires_at) in list(self._values.items()) if expires_at is not None and expires_at <= now]
+        for k in expired:
+            self._values.pop(k, None)
+        return len(expired)
+
+
+class SQLiteStateStore:
+    """SQLite-backed store in WAL mode, safe to share between worker processes."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL,
+            PRIMARY KEY (namespace, key)
+        );
+
+        CREATE TABLE IF NOT EXISTS state_lists (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            item TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_state_lists_key ON state_lists (namespace, key, seq);
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        rows = self._execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        self._execute(
+            "INSERT INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (namespace, key, json.dumps(value), time.time() + ttl if ttl else None),
+        )
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+            self._conn.execute("DELETE FROM state_lists WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def keys(self, namespace: str) -> List[str]:
+        rows = self._execute(
+            "SELECT key FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time()),
+        )
+        return [row[0] for row in rows]
+
+    def append(self, namespace: str, key: str, item: Any, max_items: int):
+        """Appends to a list, keeping only its last `max_items` entries."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO state_lists (namespace, key, item) VALUES (?, ?, ?)",
+                    (namespace, key, json.dumps(item)),
+                )
+                self._conn.execute(
+                    "DELETE FROM state_lists WHERE namespace = ? AND key = ? AND seq NOT IN ("
+                    "SELECT seq FROM state_lists WHERE namespace = ? AND key = ? ORDER BY seq DESC LIMIT ?)",
+                    (namespace, key, namespace, key, max_items),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_list(self, namespace: str, key: str, last_n: Optional[int] = None) -> List:
+        rows = self._execute(
+            "SELECT item FROM (SELECT seq, item FROM state_lists WHERE namespace = ? AND key = ? "
+            "ORDER BY seq DESC LIMIT ?) ORDER BY seq",
+            (namespace, key, last_n or -1),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+
+class RedisError(Exception):
+    """Raised for an error reply from the Redis server."""
+
+
+class RedisConnection:
+    """Minimal blocking RESP2 client: one socket, reconnected on failure."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._round_trip(setup)
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = None
+
+    def execute(self, *args):
+        return self.pipeline(args)[0]
+
+    def pipeline(self, *commands):
+        """Sends several commands in one round trip; returns their replies in order."""
+        with self._lock:
+            fresh = self._sock is None
+            if fresh:
+                self._connect()
+            try:
+                return self._round_trip(commands)
+            except OSError:
+                if fresh:
+                    raise
+                # Stale pooled socket (server restart, idle timeout): retry once on a new one
+                self.close()
+                self._connect()
+                return self._round_trip(commands)
+
+    def _round_trip(self, commands) -> List:
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies, error = [], None
+        # Read every reply even after an error so the connection stays in sync
+        for _ in commands:
+            try:
+                replies.append(self._read())
+            except RedisError as e:
+                error = error or e
+                replies.append(None)
+        if error is not None:
+            raise error
+        return replies
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(rest)
+            return None if count == -1 else [self._read() for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+
+class RedisStateStore:
+    """
+    Values live at `<prefix><namespace>:<key>` as JSON strings; each
+    namespace's keys are also tracked in a set so `keys()` never scans the
+    keyspace. Lists are Redis lists trimmed on append.
+    """
+
+    def __init__(self, url: str, prefix: str = "emailtest:"):
+        self.redis = RedisConnection(url)
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def _list_key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}:list"
+
+    def _index(self, namespace: str) -> str:
+        return f"{self.prefix}{namespace}:__keys__"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        value = self.redis.execute("GET", self._key(namespace, key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        command = ["SET", self._key(namespace, key), json.dumps(value)]
+        if ttl:
+            command += ["PX", int(ttl * 1000)]
+        self.redis.pipeline(command, ["SADD", self._index(namespace), key])
+
+    def delete(self, namespace: str, key: str):
+        self.redis.pipeline(
+            ["DEL", self._key(namespace, key), self._list_key(namespace, key)],
+            ["SREM", self._index(namespace), key],
+        )
+
+    def keys(self, namespace: str) -> List[str]:
+        keys = self.redis.execute("SMEMBERS", self._index(namespace)) or []
+        if not keys:
+            return []
+        # Drop index entries whose values have expired
+        live = self.redis.pipeline(*(["EXISTS", self._key(namespace, key)] for key in keys))
+        expired = [key for key, exists in zip(keys, live) if not exists]
+        if expired:
+            self.redis.execute("SREM", self._index(namespace), *expired)
+        return [key for key, exists in zip(keys, live) if exists]
+
+    def purge_expired(self) -> int:
+        # Redis expires keys itself; stale index entries are dropped by keys()
+        return 0
+
+    def append(self, namespace: str, key: str, item: Any, max_items: int):
+        """Appends to a list, keeping only its last `max_items` entries."""
+        list_key = self._list_key(namespace, key)
+        self.redis.pipeline(["RPUSH", list_key, json.dumps(item)], ["LTRIM", list_key, -max_items, -1])
+
+    def get_list(self, namespace: str, key: str, last_n: Optional[int] = None) -> List:
+        items = self.redis.execute("LRANGE", self._list_key(namespace, key), -last_n if last_n else 0, -1) or []
+        return [json.loads(item) for item in items]
+
+
+async def run_inline(fn: Callable, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def state_runner(store) -> Callable[..., Awaitable]:
+    """
+    Returns `run(fn, *args)` for calling into `store` (or anything built on it)
+    from async code. SQLite and Redis calls block until the disk or socket
+    answers, up to the Redis socket timeout, so they run in a worker thread;
+    the memory backend never waits and is called inline.
+    """
+    return run_inline if isinstance(store, InMemoryStateStore) else asyncio.to_thread
+
+
+def create_state_store():
+    """Builds the store selected by STATE_BACKEND (`memory`, `sqlite` or `redis`)."""
+    backend = os.getenv("STATE_BACKEND", "memory")
+    if backend == "sqlite":
+        return SQLiteStateStore(os.getenv("STATE_STORE_PATH", DEFAULT_STATE_PATH))
+    if backend == "redis":
+        return RedisStateStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"), os.getenv("REDIS_PREFIX", "emailtest:"))
+    return InMemoryStateStore()
@@ -0,0 +1,111 @@
+"""
+Leveled, structured logging for the backend.
+
+Code logs named events with fields instead of formatted strings:
+
+    log = get_logger("chatbot")
+    log.debug("intent_detected", intent=intent, entities=entities)
+
+Each call checks the level before building anything, so a disabled DEBUG
+call on the hot path costs one comparison. Fields are only formatted when a
+record is actually written.
+
+LOG_LEVEL (DEBUG, INFO, WARNING, ERROR or OFF, default INFO) sets what is
+written and LOG_FORMAT picks `text` (key=value lines) or `json` (one object
+per line). Records go to stdout, like the print statements they replace.
+"""
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+ROOT_LOGGER = "emailtest"
+
+
+class StructuredFormatter(logging.Formatter):
+    """Renders a record's event and fields as key=value text or as a JSON object."""
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.json = fmt == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: Dict[str, Any] = getattr(record, "fields", {})
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds")
+        logger = record.name[len(ROOT_LOGGER) + 1:] or record.name
+        exception = self.formatException(record.exc_info) if record.exc_info else None
+        if self.json:
+            entry = {"ts": timestamp, "level": record.levelname, "logger": logger, "event": record.msg, **fields}
+            if exception:
+                entry["exception"] = exception
+            return json.dumps(entry, default=str)
+        pairs = " ".join(f"{key}={value!r}" if isinstance(value, str) and " " in value else f"{key}={value}"
+                         for key, value in fields.items())
+        line = f"{timestamp} {record.levelname:<7} {logger} {record.msg}" + (f" {pairs}" if pairs else "")
+        return f"{line}\n{exception}" if exception else line
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at emit time, so redirect_stdout still captures it."""
+
+    def emit(self, record: logging.LogRecord):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+class EventLogger:
+    """Thin wrapper over a stdlib logger taking an event name and keyword fields."""
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def enabled(self, level: int = logging.DEBUG) -> bool:
+        """For callers that would do extra work to compute their fields."""
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: bool = False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        """ERROR with the traceback of the exception being handled."""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Installs the structured handler on the backend's root logger, from LOG_LEVEL/LOG_FORMAT by default."""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers.clear()
+    root.propagate = False
+    if level == "OFF":
+        root.setLevel(logging.CRITICAL + 1)
+        return
+    handler = StdoutHandler()
+    handler.setFormatter(StructuredFormatter(fmt))
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+configure_logging()
@@ -0,0 +1,159 @@
+"""
+Cache of Gmail threads for reply drafting and sending.
+
+Drafting a reply uses the other messages of the email's thread as context,
+and sending one needs the original's Message-ID and References chain so the
+reply joins the same conversation. Both come from one `users.threads.get`
+call in metadata format (headers and snippets, no bodies), cached per
+(user, thread ID).
+
+Mailbox sync invalidates every thread its history deltas add messages to or
+delete messages from, and sending a reply invalidates the thread it joined.
+The TTL bounds staleness for threads outside the synced inbox. With a memory
+governor, each cached thread is also charged at its size, so threads compete
+for the global memory budget with the other per-user caches.
+"""
+import asyncio
+import html
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from async_clients import AsyncGmailClient
+from memory_governor import estimate_size
+
+THREAD_CACHE_SIZE = int(os.getenv("THREAD_CACHE_SIZE", "1024"))
+THREAD_CACHE_TTL = float(os.getenv("THREAD_CACHE_TTL", "600"))
+THREAD_HEADERS = ["From", "To", "Subject", "Date", "Message-ID", "References"]
+
+
+def thread_message(msg: Dict) -> Dict:
+    """Reduces a metadata-format message to what drafting and sending need."""
+    headers = {h["name"].lower(): h["value"] for h in msg.get("payload", {}).get("headers", [])}
+    return {
+        "id": msg["id"],
+        "sender": headers.get("from", ""),
+        "to": headers.get("to", ""),
+        "subject": headers.get("subject", ""),
+        "date": headers.get("date"),
+        "message_id": headers.get("message-id"),
+        "references": headers.get("references", ""),
+        "snippet": html.unescape(msg.get("snippet", "")),
+    }
+
+
+def summarize_thread(thread: Dict) -> Dict:
+    return {
+        "id": thread["id"],
+        "history_id": thread.get("historyId"),
+        "messages": [thread_message(msg) for msg in thread.get("messages", [])],
+    }
+
+
+class ThreadCache:
+    """LRU + TTL cache of summarized threads, with concurrent fetches of one thread shared."""
+
+    def __init__(self, max_entries: int = THREAD_CACHE_SIZE, ttl: float = THREAD_CACHE_TTL, governor=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._message_threads: Dict[tuple, str] = {}
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "deduplicated": 0, "invalidations": 0, "evictions": 0, "expirations": 0}
+        self.governor = governor
+        if governor is not None:
+            governor.register("threads", self._unlink)
+
+    def thread_id_for(self, user_id: str, message_id: str) -> Optional[str]:
+        """Thread ID of a message seen in a cached thread."""
+        return self._message_threads.get((user_id, message_id))
+
+    def cached(self, user_id: str, thread_id: str) -> Optional[Dict]:
+        key = (user_id, thread_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        fetched_at, thread = entry
+        if time.monotonic() - fetched_at >= self.ttl:
+            self._drop(key)
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        if self.governor is not None:
+            self.governor.touch("threads", key)
+        return thread
+
+    async def get(self, user_id: str, gmail: AsyncGmailClient, thread_id: str) -> Dict:
+        """Returns the summarized thread, fetching it on a miss."""
+        thread = self.cached(user_id, thread_id)
+        if thread is not None:
+            self.stats["hits"] += 1
+            return thread
+
+        key = (user_id, thread_id)
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.create_task(self._fetch(key, gmail))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["deduplicated"] += 1
+        # shield: one cancelled caller must not cancel the fetch others are waiting on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: tuple, gmail: AsyncGmailClient) -> Dict:
+        raw = await gmail.get_thread(key[1], format="metadata", metadataHeaders=THREAD_HEADERS)
+        thread = summarize_thread(raw)
+        self._store(key, thread)
+        return thread
+
+    def _store(self, key: tuple, thread: Dict):
+        self._drop(key)
+        self._entries[key] = (time.monotonic(), thread)
+        for msg in thread["messages"]:
+            self._message_threads[(key[0], msg["id"])] = thread["id"]
+        if self.governor is not None:
+            self.governor.charge("threads", key, estimate_size(thread))
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key: tuple) -> bool:
+        if not self._unlink(key):
+            return False
+        if self.governor is not None:
+            self.governor.release("threads", key)
+        return True
+
+    def _unlink(self, key: tuple) -> bool:
+        """Removes an entry without telling the governor (its eviction callback)."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for msg in entry[1]["messages"]:
+            self._message_threads.pop((key[0], msg["id"]), None)
+        return True
+
+    def invalidate(self, user_id: str, thread_ids: Optional[Iterable[str]] = None):
+        """Drops the given threads, or every cached thread of the user when `thread_ids` is None."""
+        if thread_ids is None:
+            thread_ids = [thread_id for (user, thread_id) in self._entries if user == user_id]
+        for thread_id in list(thread_ids):
+            if self._drop((user_id, thread_id)):
+                self.stats["invalidations"] += 1
+
+    def snapshot(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_ratio": self.stats["hits"] / lookups if lookups else None,
+        }
+
+
+def context_messages(thread: Dict, message_id: str, limit: int) -> List[Dict]:
+    """The thread's `limit` most recent messages other than `message_id`."""
+    others = [msg for msg in thread["messages"] if msg["id"] != message_id]
+    return others[-limit:] if limit else []
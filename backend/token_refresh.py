@@ -0,0 +1,212 @@
+"""
+OAuth access token refresh for stored Google credentials.
+
+Access tokens from the code flow live for about an hour. `TokenRefresher`
+keeps them fresh in two ways:
+
+- on demand: a request that finds its token expired (or within
+  TOKEN_EXPIRY_SKEW seconds of expiring) waits for a refresh. Concurrent
+  requests for the same user share one in-flight refresh instead of each
+  hitting the token endpoint.
+- proactively: tokens within TOKEN_REFRESH_MARGIN seconds of expiry are
+  refreshed in the background, both when a request notices and from a
+  ticker every TOKEN_REFRESH_INTERVAL seconds, so requests normally never
+  wait on the token endpoint. The ticker only covers users the `active`
+  callback reports as recently seen; idle users refresh on demand when
+  they come back.
+
+Refreshed tokens are handed to a `save` callback that persists them.
+Implicit-flow tokens carry no refresh token and are left alone until they
+expire.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+import httpx
+
+from http_pool import get_http_client
+from state_store import run_inline
+from structured_log import get_logger
+
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_REFRESH_INTERVAL = float(os.getenv("TOKEN_REFRESH_INTERVAL", "60"))
+TOKEN_EXPIRY_SKEW = float(os.getenv("TOKEN_EXPIRY_SKEW", "30"))
+
+log = get_logger("token_refresh")
+
+LoadCredentials = Callable[[str], Optional[Dict]]
+SaveCredentials = Callable[[str, Dict], None]
+# Runs a blocking load/save off the event loop (see state_store.state_runner)
+RunBlocking = Callable[..., Awaitable]
+
+
+class TokenRefreshError(Exception):
+    """Raised when a token cannot be refreshed; `reauthenticate` means the user has to sign in again."""
+
+    def __init__(self, message: str, reauthenticate: bool = False):
+        super().__init__(message)
+        self.reauthenticate = reauthenticate
+
+
+def expiry_from_now(expires_in: Optional[float]) -> Optional[str]:
+    """ISO-8601 UTC expiry for a token response's `expires_in`."""
+    if not expires_in:
+        return None
+    return (datetime.now(timezone.utc) + timedelta(seconds=float(expires_in))).isoformat()
+
+
+def seconds_until_expiry(creds: Dict) -> Optional[float]:
+    """Seconds left on the stored access token, or None when the expiry is unknown."""
+    expiry = creds.get("expiry")
+    if not expiry:
+        return None
+    return (datetime.fromisoformat(expiry) - datetime.now(timezone.utc)).total_seconds()
+
+
+class TokenRefresher:
+    """Single-flight, proactive refresh of per-user OAuth access tokens."""
+
+    def __init__(self, load: LoadCredentials, save: SaveCredentials, users: Callable[[], Iterable[str]],
+                 margin: float = TOKEN_REFRESH_MARGIN, interval: float = TOKEN_REFRESH_INTERVAL,
+                 skew: float = TOKEN_EXPIRY_SKEW, run: RunBlocking = run_inline,
+                 active: Callable[[str], bool] = lambda user_id: True):
+        self.load = load
+        self.save = save
+        self.users = users
+        self.active = active
+        self.run = run
+        self.margin = margin
+        self.interval = interval
+        self.skew = skew
+        self.stats = {
+            "refreshes": 0, "on_demand": 0, "proactive": 0, "deduplicated": 0,
+            "failures": 0, "refresh_seconds": 0.0,
+        }
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._ticker: Optional[asyncio.Task] = None
+        # Strong references, so background refreshes aren't garbage-collected mid-flight
+        self._background: Set[asyncio.Task] = set()
+
+    async def ensure_fresh(self, user_id: str, creds: Dict) -> Dict:
+        """Returns usable credentials, refreshing first if the token is (nearly) expired."""
+        remaining = seconds_until_expiry(creds)
+        if remaining is None or not creds.get("refresh_token"):
+            return creds
+        if remaining <= self.skew:
+            self.stats["on_demand"] += 1
+            return await self.refresh(user_id)
+        if remaining <= self.margin:
+            self.refresh_in_background(user_id)
+        return creds
+
+    async def refresh(self, user_id: str) -> Dict:
+        """Refreshes a user's token, joining the refresh already in flight if there is one."""
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        else:
+            self.stats["deduplicated"] += 1
+        # Shielded so one cancelled caller doesn't cancel the refresh for everyone else
+        return await asyncio.shield(task)
+
+    def refresh_in_background(self, user_id: str):
+        if user_id in self._inflight:
+            return
+        self.stats["proactive"] += 1
+        task = asyncio.create_task(self._refresh_quietly(user_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _refresh_quietly(self, user_id: str):
+        try:
+            await self.refresh(user_id)
+        except TokenRefreshError as e:
+            log.warning("token_refresh_failed", user_id=user_id, error=str(e))
+        except Exception as e:
+            log.exception("token_refresh_failed", user_id=user_id, error=str(e))
+
+    async def _refresh(self, user_id: str) -> Dict:
+        creds = await self.run(self.load, user_id)
+        if not creds or not creds.get("refresh_token"):
+            raise TokenRefreshError("No refresh token stored, please sign in again", reauthenticate=True)
+
+        start = time.perf_counter()
+        try:
+            response = await get_http_client("oauth").post(creds["token_uri"], data={
+                "grant_type": "refresh_token",
+                "refresh_token": creds["refresh_token"],
+                "client_id": creds["client_id"],
+                "client_secret": creds["client_secret"],
+            })
+        except httpx.HTTPError as e:
+            self.stats["failures"] += 1
+            raise TokenRefreshError(f"Token endpoint unreachable: {e}") from e
+        finally:
+            self.stats["refresh_seconds"] += time.perf_counter() - start
+
+        if response.status_code != 200:
+            self.stats["failures"] += 1
+            # invalid_grant (revoked or expired refresh token) comes back as 400/401
+            raise TokenRefreshError(f"Token refresh failed: {response.text}",
+                                    reauthenticate=response.status_code in (400, 401))
+
+        token_data = response.json()
+        updated = {
+            **creds,
+            "token": token_data["access_token"],
+            "expiry": expiry_from_now(token_data.get("expires_in")),
+        }
+        # Google may rotate the refresh token; keep the old one if it doesn't
+        if token_data.get("refresh_token"):
+            updated["refresh_token"] = token_data["refresh_token"]
+        await self.run(self.save, user_id, updated)
+        self.stats["refreshes"] += 1
+        log.debug("token_refreshed", user_id=user_id, expiry=updated["expiry"])
+        return updated
+
+    def start(self):
+        """Starts the proactive refresh ticker on the running event loop."""
+        if self._ticker is None and self.interval > 0:
+            self._ticker = asyncio.create_task(self._tick())
+
+    async def stop(self):
+        tasks = [*self._inflight.values(), *self._background]
+        if self._ticker is not None:
+            tasks.append(self._ticker)
+            self._ticker = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # A failed pass (e.g. the state store is briefly unavailable) must not end the ticker
+            try:
+                user_ids = [user_id for user_id in await self.run(self.users) if self.active(user_id)]
+            except Exception as e:
+                log.exception("token_refresh_tick_failed", error=str(e))
+                continue
+            for user_id in user_ids:
+                try:
+                    creds = await self.run(self.load, user_id) or {}
+                    remaining = seconds_until_expiry(creds)
+                    if creds.get("refresh_token") and remaining is not None and remaining <= self.margin:
+                        self.refresh_in_background(user_id)
+                except Exception as e:
+                    log.exception("token_refresh_tick_failed", user_id=user_id, error=str(e))
+
+    def snapshot(self) -> Dict:
+        refreshes = self.stats["refreshes"]
+        return {
+            **self.stats,
+            "avg_refresh_ms": self.stats["refresh_seconds"] / refreshes * 1000 if refreshes else None,
+            "in_flight": len(self._inflight),
+            "margin_seconds": self.margin,
+            "interval_seconds": self.interval,
+        }
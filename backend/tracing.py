@@ -0,0 +1,432 @@
+"""
+Request-scoped tracing with spans exported as OpenTelemetry JSON to a local file.
+
+Every HTTP request gets a root span (`TracingMiddleware`) and code inside it
+opens child spans for its stages:
+
+    with tracer.span("intent.detect", command_length=len(command)):
+        ...
+
+The current span lives in a context variable, so spans opened in tasks
+started by `asyncio.gather`/`create_task` nest under the span that started
+them. A `/chatbot/command` trace therefore shows intent detection, the
+mailbox sync, each Gmail call (`gmail messages.list`, `gmail batch`, ...) and
+each Mistral request as children of the request, with their own timings.
+
+Recent traces are kept in memory for /debug/traces. With TRACE_EXPORT_PATH
+set, each finished trace is also written as one line of OTLP/JSON
+(`{"resourceSpans": [...]}`, the format of the OpenTelemetry collector's file
+exporter) to that file. Any OTLP tool can load it, and no collector is
+needed. Writes happen on a background thread. File export is off by default,
+so nothing is written to disk unless asked for.
+
+Settings:
+- TRACING_ENABLED=0 turns every span into a no-op.
+- TRACE_SAMPLE_RATE samples a fraction of requests. An incoming W3C
+  `traceparent` header continues the caller's trace and keeps its sampling
+  decision.
+- TRACE_MIN_DURATION_MS exports only traces at least that slow.
+- TRACE_EXCLUDE_PATHS lists path prefixes that are not traced (by default the
+  /metrics scrape and /debug endpoints).
+- Responses carry the trace ID in `X-Trace-Id`.
+"""
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from structured_log import get_logger
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+# Empty (the default) disables the file export
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_MIN_DURATION_MS = float(os.getenv("TRACE_MIN_DURATION_MS", "0"))
+TRACE_FILE_MAX_MB = float(os.getenv("TRACE_FILE_MAX_MB", "50"))
+TRACE_RECENT = int(os.getenv("TRACE_RECENT", "200"))
+TRACE_EXCLUDE_PATHS = tuple(p for p in os.getenv("TRACE_EXCLUDE_PATHS", "/metrics,/debug/").split(",") if p)
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "emailtest-backend")
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+log = get_logger("tracing")
+
+
+class Trace:
+    """The spans of one trace collected in this process, exported together when the root ends."""
+
+    __slots__ = ("trace_id", "sampled", "spans", "finished")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+        self.finished = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "events",
+                 "status", "status_message", "is_root", "tracer")
+
+    def __init__(self, tracer: "Tracer", trace: Trace, name: str, parent_id: Optional[str], kind: int,
+                 attributes: Dict[str, Any], is_root: bool):
+        self.tracer = tracer
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.events: List[tuple] = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.is_root = is_root
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def set_error(self, error):
+        """Marks the span failed, from an exception or a message."""
+        self.status = STATUS_ERROR
+        self.status_message = str(error)[:500]
+        if isinstance(error, BaseException):
+            self.attributes["exception.type"] = type(error).__name__
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer._finish(self)
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": {"code": self.status, **({"message": self.status_message} if self.status_message else {})},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [{"timeUnixNano": str(ts), "name": name, "attributes": otlp_attributes(attrs)}
+                              for ts, name, attrs in self.events]
+        return span
+
+
+class NoopSpan:
+    """Stands in for a span when tracing is off or the trace isn't sampled."""
+
+    trace_id = None
+    duration_ms = 0.0
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def set_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class ActiveSpan:
+    """Context manager making a span current for its block; see `Tracer.span` and `Tracer.activate`."""
+
+    __slots__ = ("span", "end_on_exit", "token")
+
+    def __init__(self, span, end_on_exit: bool):
+        self.span = span
+        self.end_on_exit = end_on_exit
+
+    def __enter__(self):
+        if self.span is not NOOP_SPAN:
+            self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is NOOP_SPAN:
+            return False
+        _current.reset(self.token)
+        if self.end_on_exit:
+            if exc is not None:
+                self.span.set_error(exc)
+            self.span.end()
+        return False
+
+
+NOOP_CONTEXT = ActiveSpan(NOOP_SPAN, False)
+
+
+def otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes: Dict[str, Any]) -> List[Dict]:
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header."""
+    match = TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+class JsonFileExporter:
+    """Appends finished traces as OTLP/JSON lines from a background thread, rotating at TRACE_FILE_MAX_MB; no-op without a path."""
+
+    def __init__(self, path: str = TRACE_EXPORT_PATH, max_bytes: float = TRACE_FILE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=10000)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def export(self, spans: List[Span]):
+        if not self.enabled:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                self._write(spans)
+            except OSError as e:
+                self.dropped += 1
+                log.warning("trace_export_failed", path=self.path, error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _write(self, spans: List[Span]):
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "emailtest"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}, default=str)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self.exported += 1
+
+    def flush(self):
+        """Blocks until every queued trace is written (used by benchmarks and on shutdown)."""
+        if self._thread is not None:
+            self._queue.join()
+
+
+class Tracer:
+    def __init__(self, exporter: Optional[JsonFileExporter] = None, enabled: bool = TRACING_ENABLED,
+                 sample_rate: float = TRACE_SAMPLE_RATE, min_duration_ms: float = TRACE_MIN_DURATION_MS,
+                 recent: int = TRACE_RECENT):
+        self.exporter = exporter or JsonFileExporter()
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.min_duration_ms = min_duration_ms
+        self.recent: deque = deque(maxlen=recent)
+        self.stats = {"started": 0, "sampled_out": 0, "below_threshold": 0, "spans": 0}
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, traceparent: Optional[str] = None, **attributes):
+        """Starts a span under the current one without making it current; call `end()` on it."""
+        if not self.enabled:
+            return NOOP_SPAN
+        parent = _current.get()
+        if parent is not None:
+            if not parent.trace.sampled:
+                return NOOP_SPAN
+            return Span(self, parent.trace, name, parent.span_id, kind, attributes, is_root=False)
+        remote = parse_traceparent(traceparent)
+        if remote:
+            trace_id, parent_id, sampled = remote
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        self.stats["started"] += 1
+        if not sampled:
+            self.stats["sampled_out"] += 1
+        return Span(self, Trace(trace_id, sampled), name, parent_id, kind, attributes, is_root=True)
+
+    def span(self, name: str, kind: int = KIND_INTERNAL, **attributes) -> ActiveSpan:
+        """Runs the block in a new current span, marking it failed if the block raises."""
+        if not self.enabled:
+            return NOOP_CONTEXT
+        return ActiveSpan(self.start_span(name, kind, **attributes), True)
+
+    def activate(self, span) -> ActiveSpan:
+        """Makes a span from `start_span` current for the block, without ending it."""
+        return ActiveSpan(span, False)
+
+    def current_trace_id(self) -> Optional[str]:
+        span = _current.get()
+        return span.trace.trace_id if span is not None else None
+
+    def set_user(self, user_id: str):
+        """Tags the current span (a request's root, when called from its auth dependency) with the user."""
+        span = _current.get()
+        if span is not None:
+            span.set_attribute("enduser.id", user_id)
+
+    def _finish(self, span: Span):
+        trace = span.trace
+        if not trace.sampled:
+            return
+        self.stats["spans"] += 1
+        if not span.is_root:
+            if trace.finished:
+                # Outlived its request (e.g. a shared fetch another request still awaits)
+                self.exporter.export([span])
+            else:
+                trace.spans.append(span)
+            return
+        trace.finished = True
+        spans = trace.spans + [span]
+        if span.duration_ms < self.min_duration_ms:
+            self.stats["below_threshold"] += 1
+            return
+        self.recent.append(spans)
+        self.exporter.export(spans)
+
+    def snapshot(self, limit: int = 20, slowest: bool = False, viewer: Optional[str] = None) -> Dict:
+        """
+        Recent (or slowest recent) traces as span trees with durations. Given
+        a `viewer`, only traces tagged with that user's `enduser.id` are
+        included, since paths, message IDs and timings are theirs as well.
+        """
+        traces = list(self.recent)
+        if viewer is not None:
+            traces = [spans for spans in traces if trace_user(spans) == viewer]
+        if slowest:
+            traces.sort(key=lambda spans: spans[-1].duration_ms, reverse=True)
+        else:
+            traces.reverse()
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "export_path": os.path.abspath(self.exporter.path) if self.exporter.enabled else None,
+            "exported": self.exporter.exported,
+            "dropped": self.exporter.dropped,
+            "traces": [span_tree(spans) for spans in traces[:limit]],
+        }
+
+
+def trace_user(spans: List[Span]) -> Optional[str]:
+    """The `enduser.id` a trace's spans were tagged with, if any."""
+    for span in reversed(spans):
+        user = span.attributes.get("enduser.id")
+        if user is not None:
+            return user
+    return None
+
+
+def span_tree(spans: List[Span]) -> Dict:
+    """Nests a trace's spans under their parents, children in start order."""
+    nodes = {span.span_id: {
+        "name": span.name,
+        "span_id": span.span_id,
+        "duration_ms": round(span.duration_ms, 3),
+        "attributes": span.attributes,
+        **({"error": span.status_message} if span.status == STATUS_ERROR else {}),
+        "children": [],
+    } for span in sorted(spans, key=lambda s: s.start_ns)}
+    root = spans[-1]
+    for span in sorted(spans, key=lambda s: s.start_ns):
+        if span is not root and span.parent_id in nodes:
+            nodes[span.parent_id]["children"].append(nodes[span.span_id])
+    return {"trace_id": root.trace_id, **nodes[root.span_id]}
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    """ASGI middleware opening each HTTP request's root span and returning its trace ID in X-Trace-Id."""
+
+    def __init__(self, app, tracer: Tracer = tracer, exclude_paths: tuple = TRACE_EXCLUDE_PATHS):
+        self.app = app
+        self.tracer = tracer
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        span = self.tracer.start_span(f"{scope['method']} {scope['path']}", KIND_SERVER, headers.get("traceparent"),
+                                      **{"http.method": scope["method"], "http.target": scope["path"]})
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if span.trace.sampled:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", span.trace_id.encode())]
+            await send(message)
+
+        with self.tracer.activate(span):
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            except BaseException as e:
+                span.set_error(e)
+                raise
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.set_attribute("http.route", route)
+                if span.attributes.get("http.status_code", 500) >= 500:
+                    span.status = STATUS_ERROR
+                span.end()
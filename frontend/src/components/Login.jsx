@@ -13,12 +13,12 @@ const Login = ({ onLoginSuccess }) => {
                 console.log("[Frontend] Login successful, response:", response);
                 setIsLoading(true);
                 
-                // Send the access token directly to the backend
+                // Send the access token directly to the backend; withCredentials keeps its session cookie
                 const result = await axios.post('http://localhost:8000/auth/google', {
                     access_token: response.access_token,
                     token_type: response.token_type,
                     expires_in: response.expires_in
-                });
+                }, { withCredentials: true });
                 
                 if (result.data.status === 'success') {
                     console.log("[Frontend] Authentication successful!");
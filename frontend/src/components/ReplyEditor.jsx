@@ -24,6 +24,7 @@ const ReplyEditor = ({ email, onSend, onClose, isOpen }) => {
       const response = await axios.post('/api/ai/generate-reply', {
         subject: email.subject,
         content: email.snippet || email.body,
+        message_id: email.id, // lets the backend add the rest of the thread as context
         tone: 'professional' // You can make this configurable
       });
       